@@ -0,0 +1,274 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import api
+import zeitreihe
+from cohort import INPUT_FOLDER, META_CSV, cached_runs, ingest_reports, load_manifest, load_metadata, load_quarantine, load_report
+from taxon_index import update_index
+from timecube import load_cube
+
+# This script runs a local HTTP/JSON analysis service. It loads the cached cohort once, watches the
+# report folder for new Kraken2 reports and serves similarities, time series and proportions from memory.
+# It can be configured by changing the constants below.
+#
+# Endpunkte (alle GET, level = O/F/G/S/... oder leer für alle Level):
+#   /status
+#   /similarity/plants?level=G
+#   /similarity/replicates?level=G
+#   /similarity/temporal?level=G
+#   /timeseries?plant=Rotterdam&level=G&min_rel=0.06
+#   /proportions?taxa=Crassvirales,Carjivirus        (eine Gruppe pro Taxon)
+#   /proportions?group=Phagen:Caudoviricetes|Leviviricetes
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+HOST = "127.0.0.1"
+PORT = 8765
+WATCH_INTERVAL = 30            # Sekunden zwischen zwei Blicken in INPUT_FOLDER
+RESPONSE_CACHE_SIZE = 256
+# ============================================================
+
+
+class Snapshot:
+    """
+    Ein Stand der Kohorte: Reports, Metadaten und Taxon-Index. Wird nie verändert, sondern bei jeder
+    Änderung am Report-Ordner als Ganzes durch einen neuen Stand mit höherer Version ersetzt.
+    """
+
+    def __init__(self, version=0, reports=None, mtimes=None, metadata=None, index=None, quarantine=frozenset()):
+        self.version = version
+        self.reports = reports or {}
+        self.mtimes = mtimes or {}
+        self.metadata = metadata
+        self.index = index
+        self.quarantine = quarantine
+
+
+class CohortState:
+    """
+    Hält den aktuellen Snapshot und die daraus abgeleiteten Ergebnisse. Der Lock schützt nur das
+    Austauschen des Snapshots und die Cache-Einträge; gerechnet und geladen wird außerhalb, damit eine
+    langsame Anfrage die anderen nicht blockiert.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()   # höchstens eine Aktualisierung gleichzeitig
+        self.snapshot = Snapshot()
+        self._derived = {}
+        self._responses = OrderedDict()
+
+    def refresh(self):
+        """Übernimmt neue/geänderte Reports in einen neuen Snapshot. Gibt True zurück, wenn sich etwas geändert hat."""
+        with self.refresh_lock:
+            manifest = ingest_reports(INPUT_FOLDER, verbose=False)
+            quarantine = frozenset(load_quarantine())
+            current = {run: manifest[run]["mtime"] for run in cached_runs()}
+
+            old = self.snapshot
+            if current == old.mtimes and quarantine == old.quarantine and old.metadata is not None:
+                return False
+
+            # Unveränderte Reports werden aus dem alten Snapshot übernommen
+            reports = {run: old.reports[run] if old.mtimes.get(run) == mtime else load_report(run, with_names=True)
+                       for run, mtime in current.items()}
+            snapshot = Snapshot(old.version + 1, reports, current, load_metadata(META_CSV),
+                                update_index(INPUT_FOLDER, verbose=False), quarantine)
+
+            with self.lock:
+                self.snapshot = snapshot
+                self._derived.clear()
+                self._responses.clear()
+        print(f"Kohorte v{snapshot.version}: {len(snapshot.reports)} Reports im Speicher")
+        return True
+
+    def _memoize(self, cache, key, compute, max_size=None):
+        """
+        compute() läuft höchstens einmal pro key, außerhalb des Locks. Wer dasselbe Ergebnis gleichzeitig
+        braucht, wartet auf dasselbe Future. Fehler werden weitergereicht, aber nicht gecacht.
+        """
+        with self.lock:
+            future = cache.get(key)
+            owner = future is None
+            if owner:
+                future = cache[key] = Future()
+            elif isinstance(cache, OrderedDict):
+                cache.move_to_end(key)
+
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+                with self.lock:
+                    if cache.get(key) is future:
+                        del cache[key]
+            if max_size is not None:
+                with self.lock:
+                    while len(cache) > max_size:
+                        cache.popitem(last=False)
+        return future.result()
+
+    def derived(self, snapshot, key, compute):
+        """Memoisiert Zwischenergebnisse (z.B. Profile pro Level) eines Snapshots."""
+        return self._memoize(self._derived, (snapshot.version,) + key, compute)
+
+    def cached_response(self, snapshot, key, compute):
+        return self._memoize(self._responses, (snapshot.version,) + key,
+                             lambda: json.dumps(compute(), default=str).encode(), RESPONSE_CACHE_SIZE)
+
+
+STATE = CohortState()
+
+
+class UnknownEndpoint(Exception):
+    pass
+
+
+def _frame(df):
+    return json.loads(df.to_json(orient="split", date_format="iso"))
+
+
+def _summary(values):
+    return {
+        "mean": float(values.mean()),
+        "median": float(values.median()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "n": int(len(values)),
+    }
+
+
+def _profiles(snapshot, level):
+    return STATE.derived(snapshot, ("profiles", level), lambda: api.sample_profiles(level, snapshot.reports))
+
+
+def plant_similarity_matrix(snapshot, level):
+    return _frame(api.plant_similarity_matrix(level, snapshot.reports, snapshot.metadata))
+
+
+def pair_similarities(snapshot, level, mode):
+    sim_df = api.pair_similarities(level, mode, metadata=snapshot.metadata, profiles=_profiles(snapshot, level))
+    if mode == "replicate":
+        return {"summary": _summary(sim_df["Similarity"]), "pairs": _frame(sim_df)}
+
+    per_plant = sim_df.groupby("Plant")["Similarity"].agg(["mean", "median", "min", "max"])
+    return {"summary": _summary(sim_df["Similarity"]), "per_plant": _frame(per_plant), "pairs": _frame(sim_df)}
+
+
+def time_series(snapshot, plant, level, min_rel):
+    cube = None
+    if level is not None:
+        cube = STATE.derived(snapshot, ("timecube", level),
+                             lambda: load_cube(level, list(snapshot.reports), snapshot.metadata))
+    return _frame(api.time_series(plant, level, min_rel, cube=cube))
+
+
+def proportions(snapshot, groups):
+    per_sample, per_plant, per_date = api.proportions(groups, list(snapshot.reports), snapshot.metadata, snapshot.index)
+    mean = per_sample[list(groups)].mean().to_dict()
+    return {"per_plant": _frame(per_plant), "per_date": _frame(per_date), "mean": mean}
+
+
+def _level(params):
+    level = params.get("level", [""])[0].strip()
+    return level or None
+
+
+def _groups(params):
+    groups = {}
+    for taxon in ",".join(params.get("taxa", [])).split(","):
+        if taxon.strip():
+            groups[taxon.strip()] = {taxon.strip()}
+    for group in params.get("group", []):
+        name, _, members = group.partition(":")
+        groups[name.strip()] = {m.strip() for m in members.split("|") if m.strip()}
+    if not groups:
+        raise ValueError("Parameter 'taxa' oder 'group' fehlt")
+    return groups
+
+
+def route(path, params, snapshot):
+    if path == "/status":
+        return {"version": snapshot.version, "runs": len(snapshot.reports), "quarantined": sorted(snapshot.quarantine),
+                "cached_responses": len(STATE._responses), "reports_in_cache": len(load_manifest())}
+    if path == "/similarity/plants":
+        return plant_similarity_matrix(snapshot, _level(params))
+    if path == "/similarity/replicates":
+        return pair_similarities(snapshot, _level(params), "replicate")
+    if path == "/similarity/temporal":
+        return pair_similarities(snapshot, _level(params), "temporal")
+    if path == "/timeseries":
+        min_rel = float(params.get("min_rel", [zeitreihe.MIN_REL_ABUNDANCE])[0])
+        return time_series(snapshot, params["plant"][0], _level(params), min_rel)
+    if path == "/proportions":
+        return proportions(snapshot, _groups(params))
+    raise UnknownEndpoint(path)
+
+
+class AnalysisHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        key = (url.path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        start = time.perf_counter()
+        # Ein Snapshot pro Anfrage: ein gleichzeitiges refresh() ändert die Daten mitten in der Berechnung nicht
+        snapshot = STATE.snapshot
+
+        try:
+            if url.path == "/status":
+                body = json.dumps(route(url.path, params, snapshot)).encode()
+            else:
+                body = STATE.cached_response(snapshot, key, lambda: route(url.path, params, snapshot))
+            status = 200
+        except UnknownEndpoint:
+            body, status = json.dumps({"error": f"Unbekannter Endpunkt {url.path}"}).encode(), 404
+        except (KeyError, ValueError) as e:
+            body, status = json.dumps({"error": str(e)}).encode(), 400
+        except Exception as e:
+            body, status = json.dumps({"error": f"{type(e).__name__}: {e}"}).encode(), 500
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        print(f"{url.path} {status} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def watch_reports(interval=WATCH_INTERVAL):
+    while True:
+        time.sleep(interval)
+        try:
+            STATE.refresh()
+        except Exception as e:
+            print(f"⚠ Aktualisierung fehlgeschlagen: {e}")
+
+
+def main():
+    print("→ Lade Kohorte...")
+    STATE.refresh()
+
+    threading.Thread(target=watch_reports, daemon=True).start()
+
+    server = ThreadingHTTPServer((HOST, PORT), AnalysisHandler)
+    print(f"✔ Analyse-Server läuft auf http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import pandas as pd
+
+import plant_similarity
+import proportion
+import randomization
+import similarity
+from cohort import (CACHE_DIR, INPUT_FOLDER, META_CSV, abundance_matrix, cached_runs, ingest_reports, load_metadata,
+                    load_quarantine, load_report, relative_abundance_matrix)
+from replicates import pooled_abundance_matrix, pooled_relative_abundance_matrix, pooled_reports
+from taxon_index import update_index
+from timecube import load_cube
+from util import PLANT_NAME_MAP
+
+# This module is the compute-only entry point to the analyses: plant similarity, replicate/temporal pair
+# similarities, time series, group proportions and randomization, each as a function that returns pandas
+# objects. Nothing here imports matplotlib or seaborn (the plots live in plotting.py and the analysis
+# scripts only import it inside their main()), so scheduled jobs, pool workers and analysis_server.py
+# start quickly. Every function loads what it needs from the report cache; callers that keep the cohort
+# in memory (analysis_server.py) pass reports, metadata etc. explicitly. pooled=True switches to the
+# technical replicates pooled at read level (replicates.py, one sample per alias, cached).
+#
+# Verwendung:
+#   import api
+#   api.plant_similarity_matrix("G")
+#   api.plant_similarity_matrix("G", pooled=True)
+#   api.pair_similarities("S", "replicate")["Similarity"].mean()
+#   api.time_series("Rotterdam", "O")
+#   api.proportions({"Crassvirales": {"Crassvirales"}})
+#   api.randomized_similarity("ERR12510713", n_iter=100, seed=0)
+# Import-Zeit prüfen: python check_import_time.py
+
+
+def load_cohort(cache_dir=CACHE_DIR, include_quarantined=False, pooled=False):
+    """
+    Gecachte Reports (mit Namen) aller Runs: run → DataFrame. Neue Reports werden vorher übernommen.
+    pooled=True: ein gepoolter Report pro Alias, unter dem ersten Run des Alias.
+    """
+    ingest_reports(INPUT_FOLDER, cache_dir, verbose=False)
+    runs = cached_runs(cache_dir, include_quarantined=include_quarantined)
+    if pooled:
+        return pooled_reports(runs, cache_dir=cache_dir, with_names=True)
+    return {run: load_report(run, cache_dir, with_names=True) for run in runs}
+
+
+def sample_matrix(level="S", relative=True, runs=None, pooled=False):
+    """
+    Runs × Taxids auf einem Level aus dem Cache: reads_clade relativ zu den Virus-Reads (relative=True)
+    oder als Read-Zählungen. pooled=True: eine Zeile pro Alias aus den gepoolten Reads.
+    """
+    if runs is None:
+        ingest_reports(INPUT_FOLDER, verbose=False)
+        runs = cached_runs()
+    if pooled:
+        return (pooled_relative_abundance_matrix if relative else pooled_abundance_matrix)(runs, level)
+    return (relative_abundance_matrix if relative else abundance_matrix)(runs, level)
+
+
+def _reports_and_metadata(reports, metadata, pooled=False):
+    if reports is None:
+        reports = load_cohort(pooled=pooled)
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+    return reports, metadata
+
+
+def plant_profiles(level=None, reports=None, metadata=None, pooled=False):
+    """Mittleres Profil jeder Kläranlage (Kläranlagen × Taxon-Namen), wie in plant_similarity.py."""
+    reports, metadata = _reports_and_metadata(reports, metadata, pooled)
+    rels = {run: plant_similarity.direct_abundances(report, level) for run, report in reports.items()
+            if run in metadata.index}
+    rels = {run: rel for run, rel in rels.items() if rel is not None}
+
+    plants = [metadata.loc[run, "PLANT"] for run in rels]
+    long = pd.concat(rels.values(), keys=plants, names=["PLANT", "name"])
+    plant_sums = long.groupby(level=["PLANT", "name"]).sum().unstack("name", fill_value=0)
+    return plant_sums.div(pd.Series(plants).value_counts().reindex(plant_sums.index), axis=0)
+
+
+def plant_similarity_matrix(level=None, reports=None, metadata=None, pooled=False):
+    """Bray-Curtis-Ähnlichkeit zwischen allen Kläranlagen (Kläranlagen × Kläranlagen)."""
+    return plant_similarity.compute_similarity_matrix(plant_profiles(level, reports, metadata, pooled))
+
+
+def sample_profiles(level=None, reports=None, pooled=False):
+    """Relative Abundanzen pro Run (run → Series über Taxids), wie similarity.load_all_profiles."""
+    if reports is None:
+        reports = load_cohort(pooled=pooled)
+    profiles = ((run, similarity.profile_from_cached(report, level)) for run, report in reports.items())
+    return {run: profile for run, profile in profiles if profile is not None}
+
+
+def pair_similarities(level=None, mode="replicate", reports=None, metadata=None, profiles=None, pooled=False):
+    """
+    Paarweise Ähnlichkeiten wie in similarity.py: mode "replicate" (Replikate eines Samples) oder
+    "temporal" (aufeinanderfolgende Samples einer Kläranlage). Gibt die Tabelle der Paare zurück.
+    pooled=True geht nur mit "temporal" (gepoolt gibt es keine Replikat-Paare mehr).
+    """
+    if mode not in ("replicate", "temporal"):
+        raise ValueError(f"Unbekannter Modus: {mode}")
+    if pooled and mode == "replicate":
+        raise ValueError("Replikat-Paare gibt es nur ohne Pooling")
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+    if profiles is None:
+        profiles = sample_profiles(level, reports, pooled)
+
+    meta = metadata.reset_index(drop=True)
+    if pooled:
+        # Nur die vertretenden Runs, sonst zerreißen die weiteren Replikate die Folge der Samples
+        meta = meta[meta["ENA_RUN_ACCESSION"].isin(list(profiles))]
+    if mode == "replicate":
+        return similarity.compare_replicates(meta, profiles)
+    return similarity.compare_temporal(meta.copy(), profiles)
+
+
+def time_series(plant, level, min_rel=0.06, runs=None, metadata=None, cube=None):
+    """
+    Zeitreihe einer Kläranlage (Datum × Taxa, dazu "Other" und "Unassigned") aus dem Zeitreihen-Würfel.
+    plant darf auch der Anzeigename aus util.PLANT_NAME_MAP sein.
+    """
+    aliases = {alias: name for name, alias in PLANT_NAME_MAP.items()}
+    plant = aliases.get(plant, plant)
+    if level is None:
+        raise ValueError("Parameter 'level' fehlt")
+
+    if cube is None:
+        cube = load_cube(level, runs, metadata)
+    pivot_plot = cube.series(plant, min_rel)
+    if pivot_plot is None:
+        raise KeyError(f"Keine Daten für Kläranlage {plant}")
+    return pivot_plot
+
+
+def proportions(groups, runs=None, metadata=None, index=None):
+    """
+    Anteil der Taxon-Gruppen an den Virus-Reads. groups: Name → Menge von Taxon-Namen/Taxids.
+    Gibt (pro Sample, pro Kläranlage, pro Datum) zurück; quarantänierte Runs sind ausgeschlossen.
+    """
+    if index is None:
+        index = update_index(INPUT_FOLDER, verbose=False)
+    if runs is None:
+        runs = index["runs"].tolist()
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+    skip = set(load_quarantine())
+    runs = [run for run in runs if run not in skip]
+
+    props = proportion.group_proportions(index, groups, runs)
+    return proportion.proportion_tables(props, metadata)
+
+
+def randomized_similarity(run, level=None, n_iter=randomization.N_ITER, seed=None, report=None):
+    """
+    Ähnlichkeit zweier zufälliger Hälften der Reads eines Runs (wie randomization.py), n_iter Werte.
+    Zeigt, welche Ähnlichkeit allein durch das Sampling der Reads zu erwarten ist.
+    """
+    if report is None:
+        ingest_reports(INPUT_FOLDER, verbose=False)
+        report = load_report(run, with_names=True)
+    taxon_reads = randomization.taxon_reads_from_cached(report, level)
+    return pd.Series(randomization.randomize_similarity(taxon_reads, n_iter, seed), name=run)
@@ -1,9 +1,25 @@
+import os
+
 import pandas as pd
 import subprocess
 import sys
 
+from ena_kraken_automate import DATABASES, has_report, report_archive_path, report_folder
+from report_archive import append_report
+
 # This script automates the download of FASTQ files from ENA, runs Kraken2 in a Docker container,
 # and manages the output files for a batch of samples specified in a CSV file.
+# Finished reports are appended to the compressed report archive of their database (report_archive.py,
+# kraken2_run.archive, kraken2_run_<name>.archive); runs that already have a report for every database in
+# DATABASES are skipped. It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+ARCHIVE_REPORTS = True
+KEEP_TEXT_REPORTS = True       # False = Textdatei nach dem Archivieren löschen
+# ============================================================
+
 
 def main():
     if len(sys.argv) != 2:
@@ -24,6 +40,10 @@ def main():
     print(f"→ Gefundene {len(run_ids)} Runs\n")
 
     for run_accession in run_ids:
+        if all(has_report(database, run_accession) for database in DATABASES):
+            print(f"✔ Reports bereits vorhanden: {run_accession}")
+            continue
+
         print(f"====================================================")
         print(f" Starte Analyse für {run_accession}")
         print(f"====================================================")
@@ -33,6 +53,17 @@ def main():
             check=True
         )
 
+        if ARCHIVE_REPORTS:
+            for database in DATABASES:
+                report_path = os.path.join(report_folder(database), f"{run_accession}_report.txt")
+                if not os.path.exists(report_path):
+                    continue   # schon archiviert (Textdatei gelöscht)
+                archive_path = report_archive_path(database)
+                append_report(run_accession, report_path, archive_path)
+                print(f"✔ Report archiviert: {archive_path}")
+                if not KEEP_TEXT_REPORTS:
+                    os.remove(report_path)
+
     print("\n✔ Alle Samples verarbeitet!\n")
 
 
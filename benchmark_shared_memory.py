@@ -0,0 +1,82 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cohort import ingest_reports
+from shared import share_cohort, worker_arrays
+
+# This script compares two ways of giving process-pool workers the cohort abundance matrix: pickling the
+# matrix into every task versus attaching to one shared memory block. For a growing number of workers
+# it reports the private memory of each worker (memory that is not shared with other processes) and the
+# wall time. With shared memory the private memory per worker should stay flat.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXON_LEVEL = None             # None = alle Taxa (größte Matrix)
+WORKER_COUNTS = [1, 2, 4]
+TASKS_PER_WORKER = 2
+# ============================================================
+
+
+def private_memory_mb():
+    """Private (nicht geteilte) Seiten des aktuellen Prozesses laut /proc/self/smaps_rollup."""
+    total = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                total += int(line.split()[1])
+    return total / 1024
+
+
+def _work(counts, seed):
+    # Liest die ganze Matrix, wie es z.B. Permutationen oder Rarefaction tun
+    rng = np.random.default_rng(seed)
+    rows = rng.permutation(counts.shape[0])
+    return float((counts[rows] > 0).sum()), os.getpid(), private_memory_mb()
+
+
+def _task_pickled(args):
+    counts, seed = args
+    return _work(counts, seed)
+
+
+def _task_shared(seed):
+    return _work(worker_arrays()["counts"], seed)
+
+
+def run(mode, workers, counts, shared):
+    seeds = list(range(workers * TASKS_PER_WORKER))
+    start = time.perf_counter()
+    if mode == "pickle":
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_task_pickled, [(counts, seed) for seed in seeds]))
+    else:
+        with shared.pool(workers) as pool:
+            results = list(pool.map(_task_shared, seeds))
+    elapsed = time.perf_counter() - start
+
+    per_worker = pd.DataFrame(results, columns=["value", "pid", "private_mb"]).groupby("pid")["private_mb"].max()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "private_mb_per_worker": per_worker.mean(),
+        "private_mb_total": per_worker.sum(),
+        "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    ingest_reports(verbose=False)
+    shared, runs, taxids, _ = share_cohort(taxon_level=TAXON_LEVEL)
+    with shared:
+        counts = shared.arrays["counts"]
+        print(f"Matrix: {counts.shape[0]} Runs × {counts.shape[1]} Taxa ({counts.nbytes / 2**20:.1f} MB)\n")
+
+        results = [run(mode, workers, counts, shared) for workers in WORKER_COUNTS for mode in ("pickle", "shared")]
+
+    print(pd.DataFrame(results).round(2).to_string(index=False))
@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cohort import (CACHE_DIR, INPUT_FOLDER, VIRUSES_TAXID, abundance_matrix, cached_runs, derived_path,
+                    ingest_reports, load_taxa, save_derived)
+from taxon_index import INDEX_FILE, parents, update_index
+
+# This module re-estimates species (or genus) abundances the way Bracken does: reads that Kraken2 could
+# only place at a higher node (genus, family, ...) are redistributed to the species below that node,
+# in proportion to each species' abundance in the sample and the probability that a read from that species
+# ends up at that node. The probabilities come from a Bracken k-mer distribution file of the Kraken2 database;
+# without one, a stand-in with equal probabilities is generated from the cohort's taxonomy tree.
+# The redistribution runs for all reports at once as sparse matrix products and is cached per cohort.
+#
+# Verwendung:
+#   python bracken.py --level S
+#   python bracken.py --level G --kmer-distrib database150mers.kmer_distrib
+#
+# Weitergenutzt wird das Ergebnis über cohort.abundance_matrix(..., value="bracken")
+# bzw. COUNT_VALUE = "bracken" in cohort.py.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+KMER_DISTRIB = None            # z.B. "k2_viral/database150mers.kmer_distrib"; None = Stand-in aus dem Baum
+LEVEL = "S"
+THRESHOLD = 10                 # Taxa mit weniger Reads erhalten nichts (wie bracken -t)
+MAX_DEPTH = 64
+# ============================================================
+
+STANDIN_FILE = "standin.kmer_distrib"
+
+
+def _ancestor_pairs(index, taxids, max_depth=MAX_DEPTH):
+    """(Nachfahre, echter Vorfahre) für alle taxids, bis einschließlich Viruses, ohne root."""
+    children, ancestors = [], []
+    current = np.asarray(taxids, dtype=np.int64)
+    origin = current
+    for _ in range(max_depth):
+        keep = current != VIRUSES_TAXID
+        current, origin = parents(index, current[keep]), origin[keep]
+        valid = (current > 1)
+        current, origin = current[valid], origin[valid]
+        if not len(current):
+            break
+        children.append(origin)
+        ancestors.append(current)
+    if not children:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(children), np.concatenate(ancestors)
+
+
+def _targets(taxids, level, cache_dir=CACHE_DIR):
+    taxa = load_taxa(cache_dir)
+    ranks = taxa["rank_code"].reindex(taxids).to_numpy()
+    return np.asarray(taxids)[ranks == level]
+
+
+def _level_of(index, taxids, level, cache_dir=CACHE_DIR):
+    """Taxon auf `level` oberhalb jeder taxid (oder die taxid selbst), -1 wenn es keins gibt."""
+    taxa = load_taxa(cache_dir)
+    taxids = np.asarray(taxids, dtype=np.int64)
+    result = np.full(len(taxids), -1, dtype=np.int64)
+    current = taxids.copy()
+    for _ in range(MAX_DEPTH):
+        open_ = (result < 0) & (current > 0)
+        if not open_.any():
+            break
+        hit = open_ & (taxa["rank_code"].reindex(current).to_numpy() == level)
+        result[hit] = current[hit]
+        current = np.where(open_ & ~hit, parents(index, current), -1)
+    return result
+
+
+def write_standin_distribution(index, path, cache_dir=CACHE_DIR):
+    """
+    Schreibt eine k-mer-Verteilung im Bracken-Format (mapped_taxid → genome:kmers:total) mit gleichen
+    Wahrscheinlichkeiten für alle Vorfahren jeder Spezies. Damit wird proportional zur Abundanz
+    der Spezies verteilt, ohne Kenntnis der Genome.
+    """
+    species = _targets(index["tree_taxid"], "S", cache_dir)
+    genomes, mapped = _ancestor_pairs(index, species)
+    genomes, mapped = np.concatenate([species, genomes]), np.concatenate([species, mapped])
+
+    table = pd.DataFrame({"mapped": mapped, "entry": [f"{g}:1:1" for g in genomes]})
+    lines = table.groupby("mapped")["entry"].agg(" ".join)
+    with open(path, "w") as f:
+        f.write("mapped_taxid\tgenomes_taxids:kmers_mapped:total_genome_kmers\n")
+        for taxid, entries in lines.items():
+            f.write(f"{taxid}\t{entries}\n")
+
+
+def load_kmer_distribution(path):
+    """Liest eine Bracken-k-mer-Verteilung als Tabelle (mapped_taxid, genome_taxid, Anteil)."""
+    mapped, genomes, kmers, totals = [], [], [], []
+    with open(path) as f:
+        next(f)
+        for line in f:
+            taxid, _, entries = line.rstrip("\n").partition("\t")
+            for entry in entries.split():
+                genome, mapped_kmers, total_kmers = entry.split(":")
+                mapped.append(int(taxid))
+                genomes.append(int(genome))
+                kmers.append(int(mapped_kmers))
+                totals.append(int(total_kmers))
+    return pd.DataFrame({
+        "mapped_taxid": np.array(mapped, dtype=np.int64),
+        "genome_taxid": np.array(genomes, dtype=np.int64),
+        "kmers": np.array(kmers, dtype=np.float64),
+        "total": np.array(totals, dtype=np.float64),
+    })
+
+
+def _distribution_path(kmer_distrib, index, cache_dir):
+    if kmer_distrib is not None:
+        return kmer_distrib
+    path = os.path.join(cache_dir, STANDIN_FILE)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(index_path):
+        write_standin_distribution(index, path, cache_dir)
+    return path
+
+
+def transfer_matrix(index, distribution, level, targets, nodes, cache_dir=CACHE_DIR):
+    """
+    Sparse Matrix Knoten × Ziel-Taxa: P(Read landet an Knoten | stammt aus Ziel-Taxon), nur für
+    Knoten echt oberhalb des Ziel-Taxons. Genome werden dem Taxon auf `level` darüber zugeordnet.
+    """
+    distribution = distribution.assign(target=_level_of(index, distribution["genome_taxid"].to_numpy(), level, cache_dir))
+    per_target = distribution[distribution["target"] > 0].groupby(["mapped_taxid", "target"])[["kmers", "total"]].sum()
+    per_target = per_target.reset_index()
+
+    child, ancestor = _ancestor_pairs(index, targets)
+    above = pd.DataFrame({"target": child, "mapped_taxid": ancestor})
+    per_target = per_target.merge(above, on=["mapped_taxid", "target"])
+
+    row = pd.Index(nodes).get_indexer(per_target["mapped_taxid"])
+    col = pd.Index(targets).get_indexer(per_target["target"])
+    keep = (row >= 0) & (col >= 0)
+    weights = (per_target["kmers"] / per_target["total"]).to_numpy()
+    return sparse.csr_matrix((weights[keep], (row[keep], col[keep])), shape=(len(nodes), len(targets)))
+
+
+def redistribute(direct, clade, transfer, threshold=THRESHOLD):
+    """
+    Bracken-Schritt für alle Runs gleichzeitig. direct: Runs × Knoten (reads_direct), clade: Runs × Ziel-Taxa
+    (reads_clade), transfer: Knoten × Ziel-Taxa. Reads eines Knotens gehen an die Ziel-Taxa darunter im
+    Verhältnis P(Knoten | Taxon) · Abundanz. Wie bei Bracken fallen weg: Ziel-Taxa unter threshold samt
+    ihren Reads und die Reads von Knoten ohne abundantes Ziel-Taxon darunter (sie liegen auf keinem Taxon
+    des Levels, wie in abundance_matrix ohne Umverteilung).
+    """
+    abundance = np.where(clade >= threshold, clade, 0).astype(np.float64)
+    expected = (transfer @ abundance.T).T                    # Runs × Knoten
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(expected > 0, direct / expected, 0)
+    added = abundance * (transfer.T @ share.T).T              # Runs × Ziel-Taxa
+    return np.rint(abundance + added).astype(np.int64)
+
+
+def redistributed_matrix(runs=None, level=LEVEL, cache_dir=CACHE_DIR, kmer_distrib=KMER_DISTRIB):
+    """Umverteilte Read-Zählungen Runs × Taxa auf `level`, gecacht pro Kohorte und k-mer-Verteilung."""
+    if runs is None:
+        runs = cached_runs(cache_dir)
+    runs = list(runs)
+
+    index = update_index(INPUT_FOLDER, cache_dir, verbose=False)
+    distribution_path = _distribution_path(kmer_distrib, index, cache_dir)
+    stat = os.stat(distribution_path)
+    key = hashlib.sha1(f"{os.path.abspath(distribution_path)}:{stat.st_size}:{stat.st_mtime}".encode()).hexdigest()[:8]
+
+    # Die Verteilung geht in den Hash ein, nicht ins Präfix: so ersetzt save_derived ältere Stände
+    path = derived_path(f"bracken_{level}", runs, cache_dir, extra=key)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return pd.DataFrame(data["counts"], index=pd.Index(data["runs"], name="run"),
+                                columns=pd.Index(data["taxids"], name="ncbi_taxid"))
+
+    clade = abundance_matrix(runs, level, value="reads_clade", cache_dir=cache_dir)
+    direct = abundance_matrix(runs, None, value="reads_direct", cache_dir=cache_dir)
+    targets, nodes = clade.columns.to_numpy(), direct.columns.to_numpy()
+
+    transfer = transfer_matrix(index, load_kmer_distribution(distribution_path), level, targets, nodes, cache_dir)
+    counts = redistribute(direct.to_numpy(), clade.to_numpy(), transfer)
+
+    save_derived(path, counts=counts, runs=np.array(runs, dtype="U32"), taxids=targets)
+    return pd.DataFrame(counts, index=pd.Index(runs, name="run"), columns=pd.Index(targets, name="ncbi_taxid"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bracken-artige Umverteilung der Reads auf Spezies/Gattungen")
+    parser.add_argument("--level", default=LEVEL, help="Ziel-Level (S oder G)")
+    parser.add_argument("--kmer-distrib", default=KMER_DISTRIB, help="Bracken k-mer-Verteilung der Datenbank")
+    args = parser.parse_args()
+
+    ingest_reports(verbose=False)
+    runs = cached_runs()
+    before = abundance_matrix(runs, args.level)
+    after = redistributed_matrix(runs, args.level, kmer_distrib=args.kmer_distrib)
+
+    gained = (after.sum(axis=1) / before.sum(axis=1).replace(0, np.nan)).describe()
+    print(f"✔ {after.shape[0]} Reports, {after.shape[1]} Taxa auf Level {args.level}")
+    print(f"Reads auf Level {args.level} nach / vor Umverteilung:\n{gained.round(3).to_string()}\n")
+
+    names = load_taxa()["name"]
+    top = after.sum().sort_values(ascending=False).head(15)
+    table = pd.DataFrame({"name": names.reindex(top.index), "vorher": before.sum().reindex(top.index), "nachher": top})
+    print(table.to_string())
+
+
+if __name__ == "__main__":
+    main()
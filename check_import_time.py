@@ -0,0 +1,92 @@
+import argparse
+import subprocess
+import sys
+
+# This script measures how long importing the analysis modules takes, using `python -X importtime` in a
+# fresh interpreter per module. It reports the cumulative import time and the slowest imported packages,
+# and fails (exit code 1) if a module exceeds IMPORT_TIME_TARGET_MS or pulls in one of the plotting
+# packages in FORBIDDEN. Run it after changing imports so scheduled jobs and workers keep starting fast.
+#
+# Verwendung:
+#   python check_import_time.py
+#   python check_import_time.py api similarity --top 10
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+MODULES = ["api", "cohort", "similarity", "plant_similarity", "randomization", "zeitreihe", "proportion",
+           "timecube", "analysis_server", "ordination", "permanova", "diversity", "distance_decay"]
+IMPORT_TIME_TARGET_MS = 800    # pro Modul, gemessen auf dem Analyse-Rechner (1 CPU)
+FORBIDDEN = ["matplotlib", "seaborn"]
+REPEATS = 3                    # das Minimum zählt; der erste Lauf liest oft noch von der Platte
+TOP_N = 5
+# ============================================================
+
+
+def import_times(module):
+    """Ein Import in einem frischen Interpreter: Liste aus (Paket, eigene µs, kumulative µs)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Import von {module} fehlgeschlagen:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, package = line[len("import time:"):].split("|")
+        rows.append((package.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(module, repeats=REPEATS):
+    """Bester von repeats Läufen: (kumulative ms, Zeilen dieses Laufs)."""
+    best = None
+    for _ in range(repeats):
+        rows = import_times(module)
+        total = next(cumulative for package, _, cumulative in reversed(rows) if package == module)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    return best[0] / 1000, best[1]
+
+
+def top_packages(rows, top_n=TOP_N):
+    """Die teuersten Pakete: eigene Import-Zeit aller Untermodule, summiert pro Paket."""
+    totals = {}
+    for package, self_us, _ in rows:
+        root = package.split(".")[0]
+        totals[root] = totals.get(root, 0) + self_us
+    return sorted(totals.items(), key=lambda item: -item[1])[:top_n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-Zeit der Analyse-Module prüfen")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--target-ms", type=float, default=IMPORT_TIME_TARGET_MS)
+    parser.add_argument("--top", type=int, default=TOP_N)
+    args = parser.parse_args()
+
+    failed = []
+    for module in args.modules:
+        total_ms, rows = measure(module)
+        loaded = {package.split(".")[0] for package, _, _ in rows}
+        forbidden = [package for package in FORBIDDEN if package in loaded]
+
+        status = "✔"
+        if total_ms > args.target_ms or forbidden:
+            status = "⚠"
+            failed.append(module)
+        print(f"{status} {module}: {total_ms:.0f} ms" + (f" (lädt {', '.join(forbidden)})" if forbidden else ""))
+        for package, self_us in top_packages(rows, args.top):
+            print(f"    {package:<20} {self_us / 1000:6.0f} ms")
+
+    print()
+    if failed:
+        print(f"⚠ {len(failed)} Module über {args.target_ms:.0f} ms oder mit Plot-Paketen: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✔ Alle {len(args.modules)} Module unter {args.target_ms:.0f} ms und ohne {', '.join(FORBIDDEN)}")
+
+
+if __name__ == "__main__":
+    main()
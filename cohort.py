@@ -0,0 +1,516 @@
+import hashlib
+import json
+import os
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from report_archive import ARCHIVE_PATH, ReportArchive
+from taxonomy import INDEX_DIR as TAXONOMY_DIR, RANK_CODES, TAXDUMP_DIR, fingerprint, load_taxonomy
+
+# This module parses every Kraken2 report once into a compact on-disk cache and streams the
+# cached reports in blocks that fit into a configurable memory budget. The analysis scripts use it
+# for their out-of-core path, so memory no longer grows with the number of runs.
+# While parsing, each report gets QC statistics; reports failing QC end up in a quarantine index
+# that the analysis scripts skip automatically. Reports are read from INPUT_FOLDER and from the compressed
+# report archive (report_archive.py); a text file in the folder takes precedence over its archived copy.
+# If a local NCBI taxdump is available (taxonomy.py), every cached row also gets its full lineage as taxids,
+# and rank filters (rank_rows) then go by the taxdump's lineage instead of Kraken2's rank codes.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+INPUT_FOLDER = "kraken2_run"
+META_CSV = "samples.CSV"
+CACHE_DIR = "report_cache"
+MEMORY_BUDGET_MB = 256
+BLOCK_OVERHEAD = 4             # pandas-Zwischenergebnisse brauchen grob das Vierfache der Rohdaten
+COUNT_VALUE = "reads_clade"    # "bracken" = nach Bracken-Art umverteilte Reads (bracken.py)
+
+MIN_TOTAL_READS = 1_000_000    # unclassified + root
+QUARANTINE_MANUAL = {}         # run → Grund, für Fälle, die die QC nicht erkennt
+# ============================================================
+
+REPORT_COLUMNS = ["percent", "reads_clade", "reads_direct", "rank_code", "ncbi_taxid", "name"]
+REPORT_SUFFIX = "_report.txt"
+MANIFEST_FILE = "manifest.json"
+TAXA_FILE = "taxa.tsv"
+QUARANTINE_FILE = "quarantine.json"
+VIRUSES_TAXID = 10239
+
+_taxa_cache = {}
+
+
+def run_id(filename):
+    return os.path.basename(filename).replace(REPORT_SUFFIX, "")
+
+
+def list_report_files(input_folder=INPUT_FOLDER, reports_to_use=None, reports_to_skip=None):
+    all_files = sorted(f for f in os.listdir(input_folder) if f.endswith(REPORT_SUFFIX))
+    return _select_files(all_files, reports_to_use, reports_to_skip)
+
+
+def _select_files(all_files, reports_to_use=None, reports_to_skip=None):
+    if reports_to_skip:
+        all_files = [f for f in all_files if f not in reports_to_skip]
+
+    if reports_to_use:
+        return [f for f in all_files if f in reports_to_use]
+    return all_files
+
+
+def parse_kraken2_report(path):
+    """
+    Liest einen kompletten Kraken2-Report ein und ergänzt Baumtiefe und Eltern-Taxid
+    aus der Einrückung der Namensspalte.
+    """
+    df = pd.read_csv(
+        path,
+        sep="\t",
+        header=None,
+        names=REPORT_COLUMNS,
+        dtype={"name": str, "rank_code": str},
+        keep_default_na=False,
+    )
+
+    names = df["name"]
+    stripped = names.str.lstrip(" ")
+    df["depth"] = ((names.str.len() - stripped.str.len()) // 2).astype(np.int16)
+    df["name"] = stripped.str.rstrip()
+
+    taxids = df["ncbi_taxid"].to_numpy()
+    parents = np.full(len(df), -1, dtype=np.int64)
+    stack = []
+    for i, depth in enumerate(df["depth"].to_numpy()):
+        del stack[depth:]
+        if stack:
+            parents[i] = stack[-1]
+        stack.append(taxids[i])
+    df["parent_taxid"] = parents
+
+    return df
+
+
+def report_qc(df):
+    """
+    QC-Kennzahlen eines geparsten Reports. total_reads stammt aus unclassified + root
+    (Tiefe 0), nicht aus der Summe über alle Zeilen, die verschachtelte Kladen mehrfach zählt.
+    """
+    top = df["depth"] == 0
+    total_reads = int(df.loc[top, "reads_clade"].sum())
+    viruses = df["reads_clade"][df["ncbi_taxid"] == VIRUSES_TAXID]
+    virus_reads_total = int(viruses.iloc[0]) if not viruses.empty else 0
+
+    return {
+        "total_reads": total_reads,
+        "virus_reads": virus_reads_total,
+        "viral_fraction": virus_reads_total / total_reads if total_reads else 0.0,
+        "taxa_count": int((~top).sum()),
+        # Bei vollständigen Reports ergeben die direkten Reads aller Zeilen genau die Gesamtzahl
+        "complete": bool(df["reads_direct"].sum() == total_reads),
+        "indent_ok": bool((np.diff(df["depth"].to_numpy()) <= 1).all()),
+    }
+
+
+def _cache_path(cache_dir, run):
+    return os.path.join(cache_dir, f"{run}.npz")
+
+
+def load_manifest(cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest, cache_dir):
+    tmp = os.path.join(cache_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(cache_dir, MANIFEST_FILE))
+
+
+def report_sources(input_folder=INPUT_FOLDER, archive_path=ARCHIVE_PATH):
+    """
+    run → (Größe, mtime, Pfad) aller verfügbaren Reports. Pfad ist None für Reports, die nur im
+    Archiv liegen; Größe und mtime sind dann die der archivierten Textdatei.
+    """
+    sources = {}
+    archive = ReportArchive(archive_path)
+    for run in archive.runs():
+        size, mtime = archive.stat(run)
+        sources[run] = (size, mtime, None)
+    if os.path.isdir(input_folder):
+        for report in list_report_files(input_folder):
+            path = os.path.join(input_folder, report)
+            stat = os.stat(path)
+            sources[run_id(report)] = (stat.st_size, stat.st_mtime, path)
+    return dict(sorted(sources.items()))
+
+
+def list_runs(input_folder=INPUT_FOLDER, reports_to_use=None, reports_to_skip=None, archive_path=ARCHIVE_PATH):
+    """Wie list_report_files, aber als Runs und einschließlich der Reports, die nur im Archiv liegen."""
+    files = [f"{run}{REPORT_SUFFIX}" for run in report_sources(input_folder, archive_path)]
+    return [run_id(f) for f in _select_files(files, reports_to_use, reports_to_skip)]
+
+
+def report_file(run, input_folder=INPUT_FOLDER, archive_path=ARCHIVE_PATH):
+    """Pfad der Textdatei oder, wenn der Run nur archiviert ist, der Report als Datei-Objekt (z.B. für pd.read_csv)."""
+    path = os.path.join(input_folder, f"{run}{REPORT_SUFFIX}")
+    if os.path.exists(path):
+        return path
+    archive = ReportArchive(archive_path)
+    if run not in archive:
+        raise FileNotFoundError(f"Kein Report für {run} in {input_folder}/ oder {archive_path}")
+    return archive.open(run)
+
+
+def read_report(run, input_folder=INPUT_FOLDER, archive_path=ARCHIVE_PATH):
+    """Parst den Report eines Runs aus dem Ordner oder, falls dort nicht vorhanden, aus dem Archiv."""
+    return parse_kraken2_report(report_file(run, input_folder, archive_path))
+
+
+def lineage_arrays(taxonomy, taxids):
+    """Vorfahren-Taxid pro Zeile und Rang (lineage_<rang>, -1 = kein Vorfahre auf dem Rang)."""
+    lineage = taxonomy.lineage_of(taxids)
+    return {f"lineage_{rank}": lineage[:, i] for i, rank in enumerate(taxonomy.lineage_ranks)}
+
+
+def _attach_lineage(taxonomy, cache_dir, run):
+    """Ersetzt die Lineage-Spalten eines gecachten Reports, ohne den Report neu zu parsen."""
+    with np.load(_cache_path(cache_dir, run)) as data:
+        arrays = {key: data[key] for key in data.files if not key.startswith("lineage_")}
+    if taxonomy is not None:
+        arrays.update(lineage_arrays(taxonomy, arrays["ncbi_taxid"]))
+    np.savez(_cache_path(cache_dir, run), **arrays)
+    return int(sum(a.nbytes for a in arrays.values()))
+
+
+def ingest_reports(input_folder=INPUT_FOLDER, cache_dir=CACHE_DIR, verbose=True, meta_csv=META_CSV,
+                   archive_path=ARCHIVE_PATH, taxdump_dir=TAXDUMP_DIR, taxonomy_dir=TAXONOMY_DIR):
+    """
+    Überführt neue oder geänderte Reports in den Cache (eine .npz-Datei pro Run), berechnet
+    dabei die QC-Kennzahlen und aktualisiert Manifest und Quarantäne-Index. Lineages kommen aus
+    dem taxdump in taxdump_dir (Index in taxonomy_dir), falls vorhanden.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    taxa = load_taxa(cache_dir)
+    new_taxa = []
+    changed = False
+    archive = None
+    taxonomy = load_taxonomy(taxdump_dir, taxonomy_dir, verbose=verbose)
+    lineage_key = fingerprint(taxonomy)
+
+    sources = report_sources(input_folder, archive_path)
+    for run, (size, mtime, path) in sources.items():
+        entry = manifest.get(run)
+        if entry and entry["size"] == size and entry["mtime"] == mtime and "qc" in entry:
+            if entry.get("lineage") != lineage_key and "error" not in entry["qc"]:
+                # Neuer taxdump: nur die Lineage-Spalten austauschen
+                entry.update(nbytes=_attach_lineage(taxonomy, cache_dir, run), lineage=lineage_key)
+                changed = True
+            continue
+
+        if verbose:
+            print(f"Cache {path or f'{archive_path}:{run}'}")
+        entry = {"size": size, "mtime": mtime, "rows": 0, "nbytes": 0}
+        try:
+            if path is None and archive is None:
+                archive = ReportArchive(archive_path)
+            df = parse_kraken2_report(path if path is not None else archive.open(run))
+            arrays = {
+                "ncbi_taxid": df["ncbi_taxid"].to_numpy(np.int64),
+                "parent_taxid": df["parent_taxid"].to_numpy(np.int64),
+                "depth": df["depth"].to_numpy(np.int16),
+                "rank_code": df["rank_code"].to_numpy("U3"),
+                "reads_clade": df["reads_clade"].to_numpy(np.int64),
+                "reads_direct": df["reads_direct"].to_numpy(np.int64),
+            }
+            if taxonomy is not None:
+                arrays.update(lineage_arrays(taxonomy, arrays["ncbi_taxid"]))
+        except (ValueError, TypeError, pd.errors.ParserError) as e:
+            entry["qc"] = {"error": str(e).strip()}
+            manifest[run] = entry
+            changed = True
+            continue
+
+        np.savez(_cache_path(cache_dir, run), **arrays)
+        new_taxa.append(df[["ncbi_taxid", "rank_code", "name"]])
+
+        entry.update(rows=len(df), nbytes=int(sum(a.nbytes for a in arrays.values())), qc=report_qc(df),
+                     lineage=lineage_key)
+        manifest[run] = entry
+        changed = True
+
+    # Reports, die weder im Ordner noch im Archiv liegen
+    for run in [run for run in manifest if run not in sources]:
+        del manifest[run]
+        if os.path.exists(_cache_path(cache_dir, run)):
+            os.remove(_cache_path(cache_dir, run))
+        changed = True
+
+    if new_taxa:
+        taxa = pd.concat([taxa.reset_index()] + new_taxa, ignore_index=True)
+        taxa = taxa.drop_duplicates("ncbi_taxid", keep="last").set_index("ncbi_taxid").sort_index()
+        taxa.to_csv(os.path.join(cache_dir, TAXA_FILE), sep="\t")
+        _taxa_cache.pop(cache_dir, None)
+
+    if changed:
+        _save_manifest(manifest, cache_dir)
+    # Billig (nur Manifest + Metadaten), daher immer: Schwellen oder Metadaten können sich geändert haben
+    update_quarantine(manifest, cache_dir, meta_csv)
+
+    return manifest
+
+
+def quarantine_reasons(run, qc, known_runs):
+    reasons = []
+    if "error" in qc:
+        return [f"Formatfehler: {qc['error']}"]
+    if not qc["complete"]:
+        reasons.append("unvollständig (direkte Reads ≠ Gesamt-Reads)")
+    if not qc["indent_ok"]:
+        reasons.append("fehlerhafte Einrückung")
+    if qc["total_reads"] < MIN_TOTAL_READS:
+        reasons.append(f"zu wenige Reads ({qc['total_reads']:,} < {MIN_TOTAL_READS:,})")
+    if qc["virus_reads"] == 0:
+        reasons.append("keine Virus-Reads")
+    if known_runs is not None and run not in known_runs:
+        reasons.append("keine Metadaten")
+    if run in QUARANTINE_MANUAL:
+        reasons.append(QUARANTINE_MANUAL[run])
+    return reasons
+
+
+def update_quarantine(manifest, cache_dir=CACHE_DIR, meta_csv=META_CSV):
+    """Baut den Quarantäne-Index aus den QC-Kennzahlen im Manifest neu auf (ohne Reports zu lesen)."""
+    known_runs = set(load_metadata(meta_csv)["ENA_RUN_ACCESSION"]) if os.path.exists(meta_csv) else None
+
+    quarantine = {}
+    for run, entry in sorted(manifest.items()):
+        reasons = quarantine_reasons(run, entry["qc"], known_runs)
+        if reasons:
+            quarantine[run] = reasons
+
+    if quarantine != load_quarantine(cache_dir):
+        with open(os.path.join(cache_dir, QUARANTINE_FILE), "w") as f:
+            json.dump(quarantine, f, indent=1, ensure_ascii=False)
+    return quarantine
+
+
+def load_quarantine(cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, QUARANTINE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def quarantined_runs(input_folder=INPUT_FOLDER, cache_dir=CACHE_DIR):
+    """Bringt Cache und Quarantäne auf den aktuellen Stand und gibt die gesperrten Runs zurück."""
+    ingest_reports(input_folder, cache_dir, verbose=False)
+    return set(load_quarantine(cache_dir))
+
+
+def quarantined_reports(input_folder=INPUT_FOLDER, cache_dir=CACHE_DIR):
+    """Wie quarantined_runs, aber als Dateinamen (für reports_to_skip)."""
+    return {f"{run}{REPORT_SUFFIX}" for run in quarantined_runs(input_folder, cache_dir)}
+
+
+def load_taxa(cache_dir=CACHE_DIR):
+    """Taxid → (rank_code, name) aller bisher gecachten Reports."""
+    path = os.path.join(cache_dir, TAXA_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["rank_code", "name"], index=pd.Index([], name="ncbi_taxid", dtype=np.int64))
+
+    mtime = os.path.getmtime(path)
+    cached = _taxa_cache.get(cache_dir)
+    if cached is None or cached[0] != mtime:
+        taxa = pd.read_csv(path, sep="\t", index_col="ncbi_taxid", dtype={"name": str, "rank_code": str},
+                           keep_default_na=False)
+        cached = (mtime, taxa)
+        _taxa_cache[cache_dir] = cached
+    return cached[1]
+
+
+def cached_runs(cache_dir=CACHE_DIR, include_quarantined=False):
+    manifest = load_manifest(cache_dir)
+    skip = set() if include_quarantined else set(load_quarantine(cache_dir))
+    return sorted(run for run, entry in manifest.items() if run not in skip and "error" not in entry["qc"])
+
+
+def load_report(run, cache_dir=CACHE_DIR, with_names=False):
+    """Lädt einen gecachten Report als DataFrame (eine Zeile pro Taxon)."""
+    with np.load(_cache_path(cache_dir, run)) as data:
+        df = pd.DataFrame({key: data[key] for key in data.files})
+    if with_names:
+        df["name"] = df["ncbi_taxid"].map(load_taxa(cache_dir)["name"])
+    return df
+
+
+def rank_rows(report, taxon_level):
+    """
+    Zeilen eines gecachten Reports, die Taxa auf taxon_level sind. Mit Lineage-Spalten entscheidet der
+    taxdump (die Zeile ist ihr eigener Vorfahre auf dem Rang), sonst der Rang-Code aus dem Kraken2-Report.
+    """
+    column = f"lineage_{RANK_CODES.get(taxon_level)}"
+    if column in report:
+        return report[report[column] == report["ncbi_taxid"]]
+    return report[report["rank_code"] == taxon_level]
+
+
+def virus_reads(df):
+    row = df["reads_clade"][df["ncbi_taxid"] == VIRUSES_TAXID]
+    return row.iloc[0] if not row.empty else 0
+
+
+def plan_blocks(runs, manifest, memory_budget_mb=MEMORY_BUDGET_MB):
+    """
+    Teilt die Runs in Blöcke auf, deren geschätzter Speicherbedarf (Rohdaten mal
+    BLOCK_OVERHEAD) das Budget nicht überschreitet. Jeder Block enthält mindestens einen Run.
+    """
+    budget = memory_budget_mb * 2**20
+    blocks, block, used = [], [], 0
+
+    for run in runs:
+        cost = manifest[run]["nbytes"] * BLOCK_OVERHEAD
+        if block and used + cost > budget:
+            blocks.append(block)
+            block, used = [], 0
+        block.append(run)
+        used += cost
+
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def iter_report_blocks(runs, cache_dir=CACHE_DIR, memory_budget_mb=MEMORY_BUDGET_MB, with_names=False):
+    """Liefert die Reports blockweise als Liste von (run, DataFrame)."""
+    manifest = load_manifest(cache_dir)
+    missing = [run for run in runs if run not in manifest]
+    if missing:
+        raise RuntimeError(f"Reports nicht im Cache: {', '.join(missing[:5])} (ingest_reports ausführen)")
+
+    for block in plan_blocks(runs, manifest, memory_budget_mb):
+        yield [(run, load_report(run, cache_dir, with_names=with_names)) for run in block]
+
+
+def cohort_fingerprint(runs, cache_dir=CACHE_DIR, extra=""):
+    """
+    Kurzer Hash über Runs und deren Report-Stand, als Schlüssel für abgeleitete Caches. extra geht mit
+    in den Hash ein (z.B. die Zuordnung Alias → Runs, wenn das Ergebnis auch von den Metadaten abhängt).
+    """
+    manifest = load_manifest(cache_dir)
+    # Mit Lineage-Spalten hängen Rang-Auswahlen auch vom taxdump-Stand ab
+    key = "\n".join(f"{run}:{manifest[run]['size']}:{manifest[run]['mtime']}"
+                    + (f":{manifest[run]['lineage']}" if manifest[run].get("lineage") else "") for run in sorted(runs))
+    return hashlib.sha1((key + extra).encode()).hexdigest()[:16]
+
+
+def derived_path(prefix, runs, cache_dir=CACHE_DIR, extra=""):
+    """Pfad eines abgeleiteten Caches (z.B. Matrizen, Ordinationen) für genau diese Kohorte."""
+    return os.path.join(cache_dir, f"{prefix}_{cohort_fingerprint(runs, cache_dir, extra)}.npz")
+
+
+def save_derived(path, **arrays):
+    """Speichert einen abgeleiteten Cache und entfernt ältere Stände mit demselben Präfix."""
+    directory, name = os.path.split(path)
+    prefix = name.rsplit("_", 1)[0] + "_"
+    for old in os.listdir(directory):
+        if old.startswith(prefix) and old.count("_") == name.count("_"):
+            os.remove(os.path.join(directory, old))
+    np.savez(path, **arrays)
+
+
+def abundance_matrix(runs=None, taxon_level="S", value=COUNT_VALUE, cache_dir=CACHE_DIR):
+    """
+    Read-Zählungen als Matrix Runs × Taxids auf einem Level (None = alle Zeilen außer
+    unclassified/root). Das Ergebnis wird pro Kohorte und Level im Cache abgelegt.
+    value="bracken" liefert die umverteilten Zählungen aus bracken.py.
+    """
+    if runs is None:
+        runs = cached_runs(cache_dir)
+    runs = list(runs)
+
+    if value == "bracken":
+        from bracken import redistributed_matrix
+        return redistributed_matrix(runs, taxon_level, cache_dir)
+
+    path = derived_path(f"abundance_{taxon_level or 'all'}_{value}", runs, cache_dir)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return pd.DataFrame(data["counts"], index=pd.Index(data["runs"], name="run"),
+                                columns=pd.Index(data["taxids"], name="ncbi_taxid"))
+
+    taxid_parts, value_parts, row_parts = [], [], []
+    for i, run in enumerate(runs):
+        report = load_report(run, cache_dir)
+        if taxon_level is None:
+            report = report[report["depth"] > 0]
+        else:
+            report = rank_rows(report, taxon_level)
+        taxid_parts.append(report["ncbi_taxid"].to_numpy())
+        value_parts.append(report[value].to_numpy())
+        row_parts.append(np.full(len(report), i, dtype=np.int64))
+
+    all_taxids = np.concatenate(taxid_parts) if taxid_parts else np.array([], dtype=np.int64)
+    taxids, cols = np.unique(all_taxids, return_inverse=True)
+    counts = np.zeros((len(runs), len(taxids)), dtype=np.int64)
+    if len(all_taxids):
+        np.add.at(counts, (np.concatenate(row_parts), cols), np.concatenate(value_parts))
+
+    save_derived(path, counts=counts, runs=np.array(runs, dtype="U32"), taxids=taxids)
+    return pd.DataFrame(counts, index=pd.Index(runs, name="run"), columns=pd.Index(taxids, name="ncbi_taxid"))
+
+
+def relative_abundance_matrix(runs=None, taxon_level="S", cache_dir=CACHE_DIR, value=COUNT_VALUE):
+    """reads_clade relativ zu allen Virus-Reads des Runs (wie in similarity.py), Runs × Taxids."""
+    counts = abundance_matrix(runs, taxon_level, value, cache_dir)
+    manifest = load_manifest(cache_dir)
+    virus_reads_total = np.array([manifest[run]["qc"]["virus_reads"] for run in counts.index], dtype=np.float64)
+    return counts.div(virus_reads_total, axis=0)
+
+
+@contextmanager
+def track_peak_memory(label="Analyse"):
+    """Misst den Spitzen-Speicherverbrauch (Python- und NumPy-Allokationen) eines Blocks."""
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    stats = {}
+    try:
+        yield stats
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+        stats["peak_mb"] = peak / 2**20
+        print(f"Peak-Speicher {label}: {stats['peak_mb']:.1f} MB")
+
+
+def load_metadata(csv_path=META_CSV):
+    """Lädt die Metadaten-CSV, indiziert nach ENA_RUN_ACCESSION, mit geparstem DATE."""
+    df = pd.read_csv(csv_path, sep=";")
+    df["ENA_RUN_ACCESSION"] = df["ENA_RUN_ACCESSION"].astype(str).str.strip()
+    df["PLANT"] = df["PLANT"].astype(str).str.strip()
+    df["DATE"] = pd.to_datetime(df["COLLECTION_DATE"])
+    return df.set_index("ENA_RUN_ACCESSION", drop=False)
+
+
+if __name__ == "__main__":
+    manifest = ingest_reports()
+    total = sum(entry["nbytes"] for entry in manifest.values())
+    blocks = plan_blocks(cached_runs(), manifest)
+    print(f"{len(manifest)} Reports im Cache ({total / 2**20:.1f} MB), "
+          f"{len(blocks)} Blöcke bei {MEMORY_BUDGET_MB} MB Budget")
+
+    print("\nQuarantäne:")
+    for run, reasons in load_quarantine().items():
+        print(f"  {run}: {'; '.join(reasons)}")
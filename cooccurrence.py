@@ -0,0 +1,115 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import rankdata
+
+from cohort import abundance_matrix, cached_runs, ingest_reports, load_taxa
+
+# This script builds a co-occurrence network of viral taxa across all samples. Counts are CLR-transformed
+# (compositional data), taxa below a prevalence threshold are dropped, and pairwise Spearman correlations
+# or proportionality (rho) are computed block by block, keeping only pairs above a threshold. The full
+# taxa × taxa matrix is never held in memory; the result is a sparse edge list.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXON_LEVEL = "S"
+METHOD = "spearman"            # "spearman" (auf CLR) oder "rho" (Proportionalität, Lovell et al. 2015)
+MIN_PREVALENCE = 0.2           # Taxon muss in mindestens diesem Anteil der Samples vorkommen
+MIN_ABS_CORRELATION = 0.7
+PSEUDO_COUNT = 0.5
+BLOCK_MEMORY_MB = 64           # Speicher pro Block der Korrelationsmatrix
+OUTPUT_CSV = "cooccurrence_edges.csv"
+# ============================================================
+
+
+def clr(counts, pseudo_count=PSEUDO_COUNT):
+    """Centered log-ratio pro Sample (Zeile)."""
+    logs = np.log(counts + pseudo_count)
+    return logs - logs.mean(axis=1, keepdims=True)
+
+
+def _standardize(values):
+    centered = values - values.mean(axis=0)
+    return centered / np.sqrt((centered ** 2).sum(axis=0))
+
+
+def correlation_edges(values, method=METHOD, threshold=MIN_ABS_CORRELATION, block_memory_mb=BLOCK_MEMORY_MB):
+    """
+    Paarweise Spearman-Korrelation bzw. Proportionalität aller Spalten von values (Samples × Taxa, CLR),
+    blockweise über Spaltenblöcke der oberen Dreiecksmatrix. Gibt eine obere Dreiecks-Sparse-Matrix
+    (COO) mit allen Paaren |Wert| >= threshold zurück.
+    """
+    n_taxa = values.shape[1]
+    if method == "spearman":
+        z = _standardize(rankdata(values, axis=0))
+    elif method == "rho":
+        # rho = 1 - var(x - y) / (var(x) + var(y)) = 2 cov(x, y) / (var(x) + var(y))
+        centered = values - values.mean(axis=0)
+        variances = (centered ** 2).sum(axis=0)
+    else:
+        raise ValueError(f"Unbekannte Methode: {method}")
+
+    block = max(1, int(block_memory_mb * 2**20 // (8 * n_taxa)))
+    rows, cols, data = [], [], []
+    for start in range(0, n_taxa, block):
+        stop = min(start + block, n_taxa)
+        if method == "spearman":
+            values_block = z[:, start:stop].T @ z[:, start:]
+        else:
+            covariances = centered[:, start:stop].T @ centered[:, start:]
+            values_block = 2 * covariances / (variances[start:stop, None] + variances[None, start:])
+
+        # Nur j > i (obere Dreiecksmatrix ohne Diagonale)
+        values_block[np.tril_indices(stop - start, 0, values_block.shape[1])] = 0
+        i, j = np.nonzero(np.abs(values_block) >= threshold)
+        rows.append(i + start)
+        cols.append(j + start)
+        data.append(values_block[i, j])
+
+    return sparse.coo_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n_taxa, n_taxa))
+
+
+def cooccurrence_network(runs=None, taxon_level=TAXON_LEVEL, method=METHOD, min_prevalence=MIN_PREVALENCE,
+                         threshold=MIN_ABS_CORRELATION):
+    """Kantenliste (taxid_a, taxid_b, Wert) des Co-Occurrence-Netzwerks."""
+    counts = abundance_matrix(runs, taxon_level)
+    values = clr(counts.to_numpy().astype(np.float64))
+    keep = (counts > 0).mean().to_numpy() >= min_prevalence
+    taxids = counts.columns.to_numpy()[keep]
+
+    edges = correlation_edges(values[:, keep], method, threshold)
+    return pd.DataFrame({
+        "taxid_a": taxids[edges.row],
+        "taxid_b": taxids[edges.col],
+        method: edges.data,
+    }).sort_values(method, key=np.abs, ascending=False, ignore_index=True), len(taxids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Co-Occurrence-Netzwerk viraler Taxa")
+    parser.add_argument("--level", default=TAXON_LEVEL, help="Taxonomisches Level (z.B. G, S)")
+    parser.add_argument("--method", default=METHOD, choices=["spearman", "rho"])
+    parser.add_argument("--threshold", type=float, default=MIN_ABS_CORRELATION)
+    args = parser.parse_args()
+
+    ingest_reports(verbose=False)
+    edges, n_taxa = cooccurrence_network(cached_runs(), args.level, args.method, threshold=args.threshold)
+
+    names = load_taxa()["name"]
+    edges.insert(2, "name_b", names.reindex(edges["taxid_b"]).to_numpy())
+    edges.insert(1, "name_a", names.reindex(edges["taxid_a"]).to_numpy())
+    edges.to_csv(OUTPUT_CSV, index=False)
+
+    print(f"✔ {len(edges)} Kanten zwischen {n_taxa} Taxa (|{args.method}| >= {args.threshold}) → {OUTPUT_CSV}\n")
+    degree = pd.concat([edges["name_a"], edges["name_b"]]).value_counts()
+    print("Taxa mit den meisten Kanten:\n")
+    print(degree.head(15).to_string())
+
+
+if __name__ == "__main__":
+    main()
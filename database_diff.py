@@ -0,0 +1,137 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from cohort import CACHE_DIR, INPUT_FOLDER, abundance_matrix, cached_runs, ingest_reports, load_manifest, load_taxa
+
+# This script compares the same cohort classified against two Kraken2 databases (see DATABASES in
+# ena_kraken_automate.py, one report folder per database). Each folder is parsed into its own report cache,
+# so re-running the comparison only reads new reports. Per rank it reports how similar the profiles of
+# each run are (Bray-Curtis on abundances relative to the virus reads), which taxa only one database
+# knows, and the taxa whose mean abundance changed most. Taxa are matched by taxid, so renamed taxa are
+# compared correctly and listed with both names.
+#
+# Verwendung:
+#   python database_diff.py kraken2_run kraken2_run_viral-20251001
+#   python database_diff.py kraken2_run kraken2_run_viral-20251001 --ranks G S --csv diff.csv
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+RANKS = ["O", "F", "G", "S"]
+TOP_N = 10
+DATABASE_CACHE = "databases"   # Unterordner von CACHE_DIR für weitere Report-Ordner
+# ============================================================
+
+
+def database_cache(folder):
+    """Report-Cache eines Report-Ordners; der Standard-Ordner nutzt den normalen Cache."""
+    folder = os.path.normpath(folder)
+    if os.path.abspath(folder) == os.path.abspath(INPUT_FOLDER):
+        return CACHE_DIR
+    return os.path.join(CACHE_DIR, DATABASE_CACHE, os.path.basename(folder))
+
+
+def load_database(folder):
+    cache_dir = database_cache(folder)
+    ingest_reports(folder, cache_dir, verbose=False, archive_path=f"{os.path.normpath(folder)}.archive")
+    return cache_dir
+
+
+def _relative(counts, taxa, cache_dir):
+    manifest = load_manifest(cache_dir)
+    virus = np.array([manifest[run]["qc"]["virus_reads"] for run in counts.index], dtype=np.float64)
+    counts = counts.reindex(columns=taxa, fill_value=0).to_numpy(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(virus[:, None] > 0, counts / virus[:, None], 0)
+
+
+def compare_rank(runs, rank, cache_a, cache_b):
+    """
+    Vergleich beider Datenbanken auf einem Rang. Gibt (Kennzahlen, Tabelle pro Taxon, Ähnlichkeit pro Run)
+    zurück; alle Größen werden auf den gemeinsamen Taxid-Achsen als Matrixoperationen berechnet.
+    """
+    counts_a = abundance_matrix(runs, rank, value="reads_clade", cache_dir=cache_a)
+    counts_b = abundance_matrix(runs, rank, value="reads_clade", cache_dir=cache_b)
+    taxa = counts_a.columns.union(counts_b.columns)
+    rel_a, rel_b = _relative(counts_a, taxa, cache_a), _relative(counts_b, taxa, cache_b)
+
+    total = (rel_a + rel_b).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarity = np.where(total > 0, 1 - np.abs(rel_a - rel_b).sum(axis=1) / total, np.nan)
+
+    in_a, in_b = (rel_a > 0).any(axis=0), (rel_b > 0).any(axis=0)
+    names_a = load_taxa(cache_a)["name"].reindex(taxa).to_numpy()
+    names_b = load_taxa(cache_b)["name"].reindex(taxa).to_numpy()
+    per_taxon = pd.DataFrame({
+        "name_a": names_a,
+        "name_b": names_b,
+        "mean_a": rel_a.mean(axis=0),
+        "mean_b": rel_b.mean(axis=0),
+        "prevalence_a": (rel_a > 0).mean(axis=0),
+        "prevalence_b": (rel_b > 0).mean(axis=0),
+    }, index=pd.Index(taxa, name="ncbi_taxid"))
+    per_taxon["difference"] = per_taxon["mean_b"] - per_taxon["mean_a"]
+    per_taxon["renamed"] = in_a & in_b & (names_a != names_b)
+
+    summary = {
+        "rank": rank,
+        "runs": len(runs),
+        "taxa_a": int(in_a.sum()),
+        "taxa_b": int(in_b.sum()),
+        "only_a": int((in_a & ~in_b).sum()),
+        "only_b": int((in_b & ~in_a).sum()),
+        "renamed": int(per_taxon["renamed"].sum()),
+        "share_a": rel_a.sum(axis=1).mean(),
+        "share_b": rel_b.sum(axis=1).mean(),
+        "similarity_median": np.nanmedian(similarity),
+        "similarity_min": np.nanmin(similarity),
+    }
+    return summary, per_taxon, pd.Series(similarity, index=pd.Index(runs, name="run"), name=rank)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kohorte zwischen zwei Kraken2-Datenbanken vergleichen")
+    parser.add_argument("folder_a", help="Report-Ordner der ersten Datenbank")
+    parser.add_argument("folder_b", help="Report-Ordner der zweiten Datenbank")
+    parser.add_argument("--ranks", nargs="+", default=RANKS)
+    parser.add_argument("--top", type=int, default=TOP_N)
+    parser.add_argument("--csv", help="Tabelle pro Rang und Taxon als CSV schreiben")
+    args = parser.parse_args()
+
+    cache_a, cache_b = load_database(args.folder_a), load_database(args.folder_b)
+    runs = sorted(set(cached_runs(cache_a)) & set(cached_runs(cache_b)))
+    if not runs:
+        print("⚠ Keine Runs, die in beiden Report-Ordnern vorliegen")
+        return
+    print(f"✔ {len(runs)} Runs in beiden Datenbanken (A = {args.folder_a}, B = {args.folder_b})\n")
+
+    summaries, tables, similarities = [], [], []
+    for rank in args.ranks:
+        summary, per_taxon, similarity = compare_rank(runs, rank, cache_a, cache_b)
+        summaries.append(summary)
+        tables.append(per_taxon.assign(rank=rank))
+        similarities.append(similarity)
+
+    print("Übersicht (share = Anteil der Virus-Reads auf dem Rang, similarity = Bray-Curtis pro Run):")
+    print(pd.DataFrame(summaries).set_index("rank").round(4).to_string())
+
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        for rank, per_taxon in zip(args.ranks, tables):
+            changed = per_taxon.reindex(per_taxon["difference"].abs().sort_values(ascending=False).index)
+            print(f"\nLevel {rank}: größte Änderungen der mittleren relativen Abundanz (B − A)")
+            print(changed.head(args.top).drop(columns="rank").round(5).to_string())
+
+        worst = pd.concat(similarities, axis=1).sort_values(args.ranks[-1]).head(args.top)
+        print(f"\nRuns mit der geringsten Ähnlichkeit zwischen den Datenbanken:\n{worst.round(4).to_string()}")
+
+    if args.csv:
+        pd.concat(tables).to_csv(args.csv)
+        print(f"\n✔ Tabelle geschrieben: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
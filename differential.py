@@ -0,0 +1,156 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, false_discovery_control, norm, rankdata
+
+from cohort import META_CSV, cached_runs, ingest_reports, load_metadata, load_taxa, relative_abundance_matrix
+from util import PLANT_NAME_MAP
+
+# This script finds taxa whose relative abundance differs between plants or between seasons. It runs
+# Kruskal-Wallis tests across all groups and Mann-Whitney U tests for a pair of groups, with effect sizes
+# and Benjamini-Hochberg FDR correction. All taxa of a rank are tested at once: the abundance matrix is
+# ranked column-wise and the test statistics are computed as matrix operations instead of one test per taxon.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXON_LEVEL = "S"
+MIN_PREVALENCE = 0.1           # Taxon muss in mindestens diesem Anteil der Samples vorkommen
+FDR_ALPHA = 0.05
+COMPARE = ("Rotterdam", "Budapest")
+SEASONS = {12: "Winter", 1: "Winter", 2: "Winter", 3: "Spring", 4: "Spring", 5: "Spring",
+           6: "Summer", 7: "Summer", 8: "Summer", 9: "Autumn", 10: "Autumn", 11: "Autumn"}
+# ============================================================
+
+
+def _tie_sums(ranks):
+    """Σ(t³ - t) über alle Ties jeder Spalte, für alle Spalten auf einmal."""
+    n, n_cols = ranks.shape
+    ordered = np.sort(ranks, axis=0)
+    new_run = np.ones_like(ordered, dtype=bool)
+    new_run[1:] = ordered[1:] != ordered[:-1]
+    run_ids = np.cumsum(new_run, axis=0) - 1 + n * np.arange(n_cols)
+    t = np.bincount(run_ids.ravel(), minlength=n * n_cols).astype(np.float64)
+    return (t ** 3 - t).reshape(n_cols, n).sum(axis=1)
+
+
+def kruskal_wallis(values, groups):
+    """
+    Kruskal-Wallis-H für alle Spalten von values (Samples × Taxa) mit Tie-Korrektur,
+    dazu Effektstärke η²_H = (H - k + 1) / (N - k).
+    """
+    codes, labels = pd.factorize(pd.Series(groups), sort=True)
+    n, k = len(codes), len(labels)
+    ranks = rankdata(values, axis=0)
+
+    indicator = np.zeros((k, n))
+    indicator[codes, np.arange(n)] = 1
+    sizes = indicator.sum(axis=1)
+    rank_sums = indicator @ ranks
+
+    h = 12 / (n * (n + 1)) * (rank_sums ** 2 / sizes[:, None]).sum(axis=0) - 3 * (n + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h /= 1 - _tie_sums(ranks) / (n ** 3 - n)
+    mean_ranks = pd.DataFrame((rank_sums / sizes[:, None]).T, columns=labels)
+
+    return pd.DataFrame({
+        "H": h,
+        "p": chi2.sf(h, k - 1),
+        "eta2": (h - k + 1) / (n - k),
+    }), mean_ranks
+
+
+def mann_whitney(values, in_first):
+    """
+    Zweiseitiger Mann-Whitney-U-Test (Normalapproximation mit Tie- und Stetigkeitskorrektur)
+    für alle Spalten. Effektstärke: Rang-biseriale Korrelation, positiv wenn die erste Gruppe höher liegt.
+    """
+    n1, n2 = in_first.sum(), (~in_first).sum()
+    n = n1 + n2
+    ranks = rankdata(values, axis=0)
+
+    u = ranks[in_first].sum(axis=0) - n1 * (n1 + 1) / 2
+    mu = n1 * n2 / 2
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - _tie_sums(ranks) / (n * (n - 1))))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (u - mu - 0.5 * np.sign(u - mu)) / sigma
+
+    return pd.DataFrame({
+        "U": u,
+        "z": z,
+        "p": 2 * norm.sf(np.abs(z)),
+        "rank_biserial": 2 * u / (n1 * n2) - 1,
+    })
+
+
+def _fdr(p):
+    q = np.full(len(p), np.nan)
+    valid = ~np.isnan(p)
+    q[valid] = false_discovery_control(p[valid])
+    return q
+
+
+def _annotate(result, rel):
+    taxa = load_taxa()
+    result.insert(0, "name", taxa["name"].reindex(rel.columns).to_numpy())
+    result.insert(0, "ncbi_taxid", rel.columns.to_numpy())
+    result["q"] = _fdr(result["p"].to_numpy())
+    result["significant"] = result["q"] < FDR_ALPHA
+    return result.sort_values("p")
+
+
+def prevalent(rel, min_prevalence=MIN_PREVALENCE):
+    return rel.loc[:, (rel > 0).mean() >= min_prevalence]
+
+
+def test_groups(rel, groups):
+    """Kruskal-Wallis über alle Gruppen, mit mittlerem Rang pro Gruppe."""
+    stats, mean_ranks = kruskal_wallis(rel.to_numpy(), groups)
+    result = pd.concat([stats, mean_ranks.add_prefix("mean_rank_")], axis=1)
+    return _annotate(result, rel)
+
+
+def test_pair(rel, groups, first, second):
+    """Mann-Whitney zwischen zwei Gruppen, mit log2-Verhältnis der mittleren Abundanz."""
+    groups = np.asarray(groups)
+    mask = np.isin(groups, [first, second])
+    sub = rel[mask]
+    in_first = groups[mask] == first
+
+    result = mann_whitney(sub.to_numpy(), in_first)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result["log2_ratio"] = np.log2(sub[in_first].mean().to_numpy() / sub[~in_first].mean().to_numpy())
+    return _annotate(result, rel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Unterschiedlich abundante Taxa zwischen Kläranlagen und Jahreszeiten")
+    parser.add_argument("--level", default=TAXON_LEVEL, help="Taxonomisches Level (z.B. G, S)")
+    parser.add_argument("--compare", nargs=2, default=COMPARE, metavar=("A", "B"), help="Zwei Kläranlagen oder Jahreszeiten")
+    args = parser.parse_args()
+
+    ingest_reports(verbose=False)
+    metadata = load_metadata(META_CSV)
+    rel = prevalent(relative_abundance_matrix(cached_runs(), args.level))
+    meta = metadata.loc[rel.index]
+    plants = meta["PLANT"].map(lambda p: PLANT_NAME_MAP.get(p, p)).to_numpy()
+    seasons = meta["DATE"].dt.month.map(SEASONS).to_numpy()
+    print(f"{rel.shape[1]} Taxa (Level {args.level}) in {rel.shape[0]} Samples\n")
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        for label, groups in (("Kläranlagen", plants), ("Jahreszeiten", seasons)):
+            result = test_groups(rel, groups)
+            print(f"Kruskal-Wallis {label}: {result['significant'].sum()} signifikant (FDR < {FDR_ALPHA})")
+            print(result.head(15).round(4).to_string(index=False), "\n")
+
+        first, second = args.compare
+        groups = plants if first in plants else seasons
+        result = test_pair(rel, groups, first, second)
+        print(f"Mann-Whitney {first} vs. {second}: {result['significant'].sum()} signifikant (FDR < {FDR_ALPHA})")
+        print(result.head(20).round(4).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+
+from cohort import META_CSV, cached_runs, ingest_reports, load_metadata, relative_abundance_matrix
+
+# This script relates community similarity to geographic distance and to time between samples. For all
+# sample pairs it computes the haversine distance between the plants, the number of days between the
+# collection dates and the Bray-Curtis similarity, fits distance-decay and time-decay curves and tests
+# both relationships with Mantel tests. All three pair values are computed in one pass over blocks of pairs
+# (Bray-Curtis from the cached abundance matrix), and the Mantel permutations gather directly from the
+# condensed pair vectors, so no n × n matrix is ever built. Besides the abundance matrix, memory grows with
+# the number of pairs (a few condensed vectors) plus BLOCK_MEMORY_MB and PERM_MEMORY_MB per block.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXON_LEVEL = "S"
+BLOCK_MEMORY_MB = 64           # Speicher pro Block von Paaren (Bray-Curtis: Paare × Taxa Differenzen)
+MAX_DAYS_APART = 7             # Distanz-Abnahme nur für zeitnahe Paare (trennt Raum von Zeit)
+N_PERM = 999
+PERM_MEMORY_MB = 128           # Speicher pro Batch permutierter Distanzvektoren
+SEED = 42
+# ============================================================
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def coordinates(metadata):
+    """LATITUDE/LONGITUDE stehen mit Dezimalkomma in der CSV."""
+    return metadata[["LATITUDE", "LONGITUDE"]].apply(
+        lambda col: pd.to_numeric(col.astype(str).str.replace(",", ".", regex=False))).to_numpy()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _row_starts(n):
+    """Kondensierter Index (wie scipy.pdist) des ersten Paars (i, i+1) jeder Zeile i, dazu die Paaranzahl am Ende."""
+    return np.concatenate([[0], np.cumsum(np.arange(n - 1, 0, -1))])
+
+
+def _pair_indices(n):
+    """(i, j) aller Paare i < j in kondensierter Reihenfolge."""
+    row_starts = _row_starts(n)
+    i = np.repeat(np.arange(n - 1), np.diff(row_starts))
+    return i, np.arange(row_starts[-1]) - row_starts[i] + i + 1
+
+
+def _pair_blocks(n, block_pairs):
+    """
+    Alle Paare i < j in kondensierter Reihenfolge als Blöcke (i, j_start, j_end) einer Zeile mit höchstens
+    block_pairs Paaren. j ist zusammenhängend, die Partner werden also als Slice gelesen statt kopiert.
+    """
+    for i in range(n - 1):
+        for start in range(i + 1, n, block_pairs):
+            yield i, start, min(start + block_pairs, n)
+
+
+def pair_table(runs, metadata, abundances, block_memory_mb=BLOCK_MEMORY_MB):
+    """
+    Eine Zeile pro Sample-Paar (kondensierte Reihenfolge wie scipy.pdist): Entfernung in km,
+    Abstand in Tagen, Bray-Curtis-Ähnlichkeit und ob beide Samples aus derselben Kläranlage stammen.
+    abundances: Runs × Taxa (z.B. cohort.relative_abundance_matrix). Alle Werte entstehen im selben
+    Durchlauf über Blöcke von Paaren; ein Block belegt höchstens block_memory_mb.
+    """
+    meta = metadata.loc[runs]
+    coords = coordinates(meta)
+    days = (meta["DATE"] - meta["DATE"].min()).dt.days.to_numpy()
+    plants = pd.factorize(meta["PLANT"])[0]
+    values = abundances.loc[runs].to_numpy(dtype=np.float64)
+    totals = values.sum(axis=1)
+
+    n = len(runs)
+    n_pairs = n * (n - 1) // 2
+    distance_km = np.empty(n_pairs)
+    days_apart = np.empty(n_pairs, dtype=np.int64)
+    similarity = np.empty(n_pairs)
+    same_plant = np.empty(n_pairs, dtype=bool)
+
+    block_pairs = max(1, block_memory_mb * 2**20 // (8 * max(1, values.shape[1])))
+    offset = 0
+    for i, start, end in _pair_blocks(n, block_pairs):
+        block, j = slice(offset, offset + end - start), slice(start, end)
+        distance_km[block] = haversine_km(coords[i, 0], coords[i, 1], coords[j, 0], coords[j, 1])
+        days_apart[block] = np.abs(days[i] - days[j])
+        # Bray-Curtis wie scipy: Σ|u - v| / Σ(u + v)
+        similarity[block] = 1 - np.abs(values[j] - values[i]).sum(axis=1) / (totals[i] + totals[j])
+        same_plant[block] = plants[i] == plants[j]
+        offset += end - start
+
+    return pd.DataFrame({
+        "distance_km": distance_km,
+        "days_apart": days_apart,
+        "similarity": similarity,
+        "same_plant": same_plant,
+    })
+
+
+def fit_decay(x, similarity):
+    """
+    Exponentielle Abnahme ln(Ähnlichkeit) = a + b·x (Nekola & White 1999). Gibt Steigung,
+    Achsenabschnitt, R² und die Halbwertsdistanz ln(2)/-b zurück.
+    """
+    keep = similarity > 0
+    x, y = x[keep], np.log(similarity[keep])
+    slope, intercept = np.polyfit(x, y, 1)
+    r2 = np.corrcoef(x, y)[0, 1] ** 2
+    return {"slope": slope, "intercept": intercept, "R2": r2,
+            "half_distance": np.log(2) / -slope if slope < 0 else np.inf, "pairs": int(keep.sum())}
+
+
+def mantel(x, y, n_perm=N_PERM, seed=SEED, perm_memory_mb=PERM_MEMORY_MB):
+    """
+    Mantel-Test (Pearson) zweier kondensierter Distanzvektoren. Permutiert werden die Samples von x;
+    Mittelwert und Streuung der Paarwerte bleiben dabei gleich, also reicht pro Permutation ein
+    Skalarprodukt. Die permutierten Werte werden batchweise direkt aus dem kondensierten Vektor x
+    gezogen; ein Batch belegt höchstens perm_memory_mb (Indizes und Werte).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = int(round((1 + np.sqrt(1 + 8 * len(x))) / 2))
+    row_starts = _row_starts(n)
+    i, j = _pair_indices(n)
+
+    x_mean, x_std = x.mean(), x.std()
+    y_centered = (y - y.mean()) / (y.std() * len(y))
+    r_obs = ((x - x_mean) / x_std) @ y_centered
+
+    rng = np.random.default_rng(seed)
+    batch = max(1, perm_memory_mb * 2**20 // (24 * len(y)))
+    r_perm = []
+    for start in range(0, n_perm, batch):
+        perms = rng.permuted(np.tile(np.arange(n), (min(batch, n_perm - start), 1)), axis=1)
+        a, b = perms[:, i], perms[:, j]
+        low, high = np.minimum(a, b), np.maximum(a, b)
+        permuted = x[row_starts[low] + high - low - 1]
+        r_perm.append(((permuted - x_mean) / x_std) @ y_centered)
+    r_perm = np.concatenate(r_perm)
+
+    return {"r": r_obs, "p": (np.sum(r_perm >= r_obs) + 1) / (n_perm + 1)}
+
+
+def plot_decay(pairs, geo_fit, time_fit):
+    import matplotlib.pyplot as plt
+
+    fig, (ax_geo, ax_time) = plt.subplots(1, 2, figsize=(13, 5), sharey=True)
+
+    close = pairs[pairs["days_apart"] <= MAX_DAYS_APART]
+    ax_geo.scatter(close["distance_km"], close["similarity"], s=4, alpha=0.3, rasterized=True)
+    x = np.linspace(0, close["distance_km"].max(), 100)
+    ax_geo.plot(x, np.exp(geo_fit["intercept"] + geo_fit["slope"] * x), color="black")
+    ax_geo.set_xlabel("Distance (km)")
+    ax_geo.set_ylabel("Bray-Curtis Similarity")
+    ax_geo.set_title(f"Distance Decay (≤ {MAX_DAYS_APART} days apart)")
+
+    within = pairs[pairs["same_plant"]]
+    ax_time.scatter(within["days_apart"], within["similarity"], s=4, alpha=0.3, rasterized=True)
+    x = np.linspace(0, within["days_apart"].max(), 100)
+    ax_time.plot(x, np.exp(time_fit["intercept"] + time_fit["slope"] * x), color="black")
+    ax_time.set_xlabel("Days Apart")
+    ax_time.set_title("Time Decay (within plant)")
+
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == "__main__":
+    ingest_reports(verbose=False)
+    metadata = load_metadata(META_CSV)
+    abundances = relative_abundance_matrix(cached_runs(), TAXON_LEVEL)
+    runs = abundances.index.tolist()
+    pairs = pair_table(runs, metadata, abundances)
+    distances = 1 - pairs["similarity"].to_numpy()
+
+    close = pairs[pairs["days_apart"] <= MAX_DAYS_APART]
+    within = pairs[pairs["same_plant"]]
+    geo_fit = fit_decay(close["distance_km"].to_numpy(), close["similarity"].to_numpy())
+    time_fit = fit_decay(within["days_apart"].to_numpy().astype(np.float64), within["similarity"].to_numpy())
+
+    geo_mantel = mantel(pairs["distance_km"].to_numpy(), distances)
+    time_mantel = mantel(pairs["days_apart"].to_numpy().astype(np.float64), distances)
+
+    summary = pd.DataFrame({
+        "Distanz (km)": {**geo_fit, "mantel_r": geo_mantel["r"], "mantel_p": geo_mantel["p"]},
+        "Zeit (Tage)": {**time_fit, "mantel_r": time_mantel["r"], "mantel_p": time_mantel["p"]},
+    })
+    print(f"\nDistanz- und Zeit-Abnahme der Ähnlichkeit ({len(runs)} Samples, {len(pairs)} Paare):\n")
+    print(summary.round(5))
+    plot_decay(pairs, geo_fit, time_fit)
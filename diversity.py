@@ -0,0 +1,197 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+
+from cohort import META_CSV, abundance_matrix, cached_runs, ingest_reports, load_metadata
+from replicates import pooled_abundance_matrix
+from shared import SharedArrays, worker_arrays
+from util import PLANT_NAME_MAP
+
+# This script computes alpha diversity (richness, Chao1, Shannon, Simpson) at several taxonomic ranks
+# and rarefaction curves for all samples. Rarefaction subsamples read counts directly
+# (hypergeometric draws per taxon, vectorized across samples) instead of expanding reads.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+RANKS = ["O", "F", "G", "S"]
+RAREFACTION_RANK = "S"
+N_DEPTHS = 20                  # Stützstellen der Rarefaction-Kurve
+N_ITER = 5                     # Subsampling-Wiederholungen pro Tiefe
+WORKERS = os.cpu_count()
+SEED = 42
+POOL_REPLICATES = False        # Technische Replikate auf Read-Ebene zusammenführen (replicates.py)
+# ============================================================
+
+
+def alpha_diversity(counts):
+    """Diversitätsindizes für alle Samples (Zeilen) einer Count-Matrix auf einmal."""
+    counts = np.asarray(counts, dtype=np.float64)
+    totals = counts.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = counts / totals[:, None]
+        shannon = -np.where(p > 0, p * np.log(p), 0).sum(axis=1)
+        simpson = 1 - (p ** 2).sum(axis=1)
+
+    richness = (counts > 0).sum(axis=1)
+    f1 = (counts == 1).sum(axis=1)
+    f2 = (counts == 2).sum(axis=1)
+    # Bias-korrigierter Chao1, auch für f2 = 0 definiert
+    chao1 = richness + f1 * (f1 - 1) / (2 * (f2 + 1))
+
+    return pd.DataFrame({
+        "reads": totals.astype(np.int64),
+        "richness": richness,
+        "chao1": chao1,
+        "shannon": shannon,
+        "simpson": simpson,
+        "evenness": np.where(richness > 1, shannon / np.log(np.maximum(richness, 2)), np.nan),
+    })
+
+
+def count_matrix(runs, rank, pooled=False):
+    """Read-Zählungen Runs × Taxa; pooled=True: eine Zeile pro Alias aus den gepoolten Reads."""
+    return pooled_abundance_matrix(runs, rank) if pooled else abundance_matrix(runs, rank)
+
+
+def alpha_diversity_by_rank(runs, ranks=RANKS, pooled=False):
+    tables = []
+    for rank in ranks:
+        counts = count_matrix(runs, rank, pooled)
+        table = alpha_diversity(counts.to_numpy())
+        table.index = counts.index
+        table["rank"] = rank
+        tables.append(table)
+    return pd.concat(tables).reset_index()
+
+
+def rarefy(counts, depth, rng):
+    """
+    Zieht ohne Zurücklegen `depth` Reads aus jedem Sample, direkt im Count-Raum. Die Taxa
+    werden wiederholt halbiert: pro Halbierungsebene bestimmt eine hypergeometrische Ziehung
+    (vektorisiert über alle Samples und Knoten), wie viele Reads in die linke Hälfte fallen.
+    Das sind log2(Taxa) NumPy-Aufrufe statt einer Ziehung pro Taxon. Samples mit weniger
+    als `depth` Reads ergeben eine Zeile aus -1.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    n_samples, n_taxa = counts.shape
+    totals = counts.sum(axis=1)
+    valid = totals >= depth
+
+    width = 1 << max(int(np.ceil(np.log2(max(n_taxa, 1)))), 0)
+    padded = np.zeros((n_samples, width), dtype=np.int64)
+    padded[:, :n_taxa] = counts
+
+    draws = np.where(valid, depth, 0)[:, None]
+    nodes = 1
+    while nodes < width:
+        blocks = padded.reshape(n_samples, nodes, 2, width // (2 * nodes)).sum(axis=3)
+        left, right = blocks[:, :, 0], blocks[:, :, 1]
+        drawn_left = rng.hypergeometric(left, right, draws)
+        draws = np.stack([drawn_left, draws - drawn_left], axis=2).reshape(n_samples, 2 * nodes)
+        nodes *= 2
+
+    result = draws[:, :n_taxa].copy()
+    result[~valid] = -1
+    return result
+
+
+def expected_richness(counts, depth):
+    """Erwartete Richness nach Rarefaction auf `depth` (Hurlbert), exakt und ohne Zufall."""
+    counts = np.asarray(counts, dtype=np.float64)
+    totals = counts.sum(axis=1, keepdims=True)
+
+    def log_binom(n, k):
+        return gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+
+    with np.errstate(invalid="ignore"):
+        absent = np.where(totals - counts >= depth,
+                          np.exp(log_binom(totals - counts, depth) - log_binom(totals, depth)), 0.0)
+    richness = np.where(counts > 0, 1 - absent, 0).sum(axis=1)
+    return np.where(totals[:, 0] >= depth, richness, np.nan)
+
+
+def _rarefaction_point(args):
+    depth, n_iter, seed = args
+    counts = worker_arrays()["counts"]
+    rng = np.random.default_rng(seed)
+    richness, shannon = [], []
+    for _ in range(n_iter):
+        sub = rarefy(counts, depth, rng)
+        table = alpha_diversity(np.maximum(sub, 0))
+        invalid = sub[:, 0] < 0
+        richness.append(np.where(invalid, np.nan, table["richness"]))
+        shannon.append(np.where(invalid, np.nan, table["shannon"]))
+    return depth, np.mean(richness, axis=0), np.mean(shannon, axis=0)
+
+
+def rarefaction_curves(counts, depths=None, n_iter=N_ITER, workers=WORKERS, seed=SEED):
+    """
+    Rarefaction-Kurven aller Samples. Jede Tiefe ist ein eigener Task im Prozess-Pool,
+    innerhalb einer Tiefe wird über die Samples vektorisiert. Die Count-Matrix liegt
+    einmal in Shared Memory statt in jedem Task.
+    """
+    matrix = counts.to_numpy()
+    if depths is None:
+        depths = np.unique(np.geomspace(100, matrix.sum(axis=1).max(), N_DEPTHS).astype(np.int64))
+
+    seeds = np.random.SeedSequence(seed).spawn(len(depths))
+    tasks = [(int(depth), n_iter, s) for depth, s in zip(depths, seeds)]
+
+    with SharedArrays(counts=matrix) as shared, shared.pool(workers) as pool:
+        points = list(pool.map(_rarefaction_point, tasks))
+
+    rows = []
+    for depth, richness, shannon in points:
+        expected = expected_richness(matrix, depth)
+        rows.append(pd.DataFrame({
+            "run": counts.index,
+            "depth": depth,
+            "richness": richness,
+            "expected_richness": expected,
+            "shannon": shannon,
+        }))
+    return pd.concat(rows, ignore_index=True)
+
+
+def plot_rarefaction(curves, metadata):
+    import matplotlib.pyplot as plt
+
+    curves = curves.dropna(subset=["richness"]).copy()
+    curves["PLANT"] = curves["run"].map(metadata["PLANT"]).map(lambda p: PLANT_NAME_MAP.get(p, p))
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    colors = dict(zip(sorted(curves["PLANT"].dropna().unique()), plt.cm.tab10.colors))
+    for run, curve in curves.groupby("run"):
+        ax.plot(curve["depth"], curve["richness"], color=colors.get(curve["PLANT"].iloc[0], "#BBBBBB"),
+                alpha=0.4, linewidth=0.8)
+
+    for plant, color in colors.items():
+        ax.plot([], [], color=color, label=plant)
+    ax.set_xscale("log")
+    ax.set_xlabel(f"Reads (Rang {RAREFACTION_RANK})")
+    ax.set_ylabel("Richness")
+    ax.set_title("Rarefaction Curves")
+    ax.legend(title="Plant", bbox_to_anchor=(1.02, 1), loc="upper left")
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == "__main__":
+    ingest_reports(verbose=False)
+    runs = cached_runs()
+    metadata = load_metadata(META_CSV)
+
+    alpha = alpha_diversity_by_rank(runs, pooled=POOL_REPLICATES)
+    alpha["PLANT"] = alpha["run"].map(metadata["PLANT"])
+
+    print("\nAlpha-Diversität pro Kläranlage (Mittelwerte):\n")
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(alpha.groupby(["rank", "PLANT"])[["reads", "richness", "chao1", "shannon", "simpson"]].mean().round(3))
+
+    curves = rarefaction_curves(count_matrix(runs, RAREFACTION_RANK, POOL_REPLICATES))
+    plot_rarefaction(curves, metadata)
@@ -1,15 +1,26 @@
+import argparse
 import os
 import subprocess
 import requests
-import sys
 import time
 
+from report_archive import ReportArchive
+
 # This script automates the download of FASTQ files from ENA, runs Kraken2 in a Docker container,
-# and manages the output files. It can be configured by changing the constants below.
+# and manages the output files. The reads of a run are downloaded once and classified against every
+# database in DATABASES at the same time (one container per database, all reading the same files);
+# each database gets its own report folder. It can be configured by changing the constants below.
 
 KRAKEN2_IMAGE = "staphb/kraken2:2.1.6-viral-20250402"
 OUTPUT_DIR = "kraken2_run"
-THREADS = 4
+THREADS = 4                    # pro Klassifikator
+
+# Name → (Docker-Image, Datenbank-Ordner auf dem Host oder None = im Image unter /kraken2-db).
+# DEFAULT_DATABASE schreibt nach OUTPUT_DIR, jede andere Datenbank nach OUTPUT_DIR_<Name>.
+DEFAULT_DATABASE = "viral-20250402"
+DATABASES = {
+    DEFAULT_DATABASE: (KRAKEN2_IMAGE, None),
+}
 
 
 def ena_fastq_links(run_accession):
@@ -85,41 +96,75 @@ def download_fastqs(urls, output_dir, max_retries=1000, chunk_size=1024*1024):
 
     return local_paths
 
-def run_kraken2(docker_image, run_accession, fastq_files, output_dir, threads):
-    docker_mount = os.path.abspath(output_dir)
-    fastq_inside = [os.path.basename(f) for f in fastq_files]
+def report_folder(database):
+    """Report-Ordner einer Datenbank: OUTPUT_DIR für DEFAULT_DATABASE, OUTPUT_DIR_<Name> für alle anderen."""
+    return OUTPUT_DIR if database == DEFAULT_DATABASE else f"{OUTPUT_DIR}_{database}"
+
+
+def report_archive_path(database):
+    """Report-Archiv einer Datenbank, neben ihrem Report-Ordner (kraken2_run.archive usw.)."""
+    return f"{report_folder(database)}.archive"
+
+
+def has_report(database, run_accession):
+    """True, wenn der Report als Textdatei im Report-Ordner oder im Archiv der Datenbank liegt."""
+    report_path = os.path.join(report_folder(database), f"{run_accession}_report.txt")
+    return os.path.exists(report_path) or run_accession in ReportArchive(report_archive_path(database))
+
 
-    output_report = os.path.join(output_dir, f"{run_accession}_report.txt")
-    output_output = os.path.join(output_dir, f"{run_accession}_output.txt")
+def kraken2_command(docker_image, db_path, run_accession, fastq_files, output_dir, threads):
+    fastq_dir = os.path.abspath(os.path.dirname(fastq_files[0]))
+    fastq_inside = [f"/reads/{os.path.basename(f)}" for f in fastq_files]
 
     kraken_cmd = [
         "docker", "run", "--rm",
-        "-v", f"{docker_mount}:/data",
+        "-v", f"{fastq_dir}:/reads:ro",
+        "-v", f"{os.path.abspath(output_dir)}:/data",
+    ]
+    if db_path is not None:
+        kraken_cmd += ["-v", f"{os.path.abspath(db_path)}:/kraken2-db:ro"]
+    kraken_cmd += [
         docker_image,
         "kraken2",
         "--db", "/kraken2-db",
         "--threads", str(threads),
         "--report", f"/data/{run_accession}_report.txt",
-        "--output", f"/data/{run_accession}_output.txt",
+        # Die Ausgabe pro Read wurde bisher nur geschrieben, um sie gleich wieder zu löschen
+        "--output", "/dev/null",
     ]
 
     if len(fastq_inside) == 2:
         kraken_cmd += ["--paired"] + fastq_inside
     else:
         kraken_cmd += fastq_inside
+    return kraken_cmd
+
 
-    print("\n→ Starte Kraken2 im Docker-Container:")
-    print(" ".join(kraken_cmd))
-    print()
+def run_kraken2(jobs, run_accession, fastq_files, threads):
+    """
+    Startet einen Kraken2-Container pro Datenbank gleichzeitig auf denselben FASTQ-Dateien und wartet
+    auf alle. jobs: Name → (Image, Datenbank-Ordner, Report-Ordner). Die Reads werden nur einmal von
+    der Platte gelesen, die anderen Container bekommen sie aus dem Page Cache.
+    """
+    processes = {}
+    for name, (docker_image, db_path, output_dir) in jobs.items():
+        os.makedirs(output_dir, exist_ok=True)
+        kraken_cmd = kraken2_command(docker_image, db_path, run_accession, fastq_files, output_dir, threads)
 
-    subprocess.run(kraken_cmd, check=True)
+        print(f"\n→ Starte Kraken2 ({name}) im Docker-Container:")
+        print(" ".join(kraken_cmd))
+        processes[name] = subprocess.Popen(kraken_cmd)
+
+    failed = [name for name, process in processes.items() if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f"❌ Kraken2 fehlgeschlagen für: {', '.join(failed)}")
 
     print("\n✔ Kraken2 abgeschlossen")
-    print(f"  Report: {output_report}")
-    print(f"  Output: {output_output}")
+    for name, (_, _, output_dir) in jobs.items():
+        print(f"  Report ({name}): {os.path.join(output_dir, f'{run_accession}_report.txt')}")
 
     # -------------------------------------------------------------
-    # CLEANUP: FASTQ-Dateien + Kraken-Output löschen
+    # CLEANUP: FASTQ-Dateien löschen (erst wenn alle Klassifikatoren fertig sind)
     # -------------------------------------------------------------
     print("→ Cleanup...")
     for fq in fastq_files:
@@ -128,42 +173,49 @@ def run_kraken2(docker_image, run_accession, fastq_files, output_dir, threads):
             print(f"  gelöscht: {fq}")
         except Exception as e:
             print(f"  konnte {fq} nicht löschen: {e}")
-
-    try:
-        os.remove(output_output)
-        print(f"  gelöscht: {output_output}")
-    except Exception as e:
-        print(f"  konnte {output_output} nicht löschen: {e}")
     print("✔ Cleanup abgeschlossen")
 
 
-def run_pipeline(run_accession):
+def run_pipeline(run_accession, databases=DATABASES):
     print(f"\n=== Kraken2 Pipeline für ENA Run {run_accession} ===\n")
 
-    report_path = os.path.join(OUTPUT_DIR, f"{run_accession}_report.txt")
+    missing = {}
+    for name, (docker_image, db_path) in databases.items():
+        output_dir = report_folder(name)
+        if has_report(name, run_accession):
+            print(f"✔ Report existiert bereits ({name}): {run_accession}")
+        else:
+            missing[name] = (docker_image, db_path, output_dir)
 
-    if os.path.exists(report_path):
-        print(f"✔ Report existiert bereits: {report_path}")
-    else:
+    if missing:
         fastq_urls = ena_fastq_links(run_accession)
         print(f"→ Gefundene FASTQ-Dateien: {fastq_urls}")
 
         fastq_paths = download_fastqs(fastq_urls, OUTPUT_DIR)
         print(f"→ Downloads gespeichert in {OUTPUT_DIR}")
 
-        run_kraken2(KRAKEN2_IMAGE, run_accession, fastq_paths, OUTPUT_DIR, THREADS)
+        run_kraken2(missing, run_accession, fastq_paths, THREADS)
 
     print("\n=== Fertig! ===\n")
 
 
+def parse_database(spec):
+    """NAME=IMAGE oder NAME=IMAGE@DB_ORDNER"""
+    name, _, image = spec.partition("=")
+    image, _, db_path = image.partition("@")
+    if not name or not image:
+        raise argparse.ArgumentTypeError(f"Erwartet NAME=IMAGE[@DB_ORDNER], erhalten: {spec}")
+    return name, (image, db_path or None)
+
+
 def main():
-    if len(sys.argv) != 2:
-        print("Verwendung:")
-        print("  python kraken_single.py <ENA_RUN_ACCESSION>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="FASTQ von ENA laden und mit Kraken2 klassifizieren")
+    parser.add_argument("run_accession")
+    parser.add_argument("--db", action="append", type=parse_database, metavar="NAME=IMAGE[@DB_ORDNER]",
+                        help="Datenbank (mehrfach angeben); Standard: DATABASES")
+    args = parser.parse_args()
 
-    run_accession = sys.argv[1]
-    run_pipeline(run_accession)
+    run_pipeline(args.run_accession, dict(args.db) if args.db else DATABASES)
 
 
 if __name__ == "__main__":
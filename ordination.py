@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import eigh
+from scipy.sparse.linalg import eigsh
+from scipy.spatial.distance import pdist, squareform
+
+from cohort import (CACHE_DIR, COUNT_VALUE, META_CSV, cached_runs, derived_path, ingest_reports, load_metadata,
+                    relative_abundance_matrix, save_derived)
+from replicates import grouping_key, pooled_relative_abundance_matrix, replicate_groups
+from util import PLANT_NAME_MAP
+
+# This script computes a sample-level PCoA from the Bray-Curtis distance matrix, so the structure
+# within and between plants becomes visible without averaging samples per plant first.
+# Distances and ordinations are cached per cohort and rank. With POOL_REPLICATES the technical replicates
+# of each alias are pooled at read level first (replicates.py), one row per alias.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXON_LEVEL = "S"
+N_AXES = 10                    # Anzahl berechneter Hauptkoordinaten
+POOL_REPLICATES = False        # Technische Replikate auf Read-Ebene zusammenführen (replicates.py)
+# ============================================================
+
+
+def _pooling(runs, pooled):
+    """
+    (Präfix-Zusatz, Hash-Zusatz, Runs der Zeilen) für derived_path. Gepoolt vertritt der erste Run jedes
+    Alias die Probe, und das Ergebnis hängt zusätzlich von der Zuordnung Alias → Runs ab.
+    """
+    if not pooled:
+        return "", "", runs
+    groups = replicate_groups(runs, load_metadata(META_CSV))
+    return "_pooled", grouping_key(groups), sorted(group[0] for group in groups.values())
+
+
+def bray_curtis_distances(runs=None, taxon_level=TAXON_LEVEL, cache_dir=CACHE_DIR, pooled=False):
+    """
+    Bray-Curtis-Distanzmatrix aller Samples (kondensiert, wie scipy.pdist), gecacht pro Kohorte und Level.
+    pooled=True: eine Zeile pro Alias aus den gepoolten Reads (replicates.pooled_relative_abundance_matrix).
+    """
+    if runs is None:
+        runs = cached_runs(cache_dir)
+    runs = list(runs)
+
+    suffix, extra, rows = _pooling(runs, pooled)
+    path = derived_path(f"braycurtis_{taxon_level or 'all'}_{COUNT_VALUE}{suffix}", runs, cache_dir, extra)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return data["distances"], list(data["runs"])
+
+    if pooled:
+        rel = pooled_relative_abundance_matrix(runs, taxon_level, cache_dir=cache_dir).reindex(rows)
+    else:
+        rel = relative_abundance_matrix(runs, taxon_level, cache_dir)
+    distances = pdist(rel.to_numpy(), metric="braycurtis")
+    save_derived(path, distances=distances, runs=np.array(rows, dtype="U32"))
+    return distances, rows
+
+
+def pcoa(distances, n_axes=N_AXES):
+    """
+    Hauptkoordinatenanalyse. Für große Matrizen werden nur die n_axes größten Eigenwerte
+    mit ARPACK (eigsh) bestimmt statt der vollständigen Zerlegung.
+    """
+    d = squareform(distances) if distances.ndim == 1 else distances
+    n = d.shape[0]
+
+    # Doppelte Zentrierung von -0.5 * D² ohne explizite Zentrierungsmatrix
+    b = -0.5 * d ** 2
+    b -= b.mean(axis=0, keepdims=True)
+    b -= b.mean(axis=1, keepdims=True)
+
+    k = min(n_axes, n - 1)
+    if n <= 2 * k + 1:
+        eigvals, eigvecs = eigh(b, subset_by_index=[n - k, n - 1])
+    else:
+        eigvals, eigvecs = eigsh(b, k=k, which="LA")
+
+    order = np.argsort(eigvals)[::-1]
+    eigvals, eigvecs = eigvals[order], eigvecs[:, order]
+    positive = np.clip(eigvals, 0, None)
+    coords = eigvecs * np.sqrt(positive)
+
+    # Anteil an der Gesamtvarianz (Spur von B = Summe aller Eigenwerte)
+    explained = eigvals / np.trace(b)
+    return coords, eigvals, explained
+
+
+def sample_pcoa(runs=None, taxon_level=TAXON_LEVEL, n_axes=N_AXES, cache_dir=CACHE_DIR, pooled=False):
+    """PCoA der Samples als DataFrame (PC1..PCk), gecacht pro Kohorte, Level und Achsenzahl."""
+    if runs is None:
+        runs = cached_runs(cache_dir)
+    runs = list(runs)
+
+    suffix, extra, rows = _pooling(runs, pooled)
+    path = derived_path(f"pcoa{n_axes}_{taxon_level or 'all'}_{COUNT_VALUE}{suffix}", runs, cache_dir, extra)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            coords, explained = data["coords"], data["explained"]
+        runs = rows
+    else:
+        distances, runs = bray_curtis_distances(runs, taxon_level, cache_dir, pooled)
+        coords, _, explained = pcoa(distances, n_axes)
+        save_derived(path, coords=coords, explained=explained)
+
+    axes = [f"PC{i + 1}" for i in range(coords.shape[1])]
+    return pd.DataFrame(coords, index=pd.Index(runs, name="run"), columns=axes), pd.Series(explained, index=axes)
+
+
+def plot_pcoa(coords, explained, metadata):
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    meta = metadata.reindex(coords.index)
+    fig, (ax_plant, ax_date) = plt.subplots(1, 2, figsize=(13, 5), sharex=True, sharey=True)
+
+    for plant, group in coords.groupby(meta["PLANT"].values):
+        ax_plant.scatter(group["PC1"], group["PC2"], s=14, label=PLANT_NAME_MAP.get(plant, plant))
+    ax_plant.legend(title="Plant", fontsize=8)
+    ax_plant.set_title("PCoA by Plant")
+
+    points = ax_date.scatter(coords["PC1"], coords["PC2"], s=14, c=mdates.date2num(meta["DATE"]), cmap="viridis")
+    cbar = plt.colorbar(points, ax=ax_date)
+    cbar.ax.yaxis.set_major_formatter(mdates.DateFormatter("%Y-%m"))
+    cbar.set_label("Collection Date")
+    ax_date.set_title("PCoA by Collection Date")
+
+    for ax in (ax_plant, ax_date):
+        ax.set_xlabel(f"PC1 ({explained['PC1']:.1%})")
+        ax.set_ylabel(f"PC2 ({explained['PC2']:.1%})")
+
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == "__main__":
+    ingest_reports(verbose=False)
+    metadata = load_metadata(META_CSV)
+
+    coords, explained = sample_pcoa(pooled=POOL_REPLICATES)
+    print("\nErklärte Varianz:\n")
+    print(explained.round(4))
+    plot_pcoa(coords, explained, metadata)
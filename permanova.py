@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import eigh
+from scipy.spatial.distance import squareform
+
+from cohort import META_CSV, cached_runs, ingest_reports, load_metadata
+from ordination import bray_curtis_distances
+from shared import SharedArrays, worker_arrays
+
+# This script tests whether plants, collection dates and replicates differ in their viral composition:
+# PERMANOVA (differences in location) and PERMDISP (differences in dispersion) on the sample-level
+# Bray-Curtis matrix. Label permutations are evaluated in batches as matrix products and split
+# across a process pool.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXON_LEVEL = "S"
+FACTORS = ["PLANT", "COLLECTION_DATE", "REPLICA"]
+N_PERM = 9999
+WORKERS = os.cpu_count()
+BATCH_MEMORY_MB = 64           # Speicher pro Permutations-Batch
+SEED = 42
+POOL_REPLICATES = False        # Replikate auf Read-Ebene zusammenführen (replicates.py); REPLICA entfällt dann
+# ============================================================
+
+
+def _ss_within(d2, labels, inv_sqrt_sizes, n_groups):
+    """
+    SS_W für mehrere Label-Vektoren (Zeilen von labels) auf einmal:
+    SS_W = 0.5 * spur(Aᵀ D² A) mit A = One-Hot(labels) / sqrt(Gruppengröße).
+    """
+    n_batch, n = labels.shape
+    a = np.zeros((n, n_batch * n_groups))
+    cols = labels + n_groups * np.arange(n_batch)[:, None]
+    a[np.arange(n)[None, :].repeat(n_batch, axis=0), cols] = inv_sqrt_sizes[labels]
+
+    m = d2 @ a
+    return 0.5 * (a * m).sum(axis=0).reshape(n_batch, n_groups).sum(axis=1)
+
+
+def _pseudo_f(ss_total, ss_within, n, n_groups):
+    return ((ss_total - ss_within) / (n_groups - 1)) / (ss_within / (n - n_groups))
+
+
+def _permanova_chunk(args):
+    n_groups, n_perm, batch, seed = args
+    arrays = worker_arrays()
+    d2, labels = arrays["d2"], arrays["labels"]
+    rng = np.random.default_rng(seed)
+    n = len(labels)
+    sizes = np.bincount(labels, minlength=n_groups)
+    inv_sqrt_sizes = 1 / np.sqrt(sizes)
+    ss_total = d2.sum() / (2 * n)
+
+    f_values = []
+    for start in range(0, n_perm, batch):
+        perms = rng.permuted(np.tile(labels, (min(batch, n_perm - start), 1)), axis=1)
+        f_values.append(_pseudo_f(ss_total, _ss_within(d2, perms, inv_sqrt_sizes, n_groups), n, n_groups))
+    return np.concatenate(f_values)
+
+
+def _encode(values):
+    codes, uniques = pd.factorize(pd.Series(values), sort=True)
+    return codes.astype(np.int64), len(uniques)
+
+
+def _chunks(n_perm, workers):
+    sizes = np.full(workers, n_perm // workers)
+    sizes[: n_perm % workers] += 1
+    return [int(s) for s in sizes if s > 0]
+
+
+def permanova(distances, groups, n_perm=N_PERM, workers=WORKERS, seed=SEED):
+    """Einfaktorielle PERMANOVA (Anderson 2001). Gibt pseudo-F, R² und den Permutations-p-Wert zurück."""
+    d2 = squareform(distances) ** 2 if distances.ndim == 1 else distances ** 2
+    labels, n_groups = _encode(groups)
+    n = len(labels)
+
+    sizes = np.bincount(labels, minlength=n_groups)
+    ss_total = d2.sum() / (2 * n)
+    ss_within = _ss_within(d2, labels[None, :], 1 / np.sqrt(sizes), n_groups)[0]
+    f_obs = _pseudo_f(ss_total, ss_within, n, n_groups)
+
+    batch = max(1, BATCH_MEMORY_MB * 2**20 // (8 * n * n_groups))
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    tasks = [(n_groups, size, batch, s) for size, s in zip(_chunks(n_perm, workers), seeds)]
+    with SharedArrays(d2=d2, labels=labels) as shared, shared.pool(workers) as pool:
+        f_perm = np.concatenate(list(pool.map(_permanova_chunk, tasks)))
+
+    return {
+        "groups": n_groups,
+        "pseudo_F": f_obs,
+        "R2": 1 - ss_within / ss_total,
+        "p": (np.sum(f_perm >= f_obs) + 1) / (n_perm + 1),
+    }
+
+
+def centroid_distances(distances, groups):
+    """
+    Abstand jedes Samples zum Zentroid seiner Gruppe im PCoA-Raum (Anderson 2006). Achsen mit
+    negativen Eigenwerten (Bray-Curtis ist nicht euklidisch) gehen mit negativem Vorzeichen ein.
+    """
+    d = squareform(distances) if distances.ndim == 1 else distances
+    b = -0.5 * d ** 2
+    b -= b.mean(axis=0, keepdims=True)
+    b -= b.mean(axis=1, keepdims=True)
+
+    eigvals, eigvecs = eigh(b)
+    keep = np.abs(eigvals) > 1e-10 * np.abs(eigvals).max()
+    eigvals, eigvecs = eigvals[keep], eigvecs[:, keep]
+    coords = eigvecs * np.sqrt(np.abs(eigvals))
+
+    labels, n_groups = _encode(groups)
+    sizes = np.bincount(labels, minlength=n_groups)
+    centroids = np.zeros((n_groups, coords.shape[1]))
+    np.add.at(centroids, labels, coords)
+    centroids /= sizes[:, None]
+
+    squared = ((coords - centroids[labels]) ** 2 * np.sign(eigvals)).sum(axis=1)
+    return np.sqrt(np.clip(squared, 0, None))
+
+
+def _anova_f(values, labels, n_groups):
+    """F-Statistik einer einfaktoriellen ANOVA für mehrere Label-Vektoren (Zeilen) auf einmal."""
+    n_batch, n = labels.shape
+    sizes = np.bincount(labels[0], minlength=n_groups)
+    flat = (labels + n_groups * np.arange(n_batch)[:, None]).ravel()
+    sums = np.bincount(flat, weights=np.tile(values, n_batch), minlength=n_batch * n_groups).reshape(n_batch, n_groups)
+
+    grand = values.mean()
+    ss_between = (sums ** 2 / sizes).sum(axis=1) - n * grand ** 2
+    ss_within = (values ** 2).sum() - (sums ** 2 / sizes).sum(axis=1)
+    return (ss_between / (n_groups - 1)) / (ss_within / (n - n_groups))
+
+
+def permdisp(distances, groups, n_perm=N_PERM, seed=SEED):
+    """PERMDISP: ANOVA der Zentroid-Abstände, p-Wert über permutierte Gruppenzuordnung."""
+    z = centroid_distances(distances, groups)
+    labels, n_groups = _encode(groups)
+    f_obs = _anova_f(z, labels[None, :], n_groups)[0]
+
+    rng = np.random.default_rng(seed)
+    perms = rng.permuted(np.tile(labels, (n_perm, 1)), axis=1)
+    f_perm = _anova_f(z, perms, n_groups)
+    return {"F": f_obs, "p": (np.sum(f_perm >= f_obs) + 1) / (n_perm + 1)}
+
+
+if __name__ == "__main__":
+    ingest_reports(verbose=False)
+    metadata = load_metadata(META_CSV)
+    distances, runs = bray_curtis_distances(cached_runs(), TAXON_LEVEL, pooled=POOL_REPLICATES)
+    meta = metadata.loc[runs]
+    factors = [factor for factor in FACTORS if not (POOL_REPLICATES and factor == "REPLICA")]
+
+    results = []
+    for factor in factors:
+        print(f"→ {factor}")
+        result = {"factor": factor}
+        result.update(permanova(distances, meta[factor].to_numpy()))
+        disp = permdisp(distances, meta[factor].to_numpy())
+        result.update({"PERMDISP_F": disp["F"], "PERMDISP_p": disp["p"]})
+        results.append(result)
+
+    print(f"\nPERMANOVA / PERMDISP ({N_PERM} Permutationen, Level {TAXON_LEVEL}):\n")
+    with pd.option_context("display.width", 200):
+        print(pd.DataFrame(results).set_index("factor").round(4))
@@ -1,10 +1,9 @@
-import os
-from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.spatial.distance import braycurtis
 
-from util import PLANT_NAME_MAP
+from cohort import (iter_report_blocks, load_manifest, quarantined_runs, report_file, report_sources, track_peak_memory,
+                    virus_reads)
+from replicates import pooled_reports
 
 # This script calculaes the Bray-Curtis similarity between treatment plants on the basis of viral taxonomic profiles.
 # The taxonomic profiles are aggregated per plant from Kraken2 reports.
@@ -16,6 +15,9 @@ from util import PLANT_NAME_MAP
 REPORT_DIR = "kraken2_run"
 META_CSV = "samples.csv"
 TAXON_LEVEL = None
+OUT_OF_CORE = False             # Reports blockweise aus dem Cache streamen statt alle zu laden
+MEMORY_BUDGET_MB = 256
+POOL_REPLICATES = False         # Technische Replikate auf Read-Ebene zusammenführen (replicates.py), nutzt den Cache
 # ============================================================
 
 
@@ -53,15 +55,16 @@ def load_metadata(csv_path):
 def build_sample_matrix(metadata):
     rows = []
     meta_rows = []
+    quarantine = quarantined_runs(REPORT_DIR)
+    # Textdateien und Reports, die nur im Archiv liegen (report_archive.py)
+    available = report_sources(REPORT_DIR)
 
     for _, row in metadata.iterrows():
         run = row["ENA_RUN_ACCESSION"]
-        report = os.path.join(REPORT_DIR, f"{run}_report.txt")
-
-        if not os.path.exists(report):
+        if run in quarantine or run not in available:
             continue
 
-        rel = parse_kraken2_report(report, TAXON_LEVEL)
+        rel = parse_kraken2_report(report_file(run, REPORT_DIR), TAXON_LEVEL)
         if rel is None:
             continue
 
@@ -80,52 +83,106 @@ def aggregate_by_plant(df, meta_df):
     return plant_profiles
 
 
-def compute_similarity_matrix(plant_profiles):
-    plants = plant_profiles.index
-    sim = pd.DataFrame(index=plants, columns=plants, dtype=float)
+def direct_abundances(report, taxon_level):
+    """Wie parse_kraken2_report, aber auf einem gecachten Report"""
+    virus_reads_total = virus_reads(report)
+    if virus_reads_total == 0:
+        return None
 
-    for p1 in plants:
-        for p2 in plants:
-            bc = braycurtis(plant_profiles.loc[p1], plant_profiles.loc[p2])
-            sim.loc[p1, p2] = 1 - bc
+    if taxon_level is not None:
+        report = report[report["rank_code"] == taxon_level]
+
+    report = report[report["reads_direct"] > 0]
+    return (report["reads_clade"] / virus_reads_total).groupby(report["name"]).sum()
+
+
+def accumulate_plant_profiles(metadata, taxon_level, memory_budget_mb=MEMORY_BUDGET_MB):
+    """
+    Out-of-core-Variante von build_sample_matrix + aggregate_by_plant: Die Reports werden
+    blockweise gestreamt und pro Kläranlage nur die Summe der Profile und die Anzahl
+    Samples behalten. Der Speicher wächst mit der Anzahl Taxa, nicht mit der Anzahl Runs.
+    """
+    quarantine = quarantined_runs(REPORT_DIR)
+    manifest = load_manifest()
+    plant_of_run = dict(zip(metadata["ENA_RUN_ACCESSION"], metadata["PLANT"]))
+    runs = [run for run in metadata["ENA_RUN_ACCESSION"] if run in manifest and run not in quarantine]
+
+    sums, counts = None, None
+    for block in iter_report_blocks(runs, memory_budget_mb=memory_budget_mb, with_names=True):
+        rels = {run: direct_abundances(report, taxon_level) for run, report in block}
+        rels = {run: rel for run, rel in rels.items() if rel is not None}
+        if not rels:
+            continue
 
-    return sim
+        plants = [plant_of_run[run] for run in rels]
+        block_rel = pd.concat(rels.values(), keys=plants, names=["PLANT", "name"])
+        block_sums = block_rel.groupby(level=["PLANT", "name"]).sum()
+        block_counts = pd.Series(plants).value_counts()
 
-def plot_similarity_heatmap(similarity_df):
-    fig, ax = plt.subplots(figsize=(6, 5))
+        if sums is None:
+            sums, counts = block_sums, block_counts
+        else:
+            sums = sums.add(block_sums, fill_value=0)
+            counts = counts.add(block_counts, fill_value=0)
 
-    im = ax.imshow(
-        similarity_df.values,
-        vmin=0,
-        vmax=1,
-        aspect="auto"
-    )
+    if sums is None:
+        raise RuntimeError("Keine passenden Reports gefunden!")
 
-    # Achsenbeschriftungen
-    ax.set_xticks(np.arange(len(similarity_df.columns)))
-    ax.set_yticks(np.arange(len(similarity_df.index)))
+    plant_sums = sums.unstack("name", fill_value=0)
+    return plant_sums.div(counts.reindex(plant_sums.index), axis=0)
 
-    ax.set_xticklabels((PLANT_NAME_MAP.get(col, col) for col in similarity_df.columns), rotation=45, ha="right")
-    ax.set_yticklabels((PLANT_NAME_MAP.get(row, row) for row in similarity_df.index))
 
-    # Farbskala
-    cbar = plt.colorbar(im, ax=ax)
-    cbar.set_label("Bray-Curtis Similarity", rotation=90)
+def pooled_plant_profiles(metadata, taxon_level):
+    """
+    Wie accumulate_plant_profiles, aber aus den gecachten gepoolten Reports (replicates.py): jedes Alias
+    geht mit einem Profil aus allen Reads seiner Replikate in den Mittelwert der Kläranlage ein.
+    """
+    quarantine = quarantined_runs(REPORT_DIR)
+    manifest = load_manifest()
+    plant_of_run = dict(zip(metadata["ENA_RUN_ACCESSION"], metadata["PLANT"]))
+    runs = [run for run in metadata["ENA_RUN_ACCESSION"] if run in manifest and run not in quarantine]
 
-    ax.set_title("Viral Similarity between Treatment Plants")
+    rels = {run: direct_abundances(report, taxon_level) for run, report in pooled_reports(runs, with_names=True).items()}
+    rels = {run: rel for run, rel in rels.items() if rel is not None}
+    if not rels:
+        raise RuntimeError("Keine passenden Reports gefunden!")
 
-    plt.tight_layout()
-    plt.show()
+    plants = [plant_of_run[run] for run in rels]
+    long = pd.concat(rels.values(), keys=plants, names=["PLANT", "name"])
+    plant_sums = long.groupby(level=["PLANT", "name"]).sum().unstack("name", fill_value=0)
+    return plant_sums.div(pd.Series(plants).value_counts().reindex(plant_sums.index), axis=0)
 
 
-if __name__ == "__main__":
+def compute_similarity_matrix(plant_profiles):
+    """Bray-Curtis-Ähnlichkeit aller Kläranlagen-Paare, eine Zeile der Matrix pro NumPy-Operation."""
+    values = plant_profiles.to_numpy(dtype=float)
+    difference = np.array([np.abs(values - row).sum(axis=1) for row in values])
+    total = values.sum(axis=1)
+    sim = 1 - difference / (total[:, None] + total[None, :])
+    return pd.DataFrame(sim, index=plant_profiles.index, columns=plant_profiles.index)
+
+
+def main():
     metadata = load_metadata(META_CSV)
-    abundance, meta_df = build_sample_matrix(metadata)
 
-    plant_profiles = aggregate_by_plant(abundance, meta_df)
+    if POOL_REPLICATES:
+        plant_profiles = pooled_plant_profiles(metadata, TAXON_LEVEL)
+    elif OUT_OF_CORE:
+        with track_peak_memory("Plant-Profile (out-of-core)"):
+            plant_profiles = accumulate_plant_profiles(metadata, TAXON_LEVEL)
+    else:
+        abundance, meta_df = build_sample_matrix(metadata)
+        plant_profiles = aggregate_by_plant(abundance, meta_df)
+
     similarity = compute_similarity_matrix(plant_profiles)
 
     print("\nBray-Curtis Similarity zwischen Klärwerken:\n")
     with pd.option_context('display.max_rows', None, 'display.max_columns', None):
         print(similarity.round(3))
+
+    from plotting import plot_similarity_heatmap
     plot_similarity_heatmap(similarity)
+
+
+if __name__ == "__main__":
+    main()
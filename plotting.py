@@ -0,0 +1,248 @@
+from functools import lru_cache
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+from matplotlib.collections import PolyCollection
+from matplotlib.patches import Patch
+
+from taxonomy import load_taxonomy
+from util import FAMILY_COLOR_MAP, GENUS_COLOR_MAP, ORDER_COLOR_MAP, PLANT_NAME_MAP, TAXON_IDS
+
+# This module holds the plots of similarity.py, randomization.py, plant_similarity.py and zeitreihe.py.
+# Those modules only import it inside their main(), so importing them for their numbers (api.py, the
+# analysis server, scheduled jobs) does not load matplotlib and seaborn.
+# Stacked charts are drawn from cumulative sums computed once in NumPy, with one collection per taxon layer
+# (instead of one patch per bar and taxon as pandas does), so charts over all samples render in seconds.
+# With a lineage index (taxonomy.py) colours and legend order are keyed by taxid (util.TAXON_IDS) and
+# matched against the taxdump's current names, so taxa renamed in a new database keep their colour.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+RASTERIZE_ABOVE = 200          # Layer mit mehr Balken/Stützpunkten werden in PDF/SVG als Bild eingebettet
+MAX_TICK_LABELS = 60           # bei mehr Samples wird nur jede n-te Beschriftung gezeigt
+# ============================================================
+
+COLOR_MAPS = {"O": ORDER_COLOR_MAP, "F": FAMILY_COLOR_MAP, "G": GENUS_COLOR_MAP}
+
+ORDERED_TAXA = {
+    "O": ["Crassvirales", "Timlovirales", "Chitovirales", "Imitervirales","Herpesvirales", "Tubulavirales", "Lefavirales", "Bunyavirales","Pimascovirales", "Algavirales", "Halopanivirales","Mononegavirales", "Rowavirales", "Picornavirales","Other"],
+    "F": ["Intestiviridae","Suoliviridae","Peduoviridae","Crevaviridae","Herelleviridae","Kyanoviridae","Straboviridae","Schitoviridae","Steitzviridae","Steigviridae","Autographiviridae","Demerecviridae","Mimiviridae","Poxviridae","Arenbergviridae","Other"],
+    "G": [ "Carjivirus", "Burzaovirus", "Punavirus", "Agtrevirus", "Betabaculovirus", "Gihfavirus", "Casadabanvirus", "Purivirus", "Baikalvirus", "Pamexvirus", "Immutovirus", "Other", "Unassigned" ],
+}
+
+
+@lru_cache(maxsize=1)
+def _taxonomy():
+    return load_taxonomy()
+
+
+def taxon_label(name):
+    """Aktueller Name eines Taxons der Farbtabellen: über seine Taxid aus dem Lineage-Index, sonst der Name selbst."""
+    taxonomy = _taxonomy()
+    taxid = TAXON_IDS.get(name)
+    if taxonomy is None or taxid is None:
+        return name
+    return taxonomy.name(taxid) or name
+
+
+def color_map(taxon_level):
+    """Name → Farbe für ein Level (None, wenn es keine Farbtabelle gibt)."""
+    colors = COLOR_MAPS.get(taxon_level)
+    if colors is None:
+        return None
+    return {taxon_label(name): color for name, color in colors.items()}
+
+
+def ordered_taxa(taxon_level):
+    return [taxon_label(name) for name in ORDERED_TAXA[taxon_level]]
+
+
+# ============================================================
+# ÄHNLICHKEITEN
+# ============================================================
+
+def plot_similarity_histogram(values, title, ylabel="Count"):
+    ax = sns.histplot(values)
+    ax.set_xlabel("Bray-Curtis Similarity")
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_similarity_heatmap(similarity_df):
+    fig, ax = plt.subplots(figsize=(6, 5))
+
+    im = ax.imshow(
+        similarity_df.values,
+        vmin=0,
+        vmax=1,
+        aspect="auto"
+    )
+
+    # Achsenbeschriftungen
+    ax.set_xticks(np.arange(len(similarity_df.columns)))
+    ax.set_yticks(np.arange(len(similarity_df.index)))
+
+    ax.set_xticklabels((PLANT_NAME_MAP.get(col, col) for col in similarity_df.columns), rotation=45, ha="right")
+    ax.set_yticklabels((PLANT_NAME_MAP.get(row, row) for row in similarity_df.index))
+
+    # Farbskala
+    cbar = plt.colorbar(im, ax=ax)
+    cbar.set_label("Bray-Curtis Similarity", rotation=90)
+
+    ax.set_title("Viral Similarity between Treatment Plants")
+
+    plt.tight_layout()
+    plt.show()
+
+
+# ============================================================
+# GESTAPELTE LAYER
+# ============================================================
+
+def layer_colors(columns, taxon_level):
+    colors = color_map(taxon_level)
+    if colors is None:
+        return [f"C{i % 10}" for i in range(len(columns))]
+    return [colors.get(taxon, "#BBBBBB") for taxon in columns]
+
+
+def stacked_bounds(values):
+    """Untere und obere Kante jedes Layers (Zeilen = x-Positionen, Spalten = Taxa) aus einer kumulativen Summe."""
+    top = np.cumsum(values, axis=1)
+    return top - values, top
+
+
+def draw_stacked_bars(ax, pivot_plot, colors, width=0.8):
+    """
+    Gestapelte Balken, Zeilen von pivot_plot = Balken. Jedes Taxon ist eine PolyCollection aus den
+    Rechtecken aller Balken, in denen es vorkommt.
+    """
+    values = pivot_plot.to_numpy(dtype=float)
+    bottom, top = stacked_bounds(values)
+    x = np.arange(len(values))
+    rasterized = len(values) > RASTERIZE_ABOVE
+
+    for i, (taxon, color) in enumerate(zip(pivot_plot.columns, colors)):
+        present = values[:, i] > 0
+        left, right = x[present] - width / 2, x[present] + width / 2
+        low, high = bottom[present, i], top[present, i]
+        # (Balken, 4 Ecken, xy)
+        vertices = np.stack([np.column_stack(corner) for corner in [(left, low), (left, high), (right, high), (right, low)]],
+                            axis=1)
+        ax.add_collection(PolyCollection(vertices, facecolors=color, edgecolors="none", label=taxon,
+                                         rasterized=rasterized))
+
+    ax.set_xlim(-0.5, len(values) - 0.5)
+    ax.set_ylim(0, max(1.0, top[:, -1].max(initial=0)))
+
+
+def draw_stacked_area(ax, x, pivot_plot, colors):
+    """Gestapelte Flächen über x, eine Fläche pro Taxon; x als Zahlen (z.B. mdates.date2num)."""
+    values = pivot_plot.to_numpy(dtype=float)
+    bottom, top = stacked_bounds(values)
+    rasterized = len(values) > RASTERIZE_ABOVE
+
+    for i, (taxon, color) in enumerate(zip(pivot_plot.columns, colors)):
+        ax.fill_between(x, bottom[:, i], top[:, i], facecolor=color, linewidth=0, label=taxon, rasterized=rasterized)
+
+    # Keine festen x-Grenzen: bei sharex sollen alle Kläranlagen ihren ganzen Zeitraum zeigen
+    ax.margins(x=0)
+    ax.set_ylim(0, max(1.0, top[:, -1].max(initial=0)))
+
+
+def date_positions(index):
+    """Datums-Index als Matplotlib-Zahlen, ohne die Periodenumrechnung von pandas' Zeitreihen-Plots."""
+    return mdates.date2num(np.asarray(index, dtype="datetime64[ns]"))
+
+
+def plot_stacked_composition(pivot_plot, taxon_level):
+    """Zusammensetzung pro Sample als gestapelte Balken (stacked_bar_chart.py), auch für alle Samples."""
+    n = len(pivot_plot)
+    fig, ax = plt.subplots(figsize=(max(6.4, min(0.12 * n, 40)), 4.8))
+    draw_stacked_bars(ax, pivot_plot, layer_colors(pivot_plot.columns, taxon_level))
+
+    step = max(1, int(np.ceil(n / MAX_TICK_LABELS)))
+    ticks = np.arange(0, n, step)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(pivot_plot.index[ticks], rotation=90)
+
+    ax.set_ylabel("Relative Abundance")
+    ax.set_title(f"Viral composition at taxonomic level '{taxon_level}'")
+    ax.legend(title="Taxon", bbox_to_anchor=(1.05, 1), loc="upper left", ncol=int(np.ceil(len(pivot_plot.columns) / 25)))
+    plt.tight_layout()
+    plt.show()
+
+
+# ============================================================
+# ZEITREIHEN
+# ============================================================
+
+def plot_all_plants(series_by_plant, taxon_level):
+    plants = sorted(series_by_plant)
+    n = len(plants)
+
+    fig, axes = plt.subplots(n, 1, figsize=(12, 3*n), sharex=True)
+    plt.subplots_adjust(hspace=0.4)
+    if n == 1:
+        axes = [axes]
+
+    all_taxa = set()
+
+    for ax, plant in zip(axes, plants):
+        pivot_plot = series_by_plant[plant]
+        if pivot_plot is None or pivot_plot.empty:
+            continue
+
+        all_taxa.update(pivot_plot.columns)
+
+        draw_stacked_area(ax, date_positions(pivot_plot.index), pivot_plot, layer_colors(pivot_plot.columns, taxon_level))
+        ax.xaxis_date()
+
+        ax.set_title(PLANT_NAME_MAP.get(plant, plant))
+        ax.xaxis.set_major_locator(mdates.MonthLocator(bymonth=[3,6,9,12], interval=1))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m"))
+
+        ax.xaxis.set_minor_locator(mdates.MonthLocator())
+
+
+    axes[int(n/2)].set_ylabel("Relative Abundance")
+    axes[-1].set_xlabel("Date")
+
+    legend_taxa = [t for t in ordered_taxa(taxon_level) if t in all_taxa]
+
+    add_global_legend(axes[-1], legend_taxa, taxon_level)
+    plt.show()
+
+
+def add_global_legend(ax, taxa, taxon_level):
+    colors = color_map(taxon_level)
+
+    handles = [
+        Patch(facecolor=colors.get(t, "#BBBBBB"), label=t)
+        for t in taxa
+    ]
+
+    ax.legend(
+        handles=handles,
+        title="Viral order",
+        loc="lower left",
+        bbox_to_anchor=(1.01, 3)
+    )
+
+def plot_single_plant(pivot_plot, plant, taxon_level):
+    fig, ax = plt.subplots()
+    draw_stacked_area(ax, date_positions(pivot_plot.index), pivot_plot, layer_colors(pivot_plot.columns, taxon_level))
+    ax.xaxis_date()
+    plt.title(f"Relative Virus-Häufigkeiten über Zeit ({plant})")
+    plt.ylabel("Relative Häufigkeit")
+    plt.xlabel("Datum")
+    plt.legend(title="Order", bbox_to_anchor=(1.05,1), loc="upper left")
+    plt.tight_layout()
+    plt.show()
@@ -1,11 +1,13 @@
-import os
 import numpy as np
 import pandas as pd
 
-# This script calculates the proportion of specific virus taxa in Kraken2 reports.
-# It can be configured by changing the constants below.
+from cohort import INPUT_FOLDER, META_CSV, VIRUSES_TAXID, load_metadata, load_taxa, quarantined_runs
+from taxon_index import parents, postings, update_index
 
-INPUT_FOLDER = "kraken2_run"
+# This script calculates the proportion of named groups of virus taxa in Kraken2 reports.
+# All groups are evaluated in one pass over the taxon index, matched by taxid, and nested
+# members of a group (e.g. a family below an order of the same group) are only counted once.
+# It can be configured by changing the constants below.
 
 TAXA = {
     "Caudoviricetes",
@@ -20,33 +22,91 @@ TAXA = {
     "Vinavirales"
 }
 
-def parse_kraken2_report(path):
-    """Liest Kraken2-Report ein und gibt DataFrame aller Taxa zurück"""
-    df = pd.read_csv(
-        path,
-        sep="\t",
-        header=None,
-        names=["percent", "reads_clade", "reads_direct", "rank_code", "ncbi_taxid", "name"],
-        dtype={"name": str}
+# Gruppenname → Taxon-Namen oder Taxids
+TAXON_GROUPS = {
+    "TAXA": TAXA,
+    "Crassvirales": {"Crassvirales"},
+    "Carjivirus": {"Carjivirus"},
+}
+
+MAX_DEPTH = 64
+
+
+def resolve_group(members, taxa):
+    """Übersetzt Namen und Taxids einer Gruppe in Taxids (Namen können mehrfach vorkommen)."""
+    taxids = set()
+    for member in members:
+        if isinstance(member, (int, np.integer)) or str(member).isdigit():
+            taxids.add(int(member))
+            continue
+        matches = taxa.index[taxa["name"] == str(member).strip()]
+        if len(matches) == 0:
+            print(f"⚠ Taxon '{member}' in keinem Report gefunden")
+        taxids.update(int(t) for t in matches)
+    return np.array(sorted(taxids), dtype=np.int64)
+
+
+def top_level_members(index, taxids):
+    """
+    Entfernt Gruppenmitglieder, deren Vorfahre ebenfalls zur Gruppe gehört. reads_clade des
+    Vorfahren enthält deren Reads bereits, sie würden sonst doppelt gezählt.
+    """
+    nested = np.zeros(len(taxids), dtype=bool)
+    current = taxids
+    for _ in range(MAX_DEPTH):
+        current = parents(index, current)
+        if (current < 0).all():
+            break
+        nested |= np.isin(current, taxids)
+    return taxids[~nested]
+
+
+def group_proportions(index, groups, runs=None):
+    """
+    Anteil jeder Gruppe an allen Virus-Reads, als Tabelle Runs × Gruppen.
+    Alle Gruppen werden gemeinsam aus den Postings des Taxon-Index berechnet.
+    """
+    taxa = load_taxa()
+    members = {name: top_level_members(index, resolve_group(group, taxa)) for name, group in groups.items()}
+
+    all_taxids = np.unique(np.concatenate(list(members.values())))
+    hits = postings(index, np.append(all_taxids, VIRUSES_TAXID))
+    if runs is not None:
+        hits = hits[hits["run"].isin(runs)]
+
+    virus_reads = hits[hits["ncbi_taxid"] == VIRUSES_TAXID].set_index("run")["reads_clade"]
+    reads = hits.pivot_table(index="run", columns="ncbi_taxid", values="reads_clade", aggfunc="sum", fill_value=0)
+    reads = reads.reindex(index=virus_reads.index, fill_value=0)
+
+    group_reads = pd.DataFrame(
+        {name: reads.reindex(columns=taxids, fill_value=0).sum(axis=1) for name, taxids in members.items()},
+        index=reads.index
     )
-    df["name"] = df["name"].str.strip()
-    return df
+    return group_reads.div(virus_reads, axis=0)
+
+
+def proportion_tables(proportions, metadata):
+    """Tabellen pro Sample, pro Kläranlage und pro Datum"""
+    meta = metadata.reindex(proportions.index)
+    per_sample = pd.concat([meta[["PLANT", "DATE", "REPLICA"]], proportions], axis=1)
+    per_plant = per_sample.groupby("PLANT")[list(proportions.columns)].mean()
+    per_date = per_sample.groupby("DATE")[list(proportions.columns)].mean()
+    return per_sample, per_plant, per_date
 
-fractions = []
 
-for report_file in os.listdir(INPUT_FOLDER):
-    if not report_file.endswith("_report.txt") or report_file in ["ERR2356165_report.txt", "ERR12510732_report.txt"]:
-        continue
-    path = os.path.join(INPUT_FOLDER, report_file)
-    df = parse_kraken2_report(path)
+if __name__ == "__main__":
+    index = update_index(INPUT_FOLDER, verbose=False)
+    skip = quarantined_runs(INPUT_FOLDER)
+    runs = [run for run in index["runs"].tolist() if run not in skip]
 
-    viruses_row = df[df["name"] == "Viruses"]
-    if viruses_row.empty:
-        continue
-    virus_reads = viruses_row["reads_clade"].iloc[0]
+    proportions = group_proportions(index, TAXON_GROUPS, runs)
+    per_sample, per_plant, per_date = proportion_tables(proportions, load_metadata(META_CSV))
 
-    taxa_df = df[df["name"].isin(TAXA)]
-    reads = taxa_df["reads_clade"].sum()
-    fractions.append(reads / virus_reads)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print("\nAnteile pro Kläranlage:\n")
+        print(per_plant.round(4))
+        print("\nAnteile pro Datum:\n")
+        print(per_date.round(4))
 
-print(f"Mittelwert über Proben: {np.mean(fractions):.2%}")
+    for name in proportions.columns:
+        print(f"Mittelwert über Proben ({name}): {proportions[name].mean():.2%}")
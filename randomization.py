@@ -1,8 +1,5 @@
 import pandas as pd
 import numpy as np
-from scipy.spatial.distance import braycurtis
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 # This script performs randomization to assess Bray-Curtis similarity.
 
@@ -13,6 +10,7 @@ REPORT_FILE = "kraken2_run/ERR12510713_report.txt"
 TAXON_LEVEL = None
 N_ITER = 100           # Anzahl Randomization Iterationen
 PLOT_HIST = True
+SEED = None
 # ==========================
 
 
@@ -34,36 +32,31 @@ def parse_kraken2_report(path, taxon_level):
     return taxon_reads
 
 
-def randomize_similarity(taxon_reads, n_iter=100):
+def taxon_reads_from_cached(report, taxon_level):
+    """Wie parse_kraken2_report, aber auf einem gecachten Report mit Namen (cohort.load_report(..., with_names=True))."""
+    df_level = report[report["rank_code"] == taxon_level] if taxon_level else report
+    return df_level.set_index("name")["reads_clade"].to_dict()
+
+
+def randomize_similarity(taxon_reads, n_iter=100, seed=SEED):
     """
-    Teilt die Reads zufällig in zwei Hälften und berechnet Bray-Curtis-Similarity
+    Teilt die Reads zufällig in zwei Hälften und berechnet Bray-Curtis-Similarity.
+    Die Reads pro Taxon in der ersten Hälfte sind multivariat hypergeometrisch verteilt; so werden
+    alle Iterationen auf einmal gezogen, ohne jeden Read einzeln zu mischen.
     """
-    # Erstelle ein Array aller Reads, jedes Taxon entsprechend seiner Reads
-    all_reads = []
-    for taxon, count in taxon_reads.items():
-        all_reads.extend([taxon] * int(count))
-    
-    all_reads = np.array(all_reads)
-    similarities = []
-
-    for _ in range(n_iter):
-        np.random.shuffle(all_reads)
-        half = len(all_reads) // 2
-        part1, part2 = all_reads[:half], all_reads[half:]
-
-        # Zähle Reads pro Taxon
-        unique_taxa = set(all_reads)
-        counts1 = np.array([np.sum(part1 == t) for t in unique_taxa])
-        counts2 = np.array([np.sum(part2 == t) for t in unique_taxa])
-
-        # Bray-Curtis Similarity = 1 - Bray-Curtis Distance
-        sim = 1 - braycurtis(counts1, counts2)
-        similarities.append(sim)
-    
-    return similarities
+    counts = np.array([int(count) for count in taxon_reads.values()], dtype=np.int64)
+    half = counts.sum() // 2
 
+    rng = np.random.default_rng(seed)
+    part1 = rng.multivariate_hypergeometric(counts, half, size=n_iter)
+    part2 = counts - part1
 
-if __name__ == "__main__":
+    # Bray-Curtis Similarity = 1 - Bray-Curtis Distance
+    similarities = 1 - np.abs(part1 - part2).sum(axis=1) / counts.sum()
+    return similarities.tolist()
+
+
+def main():
     taxon_reads = parse_kraken2_report(REPORT_FILE, TAXON_LEVEL)
     sims = randomize_similarity(taxon_reads, n_iter=N_ITER)
 
@@ -73,13 +66,12 @@ if __name__ == "__main__":
     print(f"  Min: {np.min(sims):.4f}, Max: {np.max(sims):.4f}")
 
     if PLOT_HIST:
-        ax = sns.histplot(sims)
-        ax.set_xlabel("Bray-Curtis Similarity")
-        ax.set_ylabel("Häufigkeit")
-        ax.set_title("Randomized Similarities")
+        from plotting import plot_similarity_histogram
+        plot_similarity_histogram(sims, "Randomized Similarities", ylabel="Häufigkeit")
+
 
-        plt.tight_layout()
-        plt.show()
+if __name__ == "__main__":
+    main()
 
 # Randomized Bray-Curtis Similarities (100 Iterationen) on Species Level:
 #   Mittelwert: 0.9466
@@ -0,0 +1,362 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import braycurtis
+
+import api
+import cohort
+import plant_similarity
+import similarity
+import zeitreihe
+from cohort import (INPUT_FOLDER, META_CSV, REPORT_SUFFIX, ingest_reports, load_metadata, load_report, quarantined_runs,
+                    rank_rows)
+from report_archive import append_reports
+from taxonomy import build_index
+from timecube import load_cube
+
+# This script guards the fast paths against the original ones. On a fixed subset of kraken2_run/ it runs the
+# legacy code (text parsing with pandas per report, scipy Bray-Curtis, one DataFrame per report) next to the
+# newer engines (report cache, archive, vectorized similarity, out-of-core aggregation, time-series cube,
+# hypergeometric randomization) and checks that both give the same numbers within a tolerance. The lineage
+# index is built from taxdump_fixture/ and checked against the lineages known for the fixture. It also
+# times both sides. With --full the similarity summaries of the whole cohort are compared with the results
+# documented at the end of similarity.py and randomization.py. Exit code 1 if any check fails.
+#
+# Verwendung:
+#   python regression.py
+#   python regression.py --levels G S --full
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+SUBSET_PLANTS = ["Rensningsanlaeg Avedoere", "Dokhaven"]
+SUBSET_DATES = 12              # die ersten n Sammeldaten pro Kläranlage (mit allen Replikaten)
+LEVELS = [None, "F", "G", "S"]
+TOLERANCE = 1e-9               # float64-Pfade
+CUBE_TOLERANCE = 1e-6          # der Zeitreihen-Würfel speichert float32
+GOLDEN_TOLERANCE = 5e-5        # dokumentierte Werte sind auf 4 Stellen gerundet
+RANDOM_TOLERANCE = 1e-3        # Randomisierung: Mittelwert/Median über N_ITER Ziehungen
+RANDOM_RUN = "ERR12510713"
+RANDOM_ITER = 100
+SEED = 0
+TAXDUMP_FIXTURE = "taxdump_fixture"
+TAXONOMY_RUNS = 3              # so viele Runs der Teilmenge werden mit dem Fixture-taxdump neu eingelesen
+# ============================================================
+
+# Ergebnisse am Ende von similarity.py: (Modus, Level) → (Mittelwert, Median, Min, Max)
+GOLDEN_PAIRS = {
+    ("replicate", "S"): (0.8940, 0.8999, 0.7874, 0.9429),
+    ("replicate", "G"): (0.9305, 0.9398, 0.8469, 0.9660),
+    ("replicate", "F"): (0.9739, 0.9762, 0.9378, 0.9900),
+    ("replicate", None): (0.9867, 0.9866, 0.9668, 0.9986),
+    ("temporal", "S"): (0.7824, 0.8226, 0.2438, 0.9452),
+    ("temporal", "G"): (0.8121, 0.8482, 0.2759, 0.9671),
+    ("temporal", "O"): (0.8603, 0.9064, 0.2842, 0.9961),
+    ("temporal", None): (0.8745, 0.9207, 0.3220, 0.9980),
+}
+# Erwartete Einträge aus taxdump_fixture/: taxid → (Name, Rang, Lineage von realm bis species, -1 = keiner)
+GOLDEN_LINEAGES = {
+    2955582: ("Carjivirus communis", "species",
+              (2731341, 2731360, 2731618, 2731619, 1978007, 2942964, 2948652, 2955582)),
+    2942966: ("Suoliviridae", "family", (2731341, 2731360, 2731618, 2731619, 1978007, 2942966, -1, -1)),
+    2844652: ("Gihfavirus pelohabitans", "species",
+              (2559587, 2732396, 2732407, 2842243, 2842249, 2842332, 2842702, 2844652)),
+    10239: ("Viruses", "acellular root", (-1, -1, -1, -1, -1, -1, -1, -1)),
+}
+# Ergebnisse am Ende von randomization.py (RANDOM_RUN): Level → (Mittelwert, Median)
+GOLDEN_RANDOM = {
+    "S": (0.9466, 0.9465),
+    "G": (0.9663, 0.9663),
+    "F": (0.9902, 0.9901),
+    None: (0.9992, 0.9992),
+}
+
+
+class Checks:
+    """Sammelt die Ergebnisse: eine Zeile pro Prüfung mit Laufzeiten und größter Abweichung."""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, check, level, difference, tolerance, legacy_seconds=np.nan, new_seconds=np.nan):
+        ok = bool(np.isfinite(difference) and difference <= tolerance)
+        self.rows.append({
+            "Prüfung": check,
+            "Level": level or "alle",
+            "Legacy [s]": legacy_seconds,
+            "Neu [s]": new_seconds,
+            "Faktor": legacy_seconds / new_seconds if new_seconds else np.nan,
+            "Abweichung": difference,
+            "Toleranz": tolerance,
+            "ok": "✔" if ok else "⚠",
+        })
+        return ok
+
+    def failed(self):
+        return [row for row in self.rows if row["ok"] != "✔"]
+
+    def table(self):
+        return pd.DataFrame(self.rows)
+
+
+def timed(function, *args, **kwargs):
+    """(Ergebnis, Sekunden); Ausgaben der Legacy-Funktionen (z.B. "Lade ...") werden verschluckt."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def frame_difference(legacy, new):
+    """Größte absolute Abweichung zweier Tabellen; unterschiedliche Zeilen/Spalten zählen als unendlich."""
+    if legacy is None or new is None:
+        return np.inf
+    if isinstance(legacy, pd.Series):
+        legacy, new = legacy.to_frame(name=0), new.to_frame(name=0)
+    if set(legacy.index) != set(new.index) or set(legacy.columns) != set(new.columns):
+        return np.inf
+    new = new.reindex(index=legacy.index, columns=legacy.columns)
+    return float(np.abs(legacy.to_numpy(dtype=float) - new.to_numpy(dtype=float)).max(initial=0))
+
+
+def subset_metadata(metadata, plants=SUBSET_PLANTS, n_dates=SUBSET_DATES):
+    """Feste Teilmenge: pro Kläranlage die ersten n_dates Sammeldaten, ohne Quarantäne."""
+    skip = quarantined_runs(INPUT_FOLDER)
+    parts = []
+    for plant in plants:
+        rows = metadata[(metadata["PLANT"] == plant) & ~metadata["ENA_RUN_ACCESSION"].isin(skip)]
+        dates = np.sort(rows["DATE"].unique())[:n_dates]
+        parts.append(rows[rows["DATE"].isin(dates)])
+    subset = pd.concat(parts)
+    present = [os.path.exists(report_path(run)) for run in subset.index]
+    return subset[present]
+
+
+def report_path(run):
+    return os.path.join(INPUT_FOLDER, f"{run}{REPORT_SUFFIX}")
+
+
+# ============================================================
+# LEGACY-PFADE
+# ============================================================
+
+def legacy_profiles(runs, level):
+    """Wie similarity.load_all_profiles: jeden Report als Text mit pandas parsen."""
+    profiles = {run: similarity.parse_kraken2_report(report_path(run), level) for run in runs}
+    return {run: profile for run, profile in profiles.items() if profile is not None}
+
+
+def legacy_pair_similarities(pairs, profiles):
+    """Bray-Curtis wie ursprünglich: scipy auf den pro Paar ausgerichteten Profilen."""
+    values = []
+    for r1, r2 in zip(pairs["Run1"], pairs["Run2"]):
+        taxa = profiles[r1].index.union(profiles[r2].index)
+        values.append(1 - braycurtis(profiles[r1].reindex(taxa, fill_value=0), profiles[r2].reindex(taxa, fill_value=0)))
+    return pd.Series(values, index=pd.MultiIndex.from_arrays([pairs["Run1"], pairs["Run2"]]))
+
+
+def legacy_plant_similarity(metadata, level):
+    """plant_similarity.py vor dem Cache: Sample-Matrix aus Textdateien, scipy-Distanzen pro Paar."""
+    taxon_level, plant_similarity.TAXON_LEVEL = plant_similarity.TAXON_LEVEL, level
+    try:
+        df, meta_df = plant_similarity.build_sample_matrix(metadata.reset_index(drop=True))
+    finally:
+        plant_similarity.TAXON_LEVEL = taxon_level
+    profiles = plant_similarity.aggregate_by_plant(df, meta_df)
+    n = len(profiles)
+    sim = np.array([[1 - braycurtis(profiles.iloc[i], profiles.iloc[j]) for j in range(n)] for i in range(n)])
+    return pd.DataFrame(sim, index=profiles.index, columns=profiles.index)
+
+
+def legacy_time_series(runs, level, plants):
+    """zeitreihe.py vor dem Cache: alle Reports als Text laden, pivot_table pro Kläranlage."""
+    sample_mapping = zeitreihe.load_sample_metadata(META_CSV)
+    df = zeitreihe.load_reports(INPUT_FOLDER, [f"{run}{REPORT_SUFFIX}" for run in runs], level, sample_mapping)
+    return {plant: zeitreihe.prepare_time_series(df, plant) for plant in plants}
+
+
+# ============================================================
+# PRÜFUNGEN
+# ============================================================
+
+def check_archive(checks, runs):
+    """Report aus dem komprimierten Archiv == Report aus der Textdatei."""
+    with tempfile.TemporaryDirectory() as tmp:
+        archive_path = os.path.join(tmp, "subset.archive")
+        append_reports([(run, report_path(run)) for run in runs], archive_path)
+        legacy, legacy_seconds = timed(lambda: [cohort.parse_kraken2_report(report_path(run)) for run in runs])
+        new, new_seconds = timed(lambda: [cohort.read_report(run, tmp, archive_path) for run in runs])
+    difference = 0.0
+    for old, archived in zip(legacy, new):
+        if not old.equals(archived):
+            difference = np.inf
+    checks.add("Archiv vs. Textdatei", None, difference, 0, legacy_seconds, new_seconds)
+
+
+def check_profiles(checks, runs, level, reports):
+    legacy, legacy_seconds = timed(legacy_profiles, runs, level)
+    new, new_seconds = timed(api.sample_profiles, level, reports)
+    difference = max((frame_difference(legacy[run].groupby(level=0).sum(), new[run].groupby(level=0).sum())
+                      for run in legacy), default=np.inf)
+    if set(legacy) != set(new):
+        difference = np.inf
+    checks.add("Profile: Cache vs. Text", level, difference, TOLERANCE, legacy_seconds, new_seconds)
+    return legacy, new
+
+
+def check_pairs(checks, metadata, level, legacy_profiles_, new_profiles):
+    for mode in ("replicate", "temporal"):
+        pairs, new_seconds = timed(api.pair_similarities, level, mode, metadata=metadata, profiles=new_profiles)
+        if pairs.empty:
+            continue
+        legacy, legacy_seconds = timed(legacy_pair_similarities, pairs, legacy_profiles_)
+        new = pd.Series(pairs["Similarity"].to_numpy(), index=legacy.index)
+        checks.add(f"Paare ({mode}): NumPy vs. scipy", level, frame_difference(legacy, new), TOLERANCE,
+                   legacy_seconds, new_seconds)
+
+
+def check_plant_similarity(checks, metadata, level, reports):
+    legacy, legacy_seconds = timed(legacy_plant_similarity, metadata, level)
+    new, new_seconds = timed(api.plant_similarity_matrix, level, reports, metadata)
+    checks.add("Kläranlagen-Matrix", level, frame_difference(legacy, new), TOLERANCE, legacy_seconds, new_seconds)
+
+    out_of_core, seconds = timed(lambda: plant_similarity.compute_similarity_matrix(
+        plant_similarity.accumulate_plant_profiles(metadata, level)))
+    checks.add("Kläranlagen-Matrix (out-of-core)", level, frame_difference(legacy, out_of_core), TOLERANCE,
+               legacy_seconds, seconds)
+
+
+def check_time_series(checks, metadata, level):
+    runs, plants = metadata.index.tolist(), sorted(metadata["PLANT"].unique())
+    legacy, legacy_seconds = timed(legacy_time_series, runs, level, plants)
+
+    def from_cube():
+        cube = load_cube(level, runs, metadata)
+        return {plant: cube.series(plant, zeitreihe.MIN_REL_ABUNDANCE) for plant in plants}
+
+    def out_of_core():
+        sample_mapping = zeitreihe.load_sample_metadata(META_CSV)
+        return zeitreihe.load_time_series_out_of_core(INPUT_FOLDER, [f"{run}{REPORT_SUFFIX}" for run in runs], level,
+                                                      sample_mapping)
+
+    for name, function, tolerance in [("Zeitreihe (Würfel)", from_cube, CUBE_TOLERANCE),
+                                      ("Zeitreihe (out-of-core)", out_of_core, TOLERANCE)]:
+        new, seconds = timed(function)
+        difference = max(frame_difference(legacy[plant], new.get(plant)) for plant in plants)
+        checks.add(name, level, difference, tolerance, legacy_seconds, seconds)
+
+
+def check_taxonomy(checks, runs):
+    """
+    Lineage-Index aus taxdump_fixture/: Name, Rang und Lineage bekannter Taxa; Ingest mit dem Fixture hängt
+    die Lineage-Spalten an, und die Rang-Auswahl über die Lineage trifft dieselben Zeilen wie die Rang-Codes.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        taxonomy, build_seconds = timed(build_index, TAXDUMP_FIXTURE, os.path.join(tmp, "index"))
+        wrong = 0
+        for taxid, (name, rank, lineage) in GOLDEN_LINEAGES.items():
+            wrong += taxonomy.name(taxid) != name
+            wrong += taxonomy.rank(taxid) != rank
+            wrong += tuple(taxonomy.lineage_of([taxid])[0].tolist()) != lineage
+        checks.add("Lineage-Index (Fixture)", None, 0.0 if not wrong else np.inf, 0, new_seconds=build_seconds)
+
+        folder, cache_dir = os.path.join(tmp, "reports"), os.path.join(tmp, "cache")
+        os.makedirs(folder)
+        for run in runs[:TAXONOMY_RUNS]:
+            os.symlink(os.path.abspath(report_path(run)), os.path.join(folder, f"{run}{REPORT_SUFFIX}"))
+        _, ingest_seconds = timed(ingest_reports, folder, cache_dir, verbose=False,
+                                  archive_path=os.path.join(tmp, "none.archive"), taxdump_dir=TAXDUMP_FIXTURE,
+                                  taxonomy_dir=os.path.join(tmp, "index"))
+
+        wrong = 0
+        fixture = np.asarray(list(GOLDEN_LINEAGES) + [2948652, 2948645, 2842702, 186789])
+        for run in runs[:TAXONOMY_RUNS]:
+            report = load_report(run, cache_dir)
+            columns = [f"lineage_{rank}" for rank in taxonomy.lineage_ranks]
+            if not all(column in report for column in columns):
+                wrong += 1
+                continue
+            rows = report[report["ncbi_taxid"].isin(fixture)]
+            wrong += int((rows[columns].to_numpy() != taxonomy.lineage_of(rows["ncbi_taxid"])).any())
+            for level in ["O", "F", "G", "S"]:
+                by_lineage = set(rank_rows(report, level)["ncbi_taxid"].tolist())
+                # Der Fixture-taxdump kennt nur einen Ausschnitt: nur die dort bekannten Taxa zählen
+                by_code = {taxid for taxid in report.loc[report["rank_code"] == level, "ncbi_taxid"].tolist()
+                           if taxonomy.known(taxid)}
+                wrong += not by_lineage or by_lineage != by_code
+        checks.add("Ingest mit Lineage (Fixture)", None, 0.0 if not wrong else np.inf, 0, new_seconds=ingest_seconds)
+
+
+def check_randomization(checks, levels):
+    report = load_report(RANDOM_RUN, with_names=True)
+    for level in levels:
+        if level not in GOLDEN_RANDOM:
+            continue
+        sims, seconds = timed(api.randomized_similarity, RANDOM_RUN, level, RANDOM_ITER, SEED, report)
+        mean, median = GOLDEN_RANDOM[level]
+        difference = max(abs(sims.mean() - mean), abs(sims.median() - median))
+        checks.add("Randomisierung vs. dokumentiert", level, difference, RANDOM_TOLERANCE, new_seconds=seconds)
+
+
+def check_golden_pairs(checks, metadata, reports):
+    """Ganze Kohorte gegen die Ergebnisse am Ende von similarity.py."""
+    for (mode, level), expected in GOLDEN_PAIRS.items():
+        pairs, seconds = timed(api.pair_similarities, level, mode, reports, metadata)
+        values = pairs["Similarity"]
+        actual = (values.mean(), values.median(), values.min(), values.max())
+        difference = max(abs(a - e) for a, e in zip(actual, expected))
+        checks.add(f"Kohorte ({mode}) vs. dokumentiert", level, difference, GOLDEN_TOLERANCE, new_seconds=seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy- und neue Rechenwege auf einer festen Teilmenge vergleichen")
+    parser.add_argument("--levels", nargs="+", default=LEVELS, type=lambda level: None if level == "all" else level,
+                        help="Taxonomie-Level, 'all' = ohne Filter")
+    parser.add_argument("--full", action="store_true", help="Zusätzlich die ganze Kohorte gegen dokumentierte Werte")
+    args = parser.parse_args()
+
+    ingest_reports(verbose=False)
+    metadata_all = load_metadata(META_CSV)
+    metadata = subset_metadata(metadata_all)
+    runs = metadata.index.tolist()
+    reports = {run: load_report(run, with_names=True) for run in runs}
+    print(f"Teilmenge: {len(runs)} Runs aus {', '.join(SUBSET_PLANTS)}\n")
+
+    checks = Checks()
+    check_archive(checks, runs)
+    for level in args.levels:
+        print(f"→ Level {level or 'alle'}")
+        legacy, new = check_profiles(checks, runs, level, reports)
+        check_pairs(checks, metadata, level, legacy, new)
+        check_plant_similarity(checks, metadata, level, reports)
+        if level is not None:
+            check_time_series(checks, metadata, level)
+    check_randomization(checks, args.levels)
+    check_taxonomy(checks, runs)
+
+    if args.full:
+        print("→ Ganze Kohorte")
+        check_golden_pairs(checks, metadata_all, api.load_cohort())
+
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_rows", None):
+        print()
+        print(checks.table().to_string(index=False, float_format=lambda x: f"{x:.3g}"))
+
+    failed = checks.failed()
+    print()
+    if failed:
+        print(f"⚠ {len(failed)} von {len(checks.rows)} Prüfungen außerhalb der Toleranz")
+        sys.exit(1)
+    print(f"✔ Alle {len(checks.rows)} Prüfungen innerhalb der Toleranz")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from cohort import (CACHE_DIR, COUNT_VALUE, META_CSV, abundance_matrix, cached_runs, derived_path, ingest_reports,
+                    load_manifest, load_metadata, load_report, load_taxa, save_derived)
+
+# This module pools technical replicates (same ENA_ALIAS, different REPLICA) at the read-count level.
+# The reports of all replicates are merged into one synthetic report per alias with the same tree layout
+# as a Kraken2 report (depth, parent, depth-first order, siblings sorted by clade reads). All aliases are
+# pooled together in one vectorized pass and cached. A pooled sample is identified by the run accession of
+# its first replicate, so metadata lookups (PLANT, DATE) keep working unchanged.
+# Analyses switch between pooled and per-replicate data with POOL_REPLICATES / pooled=True; the pooled
+# reports and the pooled count matrices both come from caches, so switching recomputes nothing.
+#
+# Verwendung:
+#   python replicates.py                        # Übersicht
+#   python replicates.py --export kraken2_pooled   # synthetische Reports als Kraken2-Textdateien
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+EXPORT_FOLDER = "kraken2_pooled"
+# ============================================================
+
+FIELDS = ["ncbi_taxid", "parent_taxid", "depth", "rank_code", "reads_clade", "reads_direct"]
+
+
+def replicate_groups(runs, metadata):
+    """Alias → sortierte Runs, nur für Runs mit Metadaten. Der erste Run vertritt die gepoolte Probe."""
+    meta = metadata.loc[[run for run in runs if run in metadata.index]]
+    return {alias: sorted(group) for alias, group in meta.groupby("ENA_ALIAS")["ENA_RUN_ACCESSION"]}
+
+
+def grouping_key(groups):
+    """
+    Zuordnung Alias → Runs als Text, für derived_path(..., extra=...): gepoolte Ergebnisse hängen von
+    den Metadaten ab, nicht nur von den Reports.
+    """
+    return "".join(f"\n{alias}={','.join(runs)}" for alias, runs in sorted(groups.items()))
+
+
+def _tree_order(group, parent_idx, depth, reads_clade, tiebreak):
+    """
+    Position jeder Zeile in der Tiefensuche ihres Reports (wie Kraken2: Geschwister absteigend nach
+    reads_clade, bei Gleichstand in der Reihenfolge von tiebreak), für alle Reports gleichzeitig. Zuerst Teilbaumgrößen von unten nach oben, dann
+    Positionen von oben nach unten, jeweils eine NumPy-Operation pro Baumebene.
+    """
+    n = len(group)
+    size = np.ones(n, dtype=np.int64)
+    for d in range(depth.max(), 0, -1):
+        rows = np.flatnonzero(depth == d)
+        np.add.at(size, parent_idx[rows], size[rows])
+
+    # Geschwister (gleicher Elternknoten; Wurzeln pro Report, unclassified vor root) sortieren
+    sibling_key = np.where(parent_idx >= 0, parent_idx, -1 - group)
+    order = np.lexsort((tiebreak, np.where(parent_idx >= 0, -reads_clade, 0), sibling_key))
+    sorted_key = sibling_key[order]
+    before = np.cumsum(size[order]) - size[order]
+    first = np.r_[True, sorted_key[1:] != sorted_key[:-1]]
+    before -= np.maximum.accumulate(np.where(first, before, 0))
+    offset = np.empty(n, dtype=np.int64)
+    offset[order] = before
+
+    position = np.where(depth == 0, offset, 0)
+    for d in range(1, depth.max() + 1):
+        rows = np.flatnonzero(depth == d)
+        position[rows] = position[parent_idx[rows]] + 1 + offset[rows]
+    return position
+
+
+def pool_reports(groups, cache_dir=CACHE_DIR, cache=True):
+    """
+    Summiert reads_clade und reads_direct pro (Alias, Taxid) über alle Replikate und baut die
+    Baumreihenfolge neu auf. Ergebnis: dict mit Feldern aus FIELDS (alle Aliase hintereinander),
+    "runs" (vertretender Run pro Alias) und "offsets" (Zeilenbereich pro Alias).
+    cache=False rechnet ohne Cache (z.B. für einzelne Blöcke der Kohorte).
+    """
+    representatives = sorted(runs[0] for runs in groups.values())
+    all_runs = [run for runs in groups.values() for run in runs]
+    path = derived_path("pooled", all_runs, cache_dir, extra=grouping_key(groups))
+    if cache and os.path.exists(path):
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+
+    group_of = {run: representatives.index(runs[0]) for runs in groups.values() for run in runs}
+    parts = {field: [] for field in FIELDS + ["group"]}
+    for run in all_runs:
+        report = load_report(run, cache_dir)
+        for field in FIELDS:
+            parts[field].append(report[field].to_numpy())
+        parts["group"].append(np.full(len(report), group_of[run], dtype=np.int64))
+    columns = {field: np.concatenate(values) for field, values in parts.items()}
+    columns["rank_code"] = columns["rank_code"].astype("U3")
+
+    # Ein Schlüssel pro (Gruppe, Taxid); Eltern über denselben Schlüssel finden
+    base = int(max(columns["ncbi_taxid"].max(), columns["parent_taxid"].max())) + 2
+    keys = columns["group"] * base + columns["ncbi_taxid"]
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    pooled = {field: columns[field][first] for field in ["ncbi_taxid", "parent_taxid", "depth", "rank_code"]}
+    for field in ["reads_clade", "reads_direct"]:
+        pooled[field] = np.bincount(inverse, weights=columns[field], minlength=len(unique_keys)).astype(np.int64)
+    group = columns["group"][first]
+
+    parent_keys = group * base + pooled["parent_taxid"]
+    parent_idx = np.where(pooled["parent_taxid"] >= 0, np.searchsorted(unique_keys, parent_keys), -1)
+    # Gleichstände wie im ersten Replikat, das das Taxon enthält
+    position = _tree_order(group, parent_idx, pooled["depth"], pooled["reads_clade"], first)
+
+    order = np.lexsort((position, group))
+    result = {field: values[order] for field, values in pooled.items()}
+    result["runs"] = np.array(representatives, dtype="U32")
+    result["offsets"] = np.searchsorted(group[order], np.arange(len(representatives) + 1))
+    if cache:
+        save_derived(path, **result)
+    return result
+
+
+def pooled_reports(runs=None, metadata=None, cache_dir=CACHE_DIR, with_names=False):
+    """Gepoolte Reports als dict vertretender Run → DataFrame (Spalten wie cohort.load_report)."""
+    if runs is None:
+        runs = cached_runs(cache_dir)
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+
+    reports = reports_from_pooled(pool_reports(replicate_groups(runs, metadata), cache_dir))
+    if with_names:
+        names = load_taxa(cache_dir)["name"]
+        for report in reports.values():
+            report["name"] = report["ncbi_taxid"].map(names)
+    return reports
+
+
+def reports_from_pooled(pooled, runs=None):
+    """Zerlegt das Ergebnis von pool_reports in vertretender Run → DataFrame (nur runs, falls angegeben)."""
+    offsets = pooled["offsets"]
+    positions = range(len(pooled["runs"])) if runs is None else np.searchsorted(pooled["runs"], runs)
+    return {
+        pooled["runs"][i]: pd.DataFrame({field: pooled[field][offsets[i]:offsets[i + 1]] for field in FIELDS})
+        for i in positions
+    }
+
+
+def pool_counts(counts, metadata):
+    """
+    Poolt eine Count-Matrix (Runs × Taxa) nach Alias. Read-Zählungen sind additiv, das Ergebnis
+    entspricht also der Matrix der gepoolten Reports.
+    """
+    groups = replicate_groups(counts.index, metadata)
+    representative = {run: runs[0] for runs in groups.values() for run in runs}
+    keep = counts.index.isin(list(representative))
+    pooled = counts[keep].groupby(counts.index[keep].map(representative)).sum()
+    pooled.index.name = counts.index.name
+    return pooled
+
+
+def pooled_abundance_matrix(runs=None, taxon_level="S", metadata=None, cache_dir=CACHE_DIR, value=COUNT_VALUE):
+    """Wie cohort.abundance_matrix, aber eine Zeile pro Alias (vertretender Run); nutzt die gecachte Matrix."""
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+    return pool_counts(abundance_matrix(runs, taxon_level, value, cache_dir), metadata)
+
+
+def pooled_relative_abundance_matrix(runs=None, taxon_level="S", metadata=None, cache_dir=CACHE_DIR,
+                                     value=COUNT_VALUE):
+    """Gepoolte Reads relativ zu den gepoolten Virus-Reads (nicht Mittelwert der relativen Abundanzen)."""
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+    counts = abundance_matrix(runs, taxon_level, value, cache_dir)
+    manifest = load_manifest(cache_dir)
+    virus = pd.DataFrame({"virus": [manifest[run]["qc"]["virus_reads"] for run in counts.index]}, index=counts.index)
+    return pool_counts(counts, metadata).div(pool_counts(virus, metadata)["virus"], axis=0)
+
+
+def write_kraken_report(report, path, cache_dir=CACHE_DIR):
+    """Schreibt einen (gepoolten) Report im Kraken2-Textformat."""
+    names = load_taxa(cache_dir)["name"].reindex(report["ncbi_taxid"]).fillna("").to_numpy()
+    names[report["ncbi_taxid"].to_numpy() == 0] = "unclassified"
+    total = report.loc[report["depth"] == 0, "reads_clade"].sum()
+
+    table = pd.DataFrame({
+        "percent": (100 * report["reads_clade"] / total).map("{:.2f}".format),
+        "reads_clade": report["reads_clade"],
+        "reads_direct": report["reads_direct"],
+        "rank_code": report["rank_code"],
+        "ncbi_taxid": report["ncbi_taxid"],
+        "name": [" " * (2 * depth) + name for depth, name in zip(report["depth"], names)],
+    })
+    table.to_csv(path, sep="\t", header=False, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Technische Replikate auf Read-Ebene zusammenführen")
+    parser.add_argument("--export", nargs="?", const=EXPORT_FOLDER, help="Gepoolte Reports als Kraken2-Textdateien schreiben")
+    args = parser.parse_args()
+
+    ingest_reports(verbose=False)
+    metadata = load_metadata(META_CSV)
+    runs = cached_runs()
+    groups = replicate_groups(runs, metadata)
+    reports = pooled_reports(runs, metadata)
+
+    n_pooled = sum(len(group) > 1 for group in groups.values())
+    print(f"✔ {len(runs)} Runs → {len(reports)} Proben ({n_pooled} aus mehreren Replikaten gepoolt)")
+
+    if args.export:
+        os.makedirs(args.export, exist_ok=True)
+        for run, report in reports.items():
+            write_kraken_report(report, os.path.join(args.export, f"{run}_report.txt"))
+        print(f"✔ Reports geschrieben nach {args.export}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import io
+import json
+import os
+import struct
+import time
+import zlib
+
+# This module stores Kraken2 reports in one append-only archive instead of one text file per run.
+# Every report is a separately zlib-compressed member behind a small header (run accession, sizes,
+# original modification time, CRC). An offset index next to the archive maps each run to its member,
+# so a single report is read with one seek and decompressed without touching the rest. A report that is
+# archived again is appended; the index then points to the newer member (`compact` drops the old ones).
+# The index can always be rebuilt from the member headers.
+#
+# Verwendung:
+#   python report_archive.py pack              # alle Reports aus kraken2_run/ aufnehmen
+#   python report_archive.py pack --remove     # ... und die Textdateien danach löschen
+#   python report_archive.py list
+#   python report_archive.py extract ERR12510640 --to kraken2_run
+#   python report_archive.py compact
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+ARCHIVE_PATH = "kraken2_run.archive"
+COMPRESSION_LEVEL = 6          # zlib 1–9; 6 ≈ 4.5× kleiner, Entpacken ~4 ms pro Report
+# ============================================================
+
+INDEX_SUFFIX = ".index.json"
+MAGIC = b"KRA1"
+HEADER = struct.Struct("<4sHQQdI")   # magic, Länge Run-Name, Rohgröße, komprimierte Größe, mtime, crc32
+
+
+def index_path(archive_path=ARCHIVE_PATH):
+    return archive_path + INDEX_SUFFIX
+
+
+class ReportArchive:
+    """
+    Lesezugriff auf ein Report-Archiv. entries: run → (offset, komprimierte Größe, Rohgröße, mtime, crc32),
+    offset zeigt hinter den Header auf die komprimierten Daten.
+    """
+
+    def __init__(self, archive_path=ARCHIVE_PATH):
+        self.path = archive_path
+        self.entries = load_index(archive_path)
+
+    def __contains__(self, run):
+        return run in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def runs(self):
+        return sorted(self.entries)
+
+    def stat(self, run):
+        """(Rohgröße, mtime) wie os.stat der ursprünglichen Textdatei."""
+        _, _, size, mtime, _ = self.entries[run]
+        return size, mtime
+
+    def read(self, run):
+        """Report eines Runs als Bytes; nur dieses Mitglied wird gelesen und entpackt."""
+        offset, length, size, _, crc = self.entries[run]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = zlib.decompress(f.read(length))
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise ValueError(f"Archiv-Mitglied {run} ist beschädigt")
+        return data
+
+    def open(self, run):
+        """Report als Datei-Objekt, z.B. für cohort.parse_kraken2_report."""
+        return io.BytesIO(self.read(run))
+
+
+def load_index(archive_path=ARCHIVE_PATH):
+    if not os.path.exists(archive_path):
+        return {}
+    path = index_path(archive_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(archive_path):
+        return rebuild_index(archive_path)
+    with open(path) as f:
+        return {run: tuple(entry) for run, entry in json.load(f).items()}
+
+
+def _save_index(entries, archive_path):
+    tmp = index_path(archive_path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(entries, f, indent=1, sort_keys=True)
+    os.replace(tmp, index_path(archive_path))
+
+
+def _scan(archive_path):
+    """Liest nur die Header aller Mitglieder: (run, Eintrag) in Dateireihenfolge."""
+    with open(archive_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = f.seek(0)
+        while position + HEADER.size <= end:
+            magic, name_length, size, length, mtime, crc = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Kein Report-Archiv oder beschädigt bei Byte {position}: {archive_path}")
+            run = f.read(name_length).decode()
+            offset = position + HEADER.size + name_length
+            if offset + length > end:
+                # Abgebrochener letzter Schreibvorgang
+                break
+            yield run, (offset, length, size, mtime, crc)
+            position = f.seek(offset + length)
+
+
+def rebuild_index(archive_path=ARCHIVE_PATH):
+    """Index aus den Headern neu aufbauen; bei mehrfach archivierten Runs gilt das letzte Mitglied."""
+    entries = dict(_scan(archive_path))
+    _save_index(entries, archive_path)
+    return entries
+
+
+def append_reports(reports, archive_path=ARCHIVE_PATH, level=COMPRESSION_LEVEL):
+    """
+    Hängt Reports an das Archiv an (legt es bei Bedarf an). reports: Iterable aus (run, Pfad der
+    Textdatei). Der Index wird erst geschrieben, wenn die Daten auf der Platte sind.
+    """
+    entries = load_index(archive_path)
+    added = []
+    with open(archive_path, "ab") as f:
+        for run, path in reports:
+            with open(path, "rb") as report:
+                data = report.read()
+            compressed = zlib.compress(data, level)
+            mtime, crc = os.stat(path).st_mtime, zlib.crc32(data)
+            name = run.encode()
+            position = f.tell()
+            f.write(HEADER.pack(MAGIC, len(name), len(data), len(compressed), mtime, crc))
+            f.write(name)
+            f.write(compressed)
+            entries[run] = (position + HEADER.size + len(name), len(compressed), len(data), mtime, crc)
+            added.append(run)
+        f.flush()
+        os.fsync(f.fileno())
+    _save_index(entries, archive_path)
+    return added
+
+
+def append_report(run, path, archive_path=ARCHIVE_PATH, level=COMPRESSION_LEVEL):
+    return append_reports([(run, path)], archive_path, level)
+
+
+def compact(archive_path=ARCHIVE_PATH):
+    """Schreibt das Archiv ohne überholte Mitglieder neu (komprimierte Daten werden nur kopiert)."""
+    entries = load_index(archive_path)
+    tmp = archive_path + ".tmp"
+    new_entries = {}
+    with open(archive_path, "rb") as source, open(tmp, "wb") as target:
+        for run in sorted(entries):
+            offset, length, size, mtime, crc = entries[run]
+            source.seek(offset)
+            name = run.encode()
+            position = target.tell()
+            target.write(HEADER.pack(MAGIC, len(name), size, length, mtime, crc))
+            target.write(name)
+            target.write(source.read(length))
+            new_entries[run] = (position + HEADER.size + len(name), length, size, mtime, crc)
+    os.replace(tmp, archive_path)
+    _save_index(new_entries, archive_path)
+    return new_entries
+
+
+def pack_folder(input_folder, archive_path=ARCHIVE_PATH, remove=False):
+    """Nimmt neue oder geänderte Reports eines Ordners auf; mit remove werden die Textdateien gelöscht."""
+    from cohort import list_report_files, run_id
+
+    archive = ReportArchive(archive_path)
+    pending = []
+    for report in list_report_files(input_folder):
+        path = os.path.join(input_folder, report)
+        run = run_id(report)
+        if run not in archive or archive.stat(run) != (os.path.getsize(path), os.stat(path).st_mtime):
+            pending.append((run, path))
+    added = append_reports(pending, archive_path)
+
+    if remove:
+        archive = ReportArchive(archive_path)
+        for report in list_report_files(input_folder):
+            run = run_id(report)
+            if run in archive:
+                # Gleiche Bytes wie im Archiv? Sonst bleibt die Textdatei liegen
+                with open(os.path.join(input_folder, report), "rb") as f:
+                    if f.read() == archive.read(run):
+                        os.remove(os.path.join(input_folder, report))
+    return added
+
+
+def main():
+    from cohort import INPUT_FOLDER, REPORT_SUFFIX
+
+    parser = argparse.ArgumentParser(description="Komprimiertes Report-Archiv mit Direktzugriff pro Run")
+    parser.add_argument("--archive", default=ARCHIVE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="Reports eines Ordners aufnehmen")
+    pack.add_argument("folder", nargs="?", default=INPUT_FOLDER)
+    pack.add_argument("--remove", action="store_true", help="Textdateien nach dem Archivieren löschen")
+    commands.add_parser("list", help="Archivierte Runs auflisten")
+    extract = commands.add_parser("extract", help="Einzelne Reports als Textdatei schreiben")
+    extract.add_argument("runs", nargs="+")
+    extract.add_argument("--to", default=".")
+    commands.add_parser("compact", help="Überholte Mitglieder entfernen")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        added = pack_folder(args.folder, args.archive, remove=args.remove)
+        archive = ReportArchive(args.archive)
+        raw = sum(entry[2] for entry in archive.entries.values())
+        print(f"✔ {len(added)} Reports aufgenommen, {len(archive)} im Archiv")
+        print(f"  {raw / 2**20:.1f} MB Text → {os.path.getsize(args.archive) / 2**20:.1f} MB Archiv")
+
+    elif args.command == "list":
+        archive = ReportArchive(args.archive)
+        for run in archive.runs():
+            size, mtime = archive.stat(run)
+            print(f"{run}\t{size}\t{time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}")
+
+    elif args.command == "extract":
+        archive = ReportArchive(args.archive)
+        os.makedirs(args.to, exist_ok=True)
+        for run in args.runs:
+            if run not in archive:
+                print(f"⚠ {run} ist nicht im Archiv")
+                continue
+            path = os.path.join(args.to, f"{run}{REPORT_SUFFIX}")
+            with open(path, "wb") as f:
+                f.write(archive.read(run))
+            _, mtime = archive.stat(run)
+            os.utime(path, (mtime, mtime))
+            print(f"✔ {path}")
+
+    elif args.command == "compact":
+        before = os.path.getsize(args.archive)
+        compact(args.archive)
+        print(f"✔ {before / 2**20:.1f} MB → {os.path.getsize(args.archive) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cohort import CACHE_DIR, abundance_matrix, load_manifest
+
+# This module hands large NumPy arrays (abundance matrix, distance matrices, metadata codes) to worker
+# processes without pickling them. The parent copies each array once into a shared memory block; workers
+# attach to the blocks by name and get zero-copy views, so per-worker memory stays flat as workers are added.
+#
+# Verwendung:
+#   with SharedArrays(counts=matrix, labels=codes) as shared:
+#       with shared.pool(workers) as pool:
+#           results = list(pool.map(task, params))
+#   # im Worker:
+#   counts = worker_arrays()["counts"]
+
+_attached = {}
+
+
+class SharedArrays:
+    """Besitzt die Shared-Memory-Blöcke und gibt sie beim Verlassen des Kontexts wieder frei."""
+
+    def __init__(self, **arrays):
+        self._blocks = []
+        self.handles = {}
+        self.arrays = {}
+        for name, array in arrays.items():
+            self.put(name, array)
+
+    def put(self, name, array):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+        self.arrays[name] = view
+        self._blocks.append(block)
+        self.handles[name] = (block.name, array.shape, array.dtype.str)
+        return self.handles[name]
+
+    def pool(self, workers):
+        """Prozess-Pool, dessen Worker beim Start an alle Blöcke andocken."""
+        return ProcessPoolExecutor(max_workers=workers, initializer=_attach_all, initargs=(self.handles,))
+
+    def close(self):
+        self.arrays = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(handle):
+    """Zero-copy-Sicht auf einen Block aus einem anderen Prozess (nur lesen)."""
+    name, shape, dtype = handle
+    # Worker aus dem Pool teilen den Resource-Tracker des Elternprozesses; freigegeben wird nur dort
+    block = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+def _attach_all(handles):
+    _attached.clear()
+    for name, handle in handles.items():
+        _attached[name] = attach(handle)
+
+
+def worker_arrays():
+    """Im Worker: name → Array aller Blöcke, an die beim Start angedockt wurde."""
+    return {name: array for name, (_, array) in _attached.items()}
+
+
+def share_cohort(runs=None, taxon_level="S", metadata=None, cache_dir=CACHE_DIR):
+    """
+    Legt die Abundanzmatrix (counts), die Virus-Reads pro Run (virus) und, falls Metadaten übergeben
+    werden, Kläranlage und Sammeltag als Codes (plant, day) in Shared Memory. Gibt (SharedArrays, runs,
+    taxids, plants) zurück.
+    """
+    counts = abundance_matrix(runs, taxon_level, cache_dir=cache_dir)
+    manifest = load_manifest(cache_dir)
+    virus = np.array([manifest[run]["qc"]["virus_reads"] for run in counts.index], dtype=np.float64)
+
+    shared = SharedArrays(counts=counts.to_numpy(), virus=virus)
+    plants = None
+    if metadata is not None:
+        meta = metadata.loc[counts.index]
+        plants, plant_codes = np.unique(meta["PLANT"].to_numpy(), return_inverse=True)
+        shared.put("plant", plant_codes)
+        shared.put("day", (meta["DATE"] - meta["DATE"].min()).dt.days.to_numpy())
+    return shared, list(counts.index), counts.columns.to_numpy(), plants
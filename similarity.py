@@ -1,10 +1,12 @@
-import os
+import numpy as np
 import pandas as pd
-from scipy.spatial.distance import pdist
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+from cohort import quarantined_runs, report_file, report_sources, virus_reads
 
 # This script compares Bray-Curtis similarities between technical replicates or the neirest temporal samples.
+# Mean and median come with bootstrap confidence intervals, once resampling pairs and once resampling plants
+# (pairs of the same plant are not independent). All resamples are drawn as index arrays and evaluated as
+# weighted statistics in a few NumPy operations per batch.
 # It can be configured by changing the constants below.
 
 # ============================================================
@@ -16,9 +18,13 @@ META_CSV = "samples.csv"
 TAXON_LEVEL = None
 MODE = "replicate"           # "replicate" oder "temporal"
 
-MIN_TOTAL_READS = 1_000_000
 DATE_COLUMN = "COLLECTION_DATE"
 PLANT_COLUMN = "PLANT"
+
+N_BOOT = 10000
+CI_LEVEL = 0.95
+SEED = 42
+BOOT_MEMORY_MB = 64            # Obergrenze für die Gewichtsmatrix eines Resample-Batches
 # ============================================================
 
 
@@ -33,10 +39,6 @@ def parse_kraken2_report(path, taxon_level):
     )
     df["name"] = df["name"].str.strip()
 
-    total_reads = df["reads_clade"].sum()
-    if total_reads < MIN_TOTAL_READS:
-        return None
-
     viruses_row = df[df["name"] == "Viruses"]
     if viruses_row.empty:
         return None
@@ -51,17 +53,31 @@ def parse_kraken2_report(path, taxon_level):
     return df.set_index("ncbi_taxid")["rel"]
 
 
+def profile_from_cached(report, taxon_level):
+    """Wie parse_kraken2_report, aber auf einem gecachten Report (siehe cohort.py)"""
+    virus_reads_total = virus_reads(report)
+    if virus_reads_total == 0:
+        return None
+
+    if taxon_level:
+        report = report[report["rank_code"] == taxon_level]
+
+    return pd.Series(report["reads_clade"].to_numpy() / virus_reads_total, index=report["ncbi_taxid"].to_numpy())
+
+
 def load_all_profiles(metadata):
     rel_abundances = {}
+    # Reports mit zu wenigen Reads etc. (siehe cohort.MIN_TOTAL_READS)
+    quarantine = quarantined_runs(INPUT_FOLDER)
+    # Textdateien und Reports, die nur im Archiv liegen (report_archive.py)
+    available = report_sources(INPUT_FOLDER)
 
     for _, row in metadata.iterrows():
         run = row["ENA_RUN_ACCESSION"]
-        report = os.path.join(INPUT_FOLDER, f"{run}_report.txt")
-
-        if not os.path.exists(report):
+        if run in quarantine or run not in available:
             continue
 
-        series = parse_kraken2_report(report, TAXON_LEVEL)
+        series = parse_kraken2_report(report_file(run, INPUT_FOLDER), TAXON_LEVEL)
         if series is not None:
             rel_abundances[run] = series
 
@@ -73,7 +89,7 @@ def bray_curtis_similarity(s1, s2):
     v1 = s1.reindex(taxa, fill_value=0)
     v2 = s2.reindex(taxa, fill_value=0)
 
-    return 1 - pdist([v1.values, v2.values], metric="braycurtis")[0]
+    return 1 - np.abs(v1.values - v2.values).sum() / (v1.values + v2.values).sum()
 
 
 # ============================================================
@@ -133,11 +149,123 @@ def compare_temporal(metadata, profiles):
     return pd.DataFrame(results)
 
 
+# ============================================================
+# BOOTSTRAP
+# ============================================================
+
+def _weighted_summaries(values, starts, weights):
+    """
+    Mittelwert und Median pro Segment für einen Batch von Resamples. values: innerhalb jedes Segments
+    aufsteigend sortiert, starts: Segmentanfänge, weights: (Resamples × Werte) Vielfachheiten.
+    Der Median entspricht np.median des Arrays, in dem jeder Wert so oft vorkommt wie sein Gewicht.
+    """
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    total = np.add.reduceat(weights, starts, axis=1)
+    mean = np.add.reduceat(weights * values, starts, axis=1) / total
+
+    cum = np.cumsum(weights, axis=1)
+    cum -= (cum[:, starts] - weights[:, starts])[:, segment]
+
+    def at_rank(rank):
+        # Anzahl der Werte im Segment, deren kumuliertes Gewicht den Rang nicht übersteigt
+        below = np.add.reduceat(cum <= rank[:, segment], starts, axis=1)
+        return values[starts + below]
+
+    median = 0.5 * (at_rank((total - 1) // 2) + at_rank(total // 2))
+    return mean, median
+
+
+def _resample_batches(n_values, n_boot=N_BOOT):
+    batch = max(1, BOOT_MEMORY_MB * 2**20 // (8 * 4 * max(n_values, 1)))
+    for start in range(0, n_boot, batch):
+        yield min(batch, n_boot - start)
+
+
+def _intervals(estimates, boot, index, ci_level=CI_LEVEL):
+    """Perzentil-Intervalle: estimates/boot als dict Statistik → (Segmente) bzw. (Resamples × Segmente)."""
+    alpha = (1 - ci_level) / 2
+    table = {}
+    for stat, estimate in estimates.items():
+        low, high = np.quantile(boot[stat], [alpha, 1 - alpha], axis=0)
+        table[stat] = estimate
+        table[f"{stat}_low"] = low
+        table[f"{stat}_high"] = high
+    return pd.DataFrame(table, index=index)
+
+
+def bootstrap_pairs(similarities, groups=None, n_boot=N_BOOT, ci_level=CI_LEVEL, seed=SEED):
+    """
+    Bootstrap über Paare, getrennt pro Gruppe (z.B. Kläranlage; None = alle Paare zusammen):
+    jedes Resample zieht innerhalb jeder Gruppe so viele Paare mit Zurücklegen, wie sie enthält.
+    """
+    values = np.asarray(similarities, dtype=np.float64)
+    groups = np.zeros(len(values), dtype=np.int64) if groups is None else np.asarray(groups)
+    names, codes = np.unique(groups, return_inverse=True)
+    order = np.lexsort((values, codes))
+    values, codes = values[order], codes[order]
+
+    sizes = np.bincount(codes, minlength=len(names))
+    starts = np.append(0, np.cumsum(sizes)[:-1])
+    estimates = dict(zip(["mean", "median"], _weighted_summaries(values, starts, np.ones((1, len(values))))))
+    estimates = {stat: estimate[0] for stat, estimate in estimates.items()}
+
+    rng = np.random.default_rng(seed)
+    boot = {"mean": [], "median": []}
+    for batch in _resample_batches(len(values), n_boot):
+        # Gezogene Position pro Platz, dann Vielfachheit jeder Position pro Resample
+        drawn = starts[codes] + (rng.random((batch, len(values))) * sizes[codes]).astype(np.int64)
+        rows = np.repeat(np.arange(batch), len(values))
+        weights = np.bincount(rows * len(values) + drawn.ravel(), minlength=batch * len(values))
+        mean, median = _weighted_summaries(values, starts, weights.reshape(batch, len(values)).astype(np.float64))
+        boot["mean"].append(mean)
+        boot["median"].append(median)
+
+    boot = {stat: np.concatenate(parts) for stat, parts in boot.items()}
+    return _intervals(estimates, boot, pd.Index(names, name="Group"), ci_level)
+
+
+def bootstrap_plants(similarities, plants, n_boot=N_BOOT, ci_level=CI_LEVEL, seed=SEED):
+    """
+    Cluster-Bootstrap: jedes Resample zieht Kläranlagen mit Zurücklegen und nimmt alle ihre Paare.
+    Berücksichtigt, dass Paare derselben Kläranlage nicht unabhängig sind.
+    """
+    values = np.asarray(similarities, dtype=np.float64)
+    names, codes = np.unique(np.asarray(plants), return_inverse=True)
+    order = np.argsort(values, kind="stable")
+    values, codes = values[order], codes[order]
+    starts = np.array([0])
+    estimates = _weighted_summaries(values, starts, np.ones((1, len(values))))
+    estimates = {"mean": estimates[0][0, 0], "median": estimates[1][0, 0]}
+
+    rng = np.random.default_rng(seed)
+    boot = {"mean": [], "median": []}
+    for batch in _resample_batches(len(values), n_boot):
+        drawn = rng.integers(0, len(names), size=(batch, len(names)))
+        rows = np.repeat(np.arange(batch), len(names))
+        multiplicity = np.bincount(rows * len(names) + drawn.ravel(), minlength=batch * len(names))
+        weights = multiplicity.reshape(batch, len(names))[:, codes].astype(np.float64)
+        mean, median = _weighted_summaries(values, starts, weights)
+        boot["mean"].append(mean)
+        boot["median"].append(median)
+
+    boot = {stat: np.concatenate(parts)[:, 0] for stat, parts in boot.items()}
+    return _intervals(estimates, boot, pd.Index(["Kläranlagen"]), ci_level)
+
+
+def bootstrap_summary(sim_df, metadata, n_boot=N_BOOT, ci_level=CI_LEVEL, seed=SEED):
+    """KIs für Mittelwert und Median aller Paare, einmal über Paare und einmal über Kläranlagen gezogen."""
+    plant_of = metadata.set_index("ENA_RUN_ACCESSION")[PLANT_COLUMN]
+    plants = sim_df["Run1"].map(plant_of)
+    by_pairs = bootstrap_pairs(sim_df["Similarity"], n_boot=n_boot, ci_level=ci_level, seed=seed)
+    by_plants = bootstrap_plants(sim_df["Similarity"], plants, n_boot, ci_level, seed)
+    return pd.concat([by_pairs.set_axis(["Paare"]), by_plants])
+
+
 # ============================================================
 # MAIN
 # ============================================================
 
-if __name__ == "__main__":
+def main():
     metadata = pd.read_csv(META_CSV, sep=";")
     profiles = load_all_profiles(metadata)
 
@@ -158,6 +286,8 @@ if __name__ == "__main__":
                 max_similarity=("Similarity", "max"),
             )
         )
+        intervals = bootstrap_pairs(sim_df["Similarity"], sim_df["Plant"])
+        summary = summary.join(intervals.drop(columns=["mean", "median"]))
         print(summary.round(4))
 
     else:
@@ -169,13 +299,16 @@ if __name__ == "__main__":
     print(f"Min:        {sim_df['Similarity'].min():.4f}")
     print(f"Max:        {sim_df['Similarity'].max():.4f}")
 
-    ax = sns.histplot(sim_df["Similarity"])
-    ax.set_xlabel("Bray-Curtis Similarity")
-    ax.set_ylabel("Count")
-    ax.set_title(title)
+    # Min und Max sind Extremwerte, für die der Bootstrap keine sinnvollen Intervalle liefert
+    print(f"\nBootstrap ({N_BOOT} Resamples, {CI_LEVEL:.0%}-KI):")
+    print(bootstrap_summary(sim_df, metadata).round(4))
+
+    from plotting import plot_similarity_histogram
+    plot_similarity_histogram(sim_df["Similarity"], title)
 
-    plt.tight_layout()
-    plt.show()
+
+if __name__ == "__main__":
+    main()
 
 
 # Results replica similarity:
@@ -183,21 +316,29 @@ if __name__ == "__main__":
 #  Mittelwert: 0.8940
 #  Median: 0.8999
 #  Min: 0.7874, Max: 0.9429
+#  95%-KI Mittelwert: 0.8825–0.9051 (Paare), 0.8737–0.9047 (Kläranlagen)
+#  95%-KI Median:     0.8863–0.9146 (Paare), 0.8545–0.9141 (Kläranlagen)
 
 #  Genus Level:
 #  Mittelwert: 0.9305
 #  Median: 0.9398
 #  Min: 0.8469, Max: 0.9660
+#  95%-KI Mittelwert: 0.9216–0.9389 (Paare), 0.9127–0.9412 (Kläranlagen)
+#  95%-KI Median:     0.9246–0.9471 (Paare), 0.8947–0.9475 (Kläranlagen)
 
 #  Family Level:
 #  Mittelwert: 0.9739
 #  Median: 0.9762
 #  Min: 0.9378, Max: 0.9900
+#  95%-KI Mittelwert: 0.9704–0.9772 (Paare), 0.9668–0.9790 (Kläranlagen)
+#  95%-KI Median:     0.9719–0.9785 (Paare), 0.9666–0.9773 (Kläranlagen)
 
 #  Overall:
 #  Mittelwert: 0.9867
 #  Median: 0.9866
 #  Min: 0.9668, Max: 0.9986
+#  95%-KI Mittelwert: 0.9843–0.9890 (Paare), 0.9857–0.9874 (Kläranlagen)
+#  95%-KI Median:     0.9843–0.9902 (Paare), 0.9843–0.9872 (Kläranlagen)
 
 # Results temporal similarity:
 #  Species Level:
@@ -205,21 +346,29 @@ if __name__ == "__main__":
 #  Median:     0.8226
 #  Min:        0.2438
 #  Max:        0.9452
+#  95%-KI Mittelwert: 0.7663–0.7978 (Paare), 0.7332–0.8105 (Kläranlagen)
+#  95%-KI Median:     0.8079–0.8360 (Paare), 0.7852–0.8439 (Kläranlagen)
 
 #  Genus Level:
 #  Mittelwert: 0.8121
 #  Median:     0.8482
 #  Min:        0.2759
 #  Max:        0.9671
+#  95%-KI Mittelwert: 0.7965–0.8270 (Paare), 0.7633–0.8402 (Kläranlagen)
+#  95%-KI Median:     0.8309–0.8588 (Paare), 0.8148–0.8737 (Kläranlagen)
 
 #  Oder Level:
 #  Mittelwert: 0.8603
 #  Median:     0.9064
 #  Min:        0.2842
 #  Max:        0.9961
+#  95%-KI Mittelwert: 0.8431–0.8769 (Paare), 0.8111–0.8883 (Kläranlagen)
+#  95%-KI Median:     0.8916–0.9227 (Paare), 0.8652–0.9298 (Kläranlagen)
 
 #  Overall:
 #  Mittelwert: 0.8745
 #  Median:     0.9207
 #  Min:        0.3220
-#  Max:        0.9980
\ No newline at end of file
+#  Max:        0.9980
+#  95%-KI Mittelwert: 0.8585–0.8897 (Paare), 0.8339–0.9001 (Kläranlagen)
+#  95%-KI Median:     0.9000–0.9356 (Paare), 0.8714–0.9493 (Kläranlagen)
\ No newline at end of file
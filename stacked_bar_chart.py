@@ -1,23 +1,27 @@
 import os
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from util import FAMILY_COLOR_MAP, PLANT_NAME_MAP
+from cohort import ARCHIVE_PATH, ingest_reports, iter_report_blocks, list_runs, quarantined_reports, report_file
+from util import PLANT_NAME_MAP
+from zeitreihe import level_abundances
 
 # This script creates stacked bar charts of viral taxonomic compositions across samples.
+# Reports are read from the report cache by default, and the bars are drawn with one collection per taxon
+# (plotting.py), so a chart over all samples takes seconds.
 # It can be configured by changing the constants below.
 
 # ============================================================
 # KONFIGURATION
 # ============================================================
 INPUT_FOLDER = "kraken2_run"
-REPORTS_TO_USE = ["ERR12510709_report.txt", "ERR12510710_report.txt", "ERR12510724_report.txt", "ERR12510725_report.txt"] # [] = alle Reports im Ordner
+REPORTS_TO_USE = [] # [] = alle Reports im Ordner, z.B. ["ERR12510709_report.txt", "ERR12510710_report.txt"]
 TAXON_LEVEL = "F"
 MIN_REL_ABUNDANCE = 0.03             # Taxa <x% werden zu "Other" zusammengefasst
 META_CSV = "samples.csv"
+FROM_CACHE = True                    # Reports aus dem Report-Cache (cohort.py) statt als Text parsen
 # ============================================================
 
-def parse_kraken2_report(path, taxon_level, sample_mapping):
+def parse_kraken2_report(path, taxon_level, sample_mapping, run=None):
     """
     Liest einen Kraken2-Report ein, filtert auf ein Taxonomie-Level
     und berechnet relative Häufigkeiten relativ zu allen Virus-Reads.
@@ -61,14 +65,14 @@ def parse_kraken2_report(path, taxon_level, sample_mapping):
     df_level["rel"] = df_level["reads_clade"] / virus_reads_total
     df_level = pd.concat([df_level[["name", "rel"]], unassigned_row], ignore_index=True)
 
-    # Sample Label bestimmen
-    basename = os.path.basename(path)
-    run_id = basename.replace("_report.txt", "")
+    # Sample Label bestimmen (path kann auch ein Datei-Objekt aus dem Archiv sein)
+    if run is None:
+        run = os.path.basename(path).replace("_report.txt", "")
 
-    if run_id in sample_mapping:
-        sample_label = sample_mapping[run_id]
+    if run in sample_mapping:
+        sample_label = sample_mapping[run]
     else:
-        sample_label = run_id
+        sample_label = run
 
     df_level["sample"] = sample_label
 
@@ -79,29 +83,44 @@ def load_reports(input_folder, reports_to_use, taxon_level, sample_mapping):
     """
     Lädt alle Reports einzeln, normalisiert sie, und kombiniert erst danach.
     """
-    all_files = sorted([f for f in os.listdir(input_folder) if f.endswith("_report.txt")])
-
-    if reports_to_use:
-        selected = [f for f in all_files if f in reports_to_use]
-    else:
-        selected = all_files
+    # Auch Runs, deren Report nur noch im Archiv liegt (report_archive.py)
+    selected = list_runs(input_folder, reports_to_use, quarantined_reports(input_folder))
 
     if not selected:
         raise RuntimeError("Keine passenden Reports gefunden!")
 
     dfs = []
-    for report in selected:
-        path = os.path.join(input_folder, report)
-        print(f"Lade {path}")
-        df_rel = parse_kraken2_report(path, taxon_level, sample_mapping)
+    for run in selected:
+        path = report_file(run, input_folder)
+        print(f"Lade {path if isinstance(path, str) else f'{ARCHIVE_PATH}:{run}'}")
+        df_rel = parse_kraken2_report(path, taxon_level, sample_mapping, run)
         dfs.append(df_rel)
 
     return pd.concat(dfs, ignore_index=True)
 
 
-def plot_stacked(df):
+def load_reports_cached(input_folder, reports_to_use, taxon_level, sample_mapping):
+    """Wie load_reports, aber aus dem Report-Cache (blockweise, ohne die Textdateien erneut zu parsen)."""
+    ingest_reports(input_folder, verbose=False)
+    runs = list_runs(input_folder, reports_to_use, quarantined_reports(input_folder))
+    if not runs:
+        raise RuntimeError("Keine passenden Reports gefunden!")
+
+    samples, series = [], []
+    for block in iter_report_blocks(runs, with_names=True):
+        for run, report in block:
+            # Mehrere Runs können dasselbe Label haben; pivot_table mittelt sie wie bei load_reports
+            samples.append(sample_mapping.get(run, run))
+            series.append(level_abundances(report, taxon_level))
+
+    df = pd.concat(series, keys=samples, names=["sample", "name"]).rename("rel").reset_index()
+    return df[["sample", "name", "rel"]]
+
+
+def composition_table(df):
     """
-    Erstellt einen gestapelten Balkenplot mit 'Other' und 'Unassigned'.
+    Samples × Taxa für den Balkenplot: kleine Taxa als 'Other', dazu 'Unassigned',
+    Taxa nach Gesamtanteil sortiert.
     """
 
     # Pivot: Zeilen = Samples, Spalten = Taxa, Werte = rel
@@ -141,19 +160,7 @@ def plot_stacked(df):
     if "Unassigned" in pivot_plot.columns:
         final_cols.append("Unassigned")
 
-    pivot_plot = pivot_plot[final_cols]
-
-    pivot_plot.plot(
-        color=FAMILY_COLOR_MAP,
-        kind="bar",
-        stacked=True,
-    )
-
-    plt.ylabel("Relative Abundance")
-    plt.title(f"Viral composition at taxonomic level '{TAXON_LEVEL}'")
-    plt.legend(title="Taxon", bbox_to_anchor=(1.05, 1), loc="upper left")
-    plt.tight_layout()
-    plt.show()
+    return pivot_plot[final_cols]
 
 def load_sample_metadata(csv_path):
     """
@@ -174,7 +181,16 @@ def load_sample_metadata(csv_path):
     return mapping
 
 
-if __name__ == "__main__":
+def main():
     sample_mapping = load_sample_metadata(META_CSV)
-    df = load_reports(INPUT_FOLDER, REPORTS_TO_USE, TAXON_LEVEL, sample_mapping)
-    plot_stacked(df)
+    if FROM_CACHE:
+        df = load_reports_cached(INPUT_FOLDER, REPORTS_TO_USE, TAXON_LEVEL, sample_mapping)
+    else:
+        df = load_reports(INPUT_FOLDER, REPORTS_TO_USE, TAXON_LEVEL, sample_mapping)
+
+    from plotting import plot_stacked_composition
+    plot_stacked_composition(composition_table(df), TAXON_LEVEL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from cohort import CACHE_DIR, INPUT_FOLDER, META_CSV, cached_runs, ingest_reports, load_metadata, load_report, load_taxa, virus_reads
+
+# This script watches every taxon at every rank in every plant for sudden rises. For each plant and taxon
+# it keeps an exponentially weighted baseline of the log relative abundance and a robust spread (EWMA of
+# the absolute deviation). Each new sample is scored against that baseline and then folded into it, so the
+# cost per sample is constant no matter how long the history is. Flagged rises are appended to an alerts table.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+ALPHA = 0.2                    # Gewicht einer neuen Probe in der EWMA
+PSEUDO_ABUNDANCE = 1e-6        # für log10 bei Abundanz 0
+Z_THRESHOLD = 4.0              # robuster z-Score, ab dem alarmiert wird
+MIN_REL_ABUNDANCE = 0.001      # Anstiege unterhalb dieser Abundanz ignorieren
+MIN_HISTORY = 5                # Proben pro Kläranlage, bevor alarmiert wird
+MIN_SCALE = 0.25               # Untergrenze der Streuung (log10-Einheiten)
+HUBER_K = 3.0                  # Ausreißer fließen nur gekappt in die Baseline ein
+STATE_FILE = "surveillance_state.npz"
+ALERTS_CSV = "surveillance_alerts.csv"
+# ============================================================
+
+MAD_TO_SD = np.sqrt(np.pi / 2)  # mittlere absolute Abweichung → Standardabweichung (Normalverteilung)
+
+
+class SurveillanceState:
+    """
+    Baseline pro Kläranlage (Zeile) und Taxon (Spalte). Neue Taxa werden als Spalte angehängt und
+    starten mit der Baseline "bisher nie gesehen", neue Kläranlagen als Zeile.
+    """
+
+    def __init__(self):
+        self.plants = []
+        self.taxids = np.empty(0, dtype=np.int64)
+        self.n_samples = np.empty(0, dtype=np.int64)
+        self.mean = np.empty((0, 0))
+        self.mad = np.empty((0, 0))
+        self.processed = set()
+
+    @classmethod
+    def load(cls, cache_dir=CACHE_DIR):
+        state = cls()
+        path = os.path.join(cache_dir, STATE_FILE)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                state.plants = list(data["plants"])
+                state.taxids = data["taxids"]
+                state.n_samples = data["n_samples"]
+                state.mean = data["mean"]
+                state.mad = data["mad"]
+                state.processed = set(data["processed"])
+        return state
+
+    def save(self, cache_dir=CACHE_DIR):
+        tmp = os.path.join(cache_dir, STATE_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, plants=np.array(self.plants, dtype="U64"), taxids=self.taxids, n_samples=self.n_samples,
+                     mean=self.mean, mad=self.mad, processed=np.array(sorted(self.processed), dtype="U32"))
+        os.replace(tmp, os.path.join(cache_dir, STATE_FILE))
+
+    def plant_row(self, plant):
+        if plant not in self.plants:
+            self.plants.append(plant)
+            self.n_samples = np.append(self.n_samples, 0)
+            self.mean = np.vstack([self.mean, np.full((1, len(self.taxids)), np.log10(PSEUDO_ABUNDANCE))])
+            self.mad = np.vstack([self.mad, np.zeros((1, len(self.taxids)))])
+        return self.plants.index(plant)
+
+    def columns(self, taxids):
+        """Spaltenindizes der Taxids; unbekannte Taxa werden angehängt."""
+        new = np.setdiff1d(taxids, self.taxids)
+        if len(new):
+            self.taxids = np.concatenate([self.taxids, new])
+            self.mean = np.hstack([self.mean, np.full((len(self.plants), len(new)), np.log10(PSEUDO_ABUNDANCE))])
+            self.mad = np.hstack([self.mad, np.zeros((len(self.plants), len(new)))])
+
+        order = np.argsort(self.taxids)
+        return order[np.searchsorted(self.taxids, taxids, sorter=order)]
+
+
+def sample_abundances(report):
+    """Relative Abundanz (reads_clade / Virus-Reads) aller Taxa unterhalb der Wurzel."""
+    rows = report[report["depth"] > 0]
+    total = virus_reads(report)
+    if total == 0:
+        return None, None
+    return rows["ncbi_taxid"].to_numpy(), rows["reads_clade"].to_numpy() / total
+
+
+def update(state, plant, taxids, rel):
+    """
+    Bewertet eine Probe gegen die Baseline ihrer Kläranlage und aktualisiert diese.
+    Gibt z-Scores, Alarm-Maske und die vorherige Baseline für alle bekannten Taxa zurück.
+    """
+    row = state.plant_row(plant)
+    cols = state.columns(taxids)
+
+    x = np.full(len(state.taxids), np.log10(PSEUDO_ABUNDANCE))
+    x[cols] = np.log10(rel + PSEUDO_ABUNDANCE)
+    abundance = np.zeros(len(state.taxids))
+    abundance[cols] = rel
+
+    n = state.n_samples[row]
+    mean, mad = state.mean[row], state.mad[row]
+    scale = np.maximum(MAD_TO_SD * mad, MIN_SCALE)
+    z = (x - mean) / scale
+    alerts = (n >= MIN_HISTORY) & (z >= Z_THRESHOLD) & (abundance >= MIN_REL_ABUNDANCE)
+    baseline = mean.copy()
+
+    if n == 0:
+        mean[:] = x
+    else:
+        # Anfangs laufender Mittelwert, danach EWMA; Ausreißer nur gekappt (Huber)
+        alpha = max(ALPHA, 1 / (n + 1))
+        deviation = np.clip(x - mean, -HUBER_K * scale, HUBER_K * scale)
+        mean += alpha * deviation
+        mad *= 1 - alpha
+        mad += alpha * np.abs(deviation)
+    state.n_samples[row] += 1
+
+    return z, alerts, baseline
+
+
+def process_new_runs(state, metadata, cache_dir=CACHE_DIR):
+    """Verarbeitet alle noch nicht gesehenen Runs in Reihenfolge des Sammeldatums."""
+    runs = [run for run in cached_runs(cache_dir) if run not in state.processed and run in metadata.index]
+    runs.sort(key=lambda run: (metadata.loc[run, "DATE"], run))
+
+    taxa = load_taxa(cache_dir)
+    alerts = []
+    for run in runs:
+        taxids, rel = sample_abundances(load_report(run, cache_dir))
+        state.processed.add(run)
+        if taxids is None:
+            continue
+
+        plant, date = metadata.loc[run, "PLANT"], metadata.loc[run, "DATE"]
+        z, flagged, baseline = update(state, plant, taxids, rel)
+
+        hits = np.flatnonzero(flagged)
+        if len(hits):
+            hit_taxids = state.taxids[hits]
+            rel_by_taxid = pd.Series(rel, index=taxids)
+            alerts.append(pd.DataFrame({
+                "run": run,
+                "DATE": date,
+                "PLANT": plant,
+                "ncbi_taxid": hit_taxids,
+                "rank_code": taxa["rank_code"].reindex(hit_taxids).to_numpy(),
+                "name": taxa["name"].reindex(hit_taxids).to_numpy(),
+                "rel_abundance": rel_by_taxid.reindex(hit_taxids).to_numpy(),
+                "baseline": 10 ** baseline[hits],
+                "z": z[hits],
+            }))
+
+    return runs, pd.concat(alerts, ignore_index=True) if alerts else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Anomalie-Erkennung für alle Taxa und Kläranlagen")
+    parser.add_argument("--reset", action="store_true", help="Baselines verwerfen und alle Reports neu einlesen")
+    args = parser.parse_args()
+
+    ingest_reports(INPUT_FOLDER, verbose=False)
+    metadata = load_metadata(META_CSV)
+
+    if args.reset:
+        for path in (os.path.join(CACHE_DIR, STATE_FILE), ALERTS_CSV):
+            if os.path.exists(path):
+                os.remove(path)
+    state = SurveillanceState.load()
+
+    runs, alerts = process_new_runs(state, metadata)
+    state.save()
+    print(f"✔ {len(runs)} neue Proben verarbeitet ({len(state.plants)} Kläranlagen, {len(state.taxids)} Taxa)")
+
+    if alerts is None:
+        print("Keine Auffälligkeiten.")
+        return
+
+    alerts.to_csv(ALERTS_CSV, mode="a", header=not os.path.exists(ALERTS_CSV), index=False)
+    print(f"⚠ {len(alerts)} Alarme → {ALERTS_CSV}\n")
+    with pd.option_context("display.max_rows", 50, "display.width", 200):
+        print(alerts.sort_values("z", ascending=False).head(30).round(4).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from cohort import CACHE_DIR, INPUT_FOLDER, META_CSV, ingest_reports, load_metadata, load_quarantine, load_report, load_taxa
+
+# This module maintains an inverted index taxid → (run, reads_clade, reads_direct) over the report cache,
+# so questions like "which samples contain taxon X" no longer require scanning every report.
+# The index is updated incrementally: only new or changed reports are read.
+#
+# Verwendung:
+#   python taxon_index.py Carjivirus
+#   python taxon_index.py 2948652 --clade
+
+INDEX_FILE = "taxon_index.npz"
+
+POSTING_FIELDS = ["taxid", "run_idx", "reads_clade", "reads_direct"]
+
+
+def _empty_index():
+    return {
+        "runs": np.array([], dtype="U32"),
+        "run_mtime": np.array([], dtype=np.float64),
+        "taxid": np.array([], dtype=np.int64),
+        "run_idx": np.array([], dtype=np.int32),
+        "reads_clade": np.array([], dtype=np.int64),
+        "reads_direct": np.array([], dtype=np.int64),
+        "keys": np.array([], dtype=np.int64),
+        "offsets": np.array([0], dtype=np.int64),
+        "tree_taxid": np.array([], dtype=np.int64),
+        "tree_parent": np.array([], dtype=np.int64),
+    }
+
+
+def load_index(cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return _empty_index()
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _finalize(index):
+    """Sortiert die Postings nach (taxid, run) und baut die Offsets pro Taxid neu auf."""
+    order = np.lexsort((index["run_idx"], index["taxid"]))
+    for field in POSTING_FIELDS:
+        index[field] = index[field][order]
+
+    keys, starts = np.unique(index["taxid"], return_index=True)
+    index["keys"] = keys
+    index["offsets"] = np.append(starts, len(index["taxid"])).astype(np.int64)
+
+    tree_taxid, first = np.unique(index["tree_taxid"], return_index=True)
+    index["tree_taxid"] = tree_taxid
+    index["tree_parent"] = index["tree_parent"][first]
+    return index
+
+
+def update_index(input_folder=INPUT_FOLDER, cache_dir=CACHE_DIR, verbose=True):
+    """
+    Bringt den Index auf den Stand des Report-Caches. Postings geänderter oder
+    gelöschter Runs werden entfernt, nur neue Runs werden aus dem Cache gelesen.
+    """
+    manifest = ingest_reports(input_folder, cache_dir, verbose=verbose)
+    # Unlesbare Reports haben keinen Cache-Eintrag, der indexiert werden könnte
+    manifest = {run: entry for run, entry in manifest.items() if "error" not in entry["qc"]}
+    index = load_index(cache_dir)
+
+    known = dict(zip(index["runs"].tolist(), index["run_mtime"].tolist()))
+    stale = {run for run, mtime in known.items() if run not in manifest or manifest[run]["mtime"] != mtime}
+    new_runs = sorted(run for run in manifest if run not in known or run in stale)
+    if not stale and not new_runs:
+        return index
+
+    # Verbleibende Runs neu durchnummerieren, Postings veralteter Runs verwerfen
+    keep = np.array([run not in stale for run in index["runs"].tolist()], dtype=bool)
+    remap = np.full(len(keep), -1, dtype=np.int32)
+    remap[keep] = np.arange(keep.sum(), dtype=np.int32)
+    mask = remap[index["run_idx"]] >= 0
+    kept_runs = index["runs"][keep]
+
+    parts = {field: [index[field][mask]] for field in POSTING_FIELDS}
+    parts["run_idx"] = [remap[index["run_idx"][mask]]]
+    tree_taxid, tree_parent = [index["tree_taxid"]], [index["tree_parent"]]
+
+    offset = len(kept_runs)
+    for i, run in enumerate(new_runs):
+        if verbose:
+            print(f"Indexiere {run}")
+        report = load_report(run, cache_dir)
+        parts["taxid"].append(report["ncbi_taxid"].to_numpy())
+        parts["run_idx"].append(np.full(len(report), offset + i, dtype=np.int32))
+        parts["reads_clade"].append(report["reads_clade"].to_numpy())
+        parts["reads_direct"].append(report["reads_direct"].to_numpy())
+        tree_taxid.append(report["ncbi_taxid"].to_numpy())
+        tree_parent.append(report["parent_taxid"].to_numpy())
+
+    index = {field: np.concatenate(arrays) for field, arrays in parts.items()}
+    index["runs"] = np.concatenate([kept_runs, np.array(new_runs, dtype="U32")])
+    index["run_mtime"] = np.array([manifest[run]["mtime"] for run in index["runs"].tolist()], dtype=np.float64)
+    index["tree_taxid"] = np.concatenate(tree_taxid)
+    index["tree_parent"] = np.concatenate(tree_parent)
+    index = _finalize(index)
+
+    np.savez(os.path.join(cache_dir, INDEX_FILE), **index)
+    return index
+
+
+def resolve_taxid(taxon, cache_dir=CACHE_DIR):
+    """Akzeptiert eine Taxid oder einen Taxon-Namen."""
+    if isinstance(taxon, (int, np.integer)) or str(taxon).isdigit():
+        return int(taxon)
+
+    taxa = load_taxa(cache_dir)
+    matches = taxa.index[taxa["name"] == str(taxon).strip()]
+    if len(matches) == 0:
+        raise KeyError(f"Taxon '{taxon}' nicht im Index")
+    if len(matches) > 1:
+        print(f"⚠ '{taxon}' ist mehrdeutig ({', '.join(map(str, matches))}), verwende {matches[0]}")
+    return int(matches[0])
+
+
+def descendants(index, taxid):
+    """Alle Taxids unterhalb von taxid (inklusive taxid selbst)."""
+    found = [np.array([taxid], dtype=np.int64)]
+    frontier = found[0]
+    while len(frontier):
+        frontier = index["tree_taxid"][np.isin(index["tree_parent"], frontier)]
+        found.append(frontier)
+    return np.unique(np.concatenate(found))
+
+
+def parents(index, taxids):
+    """Eltern-Taxid zu jeder Taxid (-1 für Wurzeln und unbekannte Taxids)."""
+    taxids = np.asarray(taxids, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(index["tree_taxid"], taxids), len(index["tree_taxid"]) - 1)
+    return np.where(index["tree_taxid"][pos] == taxids, index["tree_parent"][pos], -1)
+
+
+def postings(index, taxids):
+    """Postings (taxid, run, reads_clade, reads_direct) für ein oder mehrere Taxids."""
+    taxids = np.atleast_1d(np.asarray(taxids, dtype=np.int64))
+    pos = np.searchsorted(index["keys"], taxids)
+    pos = pos[(pos < len(index["keys"])) & (index["keys"][np.minimum(pos, len(index["keys"]) - 1)] == taxids)]
+
+    # Posting-Bereiche [start, end) ohne Python-Schleife zu einem Zeilen-Array verketten
+    starts, lengths = index["offsets"][pos], index["offsets"][pos + 1] - index["offsets"][pos]
+    rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    return pd.DataFrame({
+        "ncbi_taxid": index["taxid"][rows],
+        "run": index["runs"][index["run_idx"][rows]],
+        "reads_clade": index["reads_clade"][rows],
+        "reads_direct": index["reads_direct"][rows],
+    })
+
+
+def query_taxon(index, taxon, clade=False, metadata=None, cache_dir=CACHE_DIR, include_quarantined=False):
+    """
+    Beantwortet "welche Runs enthalten Taxon X und mit wie vielen Reads". Mit clade=True
+    werden zusätzlich alle Nachfahren aufgeführt (eine Zeile pro Run und Taxid).
+    """
+    taxid = resolve_taxid(taxon, cache_dir)
+    taxids = descendants(index, taxid) if clade else taxid
+    result = postings(index, taxids)
+    if not include_quarantined:
+        result = result[~result["run"].isin(list(load_quarantine(cache_dir)))].reset_index(drop=True)
+    result["name"] = result["ncbi_taxid"].map(load_taxa(cache_dir)["name"])
+
+    if metadata is not None:
+        result["PLANT"] = result["run"].map(metadata["PLANT"])
+        result["DATE"] = result["run"].map(metadata["DATE"])
+        result = result.sort_values(["ncbi_taxid", "PLANT", "DATE"], ignore_index=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Abfrage des Taxon-Index über alle Reports")
+    parser.add_argument("taxon", help="Taxid oder Taxon-Name")
+    parser.add_argument("--clade", action="store_true", help="Alle Nachfahren mit abfragen")
+    args = parser.parse_args()
+
+    index = update_index(verbose=False)
+    metadata = load_metadata(META_CSV)
+
+    start = time.perf_counter()
+    result = query_taxon(index, args.taxon, clade=args.clade, metadata=metadata)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(result)
+    print(f"\n{len(result)} Treffer in {result['run'].nunique()} Runs ({elapsed:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
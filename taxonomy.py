@@ -0,0 +1,219 @@
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# This module builds a lineage index from a local NCBI taxdump (nodes.dmp, names.dmp), e.g. the one the
+# Kraken2 database was built from. All lookups are plain array accesses by taxid: parent, rank, scientific
+# name, and the ancestor on each rank of LINEAGE_RANKS (precomputed for every node). The index is stored
+# as .npy files and opened memory-mapped, so loading it costs nothing and only the touched pages are read.
+# cohort.ingest_reports uses it to attach the full lineage to every report row as integer taxids.
+#
+# Verwendung:
+#   python taxonomy.py 2948652 10239
+#   python taxonomy.py --taxdump taxdump_fixture 2948652    # kleiner Ausschnitt zum Ausprobieren
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+TAXDUMP_DIR = "taxdump"        # entpacktes taxdump.tar.gz (ftp.ncbi.nih.gov/pub/taxonomy/)
+INDEX_DIR = "report_cache/taxonomy"
+LINEAGE_RANKS = ["realm", "kingdom", "phylum", "class", "order", "family", "genus", "species"]
+MAX_DEPTH = 128
+# ============================================================
+
+META_FILE = "meta.json"
+# Kraken2-Rang-Code → Rang im taxdump (für die Rang-Auswahl über die Lineage-Spalten)
+RANK_CODES = {"K": "kingdom", "P": "phylum", "C": "class", "O": "order", "F": "family", "G": "genus", "S": "species"}
+ARRAYS = ["parent", "rank_code", "name_offsets", "lineage"]
+NAMES_FILE = "names.bin"
+
+
+class Taxonomy:
+    """
+    Memory-gemappter Lineage-Index. Alle Arrays sind über die Taxid indiziert (-1 = unbekannt);
+    lineage[taxid, i] ist der Vorfahre auf LINEAGE_RANKS[i] (oder die Taxid selbst).
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.ranks = self.meta["ranks"]
+        self.lineage_ranks = self.meta["lineage_ranks"]
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r"))
+        self.names = np.memmap(os.path.join(index_dir, NAMES_FILE), dtype=np.uint8, mode="r") \
+            if self.name_offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+    def _gather(self, array, taxids, missing=-1):
+        taxids = np.asarray(taxids, dtype=np.int64)
+        valid = (taxids >= 0) & (taxids < len(self.parent))
+        result = np.full(taxids.shape + array.shape[1:], missing, dtype=array.dtype)
+        result[valid] = array[taxids[valid]]
+        return result
+
+    def parents(self, taxids):
+        return self._gather(self.parent, taxids)
+
+    def known(self, taxid):
+        return 0 <= taxid < len(self.parent) and self.parent[taxid] >= 0
+
+    def rank(self, taxid):
+        return self.ranks[self.rank_code[taxid]] if self.known(taxid) else None
+
+    def name(self, taxid):
+        if not self.known(taxid):
+            return None
+        return self.names[self.name_offsets[taxid]:self.name_offsets[taxid + 1]].tobytes().decode()
+
+    def ancestors(self, taxid):
+        """Vorfahren von taxid bis zur Wurzel (ohne taxid selbst)."""
+        result = []
+        while self.known(taxid) and self.parent[taxid] != taxid and len(result) < MAX_DEPTH:
+            taxid = int(self.parent[taxid])
+            result.append(taxid)
+        return result
+
+    def lineage_of(self, taxids):
+        """(len(taxids) × len(lineage_ranks)) Vorfahren-Taxids, -1 wo es auf dem Rang keinen gibt."""
+        return self._gather(self.lineage, taxids)
+
+    def lineage_frame(self, taxids):
+        """Lineage mit Namen, eine Zeile pro Taxid, eine Spalte pro Rang."""
+        lineage = self.lineage_of(taxids)
+        names = {taxid: self.name(taxid) for taxid in np.unique(lineage[lineage >= 0]).tolist()}
+        frame = pd.DataFrame(lineage, index=pd.Index(np.asarray(taxids), name="ncbi_taxid"), columns=self.lineage_ranks)
+        return frame.apply(lambda column: column.map(names))
+
+
+def _read_dmp(path, columns):
+    # Felder sind durch "\t|\t" getrennt, d.h. jedes zweite Tab-Feld ist ein "|"
+    return pd.read_csv(path, sep="\t", header=None, usecols=[2 * i for i in columns], quoting=csv.QUOTE_NONE,
+                       dtype=str, keep_default_na=False).set_axis(range(len(columns)), axis=1)
+
+
+def _source_stat(taxdump_dir):
+    return {name: [os.path.getsize(os.path.join(taxdump_dir, name)), os.path.getmtime(os.path.join(taxdump_dir, name))]
+            for name in ["nodes.dmp", "names.dmp"]}
+
+
+def _depths(parent, taxids):
+    """Tiefe jedes Knotens (Wurzel = 0) durch gleichzeitiges Hochlaufen aller Knoten."""
+    depth = np.zeros(len(taxids), dtype=np.int32)
+    current = parent[taxids]
+    open_ = current != taxids
+    for _ in range(MAX_DEPTH):
+        if not open_.any():
+            break
+        depth[open_] += 1
+        nxt = parent[current]
+        open_ &= (nxt != current) & (nxt >= 0)
+        current = np.where(open_, nxt, current)
+    return depth
+
+
+def build_index(taxdump_dir=TAXDUMP_DIR, index_dir=INDEX_DIR, lineage_ranks=LINEAGE_RANKS):
+    """Liest nodes.dmp und names.dmp einmal und schreibt den Index nach index_dir."""
+    nodes = _read_dmp(os.path.join(taxdump_dir, "nodes.dmp"), [0, 1, 2])
+    taxids = nodes[0].astype(np.int64).to_numpy()
+    size = int(taxids.max()) + 1
+
+    parent = np.full(size, -1, dtype=np.int32)
+    parent[taxids] = nodes[1].astype(np.int64).to_numpy()
+    ranks, rank_codes = np.unique(nodes[2].to_numpy(), return_inverse=True)
+    rank_code = np.zeros(size, dtype=np.uint8)
+    rank_code[taxids] = rank_codes
+
+    names = _read_dmp(os.path.join(taxdump_dir, "names.dmp"), [0, 1, 3])
+    names = names[names[2] == "scientific name"]
+    encoded = names[1].str.encode("utf-8")
+    lengths = np.zeros(size, dtype=np.int64)
+    name_taxids = names[0].astype(np.int64).to_numpy()
+    lengths[name_taxids] = encoded.str.len().to_numpy()
+    name_offsets = np.append(0, np.cumsum(lengths))
+    blob = np.frombuffer(b"".join(encoded.to_numpy()[np.argsort(name_taxids)]), dtype=np.uint8)
+
+    # Vorfahren pro Rang: von der Wurzel abwärts, eine Baumebene nach der anderen
+    lineage = np.full((size, len(lineage_ranks)), -1, dtype=np.int32)
+    for i, name in enumerate(lineage_ranks):
+        if name in ranks:
+            own = taxids[rank_code[taxids] == np.searchsorted(ranks, name)]
+            lineage[own, i] = own
+    depth = _depths(parent, taxids)
+    order = np.argsort(depth, kind="stable")
+    bounds = np.searchsorted(depth[order], np.arange(1, depth.max() + 2))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        level = taxids[order[start:end]]
+        lineage[level] = np.where(lineage[level] >= 0, lineage[level], lineage[parent[level]])
+
+    os.makedirs(index_dir, exist_ok=True)
+    if os.path.exists(os.path.join(index_dir, META_FILE)):
+        os.remove(os.path.join(index_dir, META_FILE))
+    for name, array in [("parent", parent), ("rank_code", rank_code), ("name_offsets", name_offsets), ("lineage", lineage)]:
+        np.save(os.path.join(index_dir, f"{name}.npy"), array)
+    blob.tofile(os.path.join(index_dir, NAMES_FILE))
+    meta = {"ranks": ranks.tolist(), "lineage_ranks": list(lineage_ranks), "source": os.path.abspath(taxdump_dir),
+            "stat": _source_stat(taxdump_dir)}
+    # meta.json zuletzt: ein Index ohne meta.json gilt als unvollständig
+    with open(os.path.join(index_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=1)
+    return Taxonomy(index_dir)
+
+
+def load_taxonomy(taxdump_dir=TAXDUMP_DIR, index_dir=INDEX_DIR, verbose=False):
+    """
+    Index zum taxdump, bei Bedarf (neu) gebaut. None, wenn kein taxdump vorliegt und auch kein Index
+    gebaut wurde.
+    """
+    meta_path = os.path.join(index_dir, META_FILE)
+    if taxdump_dir is None or not os.path.exists(os.path.join(taxdump_dir, "nodes.dmp")):
+        return Taxonomy(index_dir) if os.path.exists(meta_path) else None
+
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta["source"] == os.path.abspath(taxdump_dir) and meta["lineage_ranks"] == LINEAGE_RANKS
+                and meta["stat"] == _source_stat(taxdump_dir)):
+            return Taxonomy(index_dir)
+    if verbose:
+        print(f"→ Baue Lineage-Index aus {taxdump_dir}/")
+    return build_index(taxdump_dir, index_dir)
+
+
+def fingerprint(taxonomy):
+    """Kennung des Index-Stands, damit gecachte Lineages bei einem neuen taxdump ersetzt werden."""
+    return None if taxonomy is None else json.dumps([taxonomy.meta["stat"], taxonomy.lineage_ranks], sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lineage-Abfrage über einen lokalen NCBI-taxdump")
+    parser.add_argument("taxids", nargs="+", type=int)
+    parser.add_argument("--taxdump", default=TAXDUMP_DIR)
+    parser.add_argument("--index-dir", default=None, help="Standard: INDEX_DIR bzw. <taxdump>/index")
+    args = parser.parse_args()
+
+    index_dir = args.index_dir or (INDEX_DIR if args.taxdump == TAXDUMP_DIR else os.path.join(args.taxdump, "index"))
+    taxonomy = load_taxonomy(args.taxdump, index_dir, verbose=True)
+    if taxonomy is None:
+        print(f"⚠ Kein taxdump in {args.taxdump}/ (nodes.dmp, names.dmp)")
+        return
+
+    for taxid in args.taxids:
+        name = taxonomy.name(taxid)
+        if name is None:
+            print(f"⚠ {taxid} ist nicht im taxdump")
+            continue
+        print(f"{taxid}\t{name} ({taxonomy.rank(taxid)})")
+        for ancestor in taxonomy.ancestors(taxid):
+            print(f"  {ancestor}\t{taxonomy.name(ancestor)} ({taxonomy.rank(ancestor)})")
+    print()
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(taxonomy.lineage_frame(args.taxids))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cohort import (CACHE_DIR, META_CSV, abundance_matrix, cached_runs, derived_path, ingest_reports, load_manifest,
+                    load_metadata, load_taxa, save_derived, track_peak_memory)
+
+# This module precomputes the time series behind zeitreihe.py as a cube plant × date × taxon for several
+# ranks. Each rank is built in one grouped pass over the cohort abundance matrix and cached compactly
+# (float32, rows sorted by plant and date). Slicing a plant is a view into the array, and applying a
+# different MIN_REL_ABUNDANCE only compares the precomputed per-plant maxima against the new threshold.
+# It can be configured by changing the constants below.
+
+# ============================================================
+# KONFIGURATION
+# ============================================================
+RANKS = ["O", "F", "G", "S"]
+# ============================================================
+
+
+class TimeCube:
+    """
+    Zeitreihen-Würfel eines Levels. values: (Kläranlage, Datum)-Zeilen × Taxa mit der über Replikate
+    gemittelten relativen Abundanz; plant_offsets[i]:plant_offsets[i + 1] sind die Zeilen der Kläranlage i.
+    """
+
+    def __init__(self, rank, plants, plant_offsets, dates, taxa, values, unassigned, maxima):
+        self.rank = rank
+        self.plants = list(plants)
+        self.plant_offsets = plant_offsets
+        self.dates = dates
+        self.taxa = taxa
+        self.values = values
+        self.unassigned = unassigned
+        self.maxima = maxima
+        self._plant_index = {plant: i for i, plant in enumerate(self.plants)}
+
+    def plant_slice(self, plant):
+        i = self._plant_index[plant]
+        return slice(self.plant_offsets[i], self.plant_offsets[i + 1])
+
+    def series(self, plant, min_rel_abundance):
+        """
+        Wie zeitreihe.prepare_time_series: Taxa, deren Maximum in einem Run der Kläranlage unter
+        min_rel_abundance liegt, werden zu "Other" zusammengefasst, dazu "Unassigned".
+        """
+        if plant not in self._plant_index:
+            print(f"⚠ Keine Daten für Kläranlage {plant}")
+            return None
+
+        rows = self.plant_slice(plant)
+        values = self.values[rows]
+        keep = np.flatnonzero(self.maxima[self._plant_index[plant]] >= min_rel_abundance)
+        kept = values[:, keep].astype(np.float64)
+        order = np.argsort(-kept.sum(axis=0), kind="stable")
+
+        frame = pd.DataFrame(kept[:, order], index=pd.DatetimeIndex(self.dates[rows], name="DATE"),
+                             columns=pd.Index(self.taxa[keep][order], name="name"))
+        frame["Other"] = values.sum(axis=1, dtype=np.float64) - kept.sum(axis=1)
+        frame["Unassigned"] = self.unassigned[rows]
+        return frame
+
+
+def build_cube(rank, runs, metadata, cache_dir=CACHE_DIR):
+    """Ein gruppierter Durchlauf: Runs × Taxa → Mittelwert pro (Kläranlage, Datum), Maximum pro Kläranlage."""
+    counts = abundance_matrix(runs, rank, cache_dir=cache_dir)
+    manifest = load_manifest(cache_dir)
+    virus = np.array([manifest[run]["qc"]["virus_reads"] for run in counts.index], dtype=np.float64)
+    rel = counts.to_numpy() / virus[:, None]
+
+    # Gleichnamige Taxa zusammenfassen wie level_abundances in zeitreihe.py
+    names = load_taxa(cache_dir)["name"].reindex(counts.columns).to_numpy()
+    taxa, name_idx = np.unique(names, return_inverse=True)
+    by_name = sparse.csr_matrix((np.ones(len(names)), (np.arange(len(names)), name_idx)), shape=(len(names), len(taxa)))
+    rel = np.asarray(rel @ by_name)
+
+    meta = metadata.loc[counts.index]
+    keys = pd.MultiIndex.from_arrays([meta["PLANT"].to_numpy(), meta["DATE"].to_numpy()], names=["PLANT", "DATE"])
+    row_codes, row_keys = pd.factorize(keys, sort=True)
+    plant_codes, plants = pd.factorize(meta["PLANT"].to_numpy(), sort=True)
+
+    n_rows = len(row_keys)
+    runs_per_row = np.bincount(row_codes, minlength=n_rows)
+    values = np.zeros((n_rows, rel.shape[1]))
+    np.add.at(values, row_codes, rel)
+    values /= runs_per_row[:, None]
+
+    unassigned = np.bincount(row_codes, weights=1 - rel.sum(axis=1), minlength=n_rows) / runs_per_row
+
+    maxima = np.zeros((len(plants), rel.shape[1]))
+    np.maximum.at(maxima, plant_codes, rel)
+
+    row_plants = row_keys.get_level_values(0)
+    plant_offsets = np.searchsorted(pd.Index(row_plants), plants, side="left")
+    plant_offsets = np.append(plant_offsets, n_rows)
+
+    return TimeCube(rank, plants, plant_offsets, row_keys.get_level_values(1).to_numpy(), taxa.astype(str),
+                    values.astype(np.float32), unassigned, maxima.astype(np.float32))
+
+
+def load_cube(rank, runs=None, metadata=None, cache_dir=CACHE_DIR):
+    """Würfel eines Levels aus dem Cache, bei Bedarf neu aufgebaut."""
+    if runs is None:
+        runs = cached_runs(cache_dir)
+    if metadata is None:
+        metadata = load_metadata(META_CSV)
+    runs = [run for run in runs if run in metadata.index]
+
+    path = derived_path(f"timecube_{rank}", runs, cache_dir)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return TimeCube(rank, data["plants"], data["plant_offsets"], data["dates"], data["taxa"], data["values"],
+                            data["unassigned"], data["maxima"])
+
+    cube = build_cube(rank, runs, metadata, cache_dir)
+    save_derived(path, plants=np.array(cube.plants, dtype="U64"), plant_offsets=cube.plant_offsets,
+                 dates=cube.dates, taxa=cube.taxa, values=cube.values, unassigned=cube.unassigned, maxima=cube.maxima)
+    return cube
+
+
+if __name__ == "__main__":
+    ingest_reports(verbose=False)
+    metadata = load_metadata(META_CSV)
+
+    with track_peak_memory("Zeitreihen-Würfel"):
+        cubes = {rank: load_cube(rank, metadata=metadata) for rank in RANKS}
+
+    for rank, cube in cubes.items():
+        print(f"Level {rank}: {len(cube.plants)} Kläranlagen, {cube.values.shape[0]} Datumswerte, "
+              f"{cube.values.shape[1]} Taxa ({cube.values.nbytes / 2**20:.1f} MB)")
@@ -64,3 +64,48 @@ GENUS_COLOR_MAP = {
     "Pamexvirus":        "#fdbf6f",
     "Immutovirus":       "#ffff99",
 }
+
+# Taxids der Taxa in den Farbtabellen (Datenbank viral-20250402). Mit Lineage-Index (taxonomy.py) werden
+# Farben und Reihenfolge über diese Taxids zugeordnet, so dass umbenannte Taxa ihre Farbe behalten.
+TAXON_IDS = {
+    "Crassvirales":       1978007,
+    "Timlovirales":       2842249,
+    "Chitovirales":       2732527,
+    "Imitervirales":      2732554,
+    "Herpesvirales":      548681,
+    "Lefavirales":        2840070,
+    "Bunyavirales":       1980410,
+    "Pimascovirales":     2732555,
+    "Algavirales":        2732524,
+    "Halopanivirales":    2732011,
+    "Mononegavirales":    11157,
+    "Rowavirales":        2732559,
+    "Picornavirales":     464095,
+    "Tubulavirales":      2732094,
+    "Crevaviridae":       2942963,
+    "Herelleviridae":     2560065,
+    "Intestiviridae":     2942964,
+    "Kyanoviridae":       2946160,
+    "Mimiviridae":        549779,
+    "Peduoviridae":       2946167,
+    "Schitoviridae":      2842329,
+    "Steigviridae":       2942965,
+    "Steitzviridae":      2842332,
+    "Straboviridae":      2946170,
+    "Suoliviridae":       2942966,
+    "Demerecviridae":     2731690,
+    "Autographiviridae":  2731643,
+    "Poxviridae":         10240,
+    "Arenbergviridae":    3044459,
+    "Carjivirus":         2948652,
+    "Burzaovirus":        2948645,
+    "Punavirus":          186789,
+    "Agtrevirus":         2169532,
+    "Betabaculovirus":    558017,
+    "Gihfavirus":         2842702,
+    "Casadabanvirus":     1623286,
+    "Purivirus":          3044798,
+    "Baikalvirus":        2733094,
+    "Pamexvirus":         1982355,
+    "Immutovirus":        2948764,
+}
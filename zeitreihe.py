@@ -1,10 +1,10 @@
 import os
-from matplotlib.patches import Patch
-import matplotlib.dates as mdates
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from util import FAMILY_COLOR_MAP, GENUS_COLOR_MAP, ORDER_COLOR_MAP, PLANT_NAME_MAP
+from cohort import (ARCHIVE_PATH, ingest_reports, iter_report_blocks, list_runs, load_metadata, load_taxa,
+                    plan_blocks, quarantined_reports, rank_rows, report_file, track_peak_memory, virus_reads)
+from replicates import FIELDS, pool_reports, replicate_groups, reports_from_pooled
+from timecube import load_cube
 
 # This script creates stacked area plots of virus taxonomic levels over time for wastewater treatment plants.
 # It can be configured by changing the constants below. 
@@ -17,9 +17,13 @@ REPORTS_TO_USE = []
 TAXON_LEVEL = "G"               # "O"=Order, "F"=Family, "G"=Genus, None=all levels
 MIN_REL_ABUNDANCE = 0.06
 META_CSV = "samples.csv"
+OUT_OF_CORE = False             # Reports blockweise aus dem Cache streamen statt alle zu laden
+MEMORY_BUDGET_MB = 256
+POOL_REPLICATES = False         # Technische Replikate auf Read-Ebene zusammenführen (replicates.py), nutzt den Cache
+TIME_CUBE = False               # Vorberechneten Zeitreihen-Würfel (timecube.py) verwenden
 # ============================================================
 
-def parse_kraken2_report(path, taxon_level):
+def parse_kraken2_report(path, taxon_level, run=None):
     df = pd.read_csv(
         path, sep="\t", header=None,
         names=["percent", "reads_clade", "reads_direct", "rank_code", "ncbi_taxid", "name"],
@@ -49,10 +53,10 @@ def parse_kraken2_report(path, taxon_level):
     df_level["rel"] = df_level["reads_clade"] / virus_reads_total
     df_level = pd.concat([df_level[["name", "rel"]], unassigned_row], ignore_index=True)
 
-    # Sample Label bestimmen
-    basename = os.path.basename(path)
-    run_id = basename.replace("_report.txt", "")
-    df_level["run"] = run_id
+    # Sample Label bestimmen (path kann auch ein Datei-Objekt aus dem Archiv sein)
+    if run is None:
+        run = os.path.basename(path).replace("_report.txt", "")
+    df_level["run"] = run
     return df_level[["run", "name", "rel"]]
 
 def load_sample_metadata(csv_path):
@@ -70,24 +74,17 @@ def load_sample_metadata(csv_path):
     return mapping
 
 def load_reports(input_folder, reports_to_use, taxon_level, sample_mapping, reports_to_skip=None):
-    all_files = sorted([f for f in os.listdir(input_folder) if f.endswith("_report.txt")])
-
-    if reports_to_skip:
-        all_files = [f for f in all_files if f not in reports_to_skip]
-
-    if reports_to_use:
-        selected = [f for f in all_files if f in reports_to_use]
-    else:
-        selected = all_files
+    # Auch Runs, deren Report nur noch im Archiv liegt (report_archive.py)
+    selected = list_runs(input_folder, reports_to_use, reports_to_skip)
 
     if not selected:
         raise RuntimeError("Keine passenden Reports gefunden!")
 
     dfs = []
-    for report in selected:
-        path = os.path.join(input_folder, report)
-        print(f"Lade {path}")
-        df_rel = parse_kraken2_report(path, taxon_level)
+    for run in selected:
+        path = report_file(run, input_folder)
+        print(f"Lade {path if isinstance(path, str) else f'{ARCHIVE_PATH}:{run}'}")
+        df_rel = parse_kraken2_report(path, taxon_level, run)
         # Metadaten hinzufügen
         meta = sample_mapping[df_rel["run"].iloc[0]]
         df_rel["DATE"] = meta["DATE"]
@@ -140,112 +137,134 @@ def prepare_time_series(df, plant, min_rel_abundance=MIN_REL_ABUNDANCE, top_n=No
 
     return pivot_plot[sorted_cols]
 
-def plot_all_plants(df):
-    plants = sorted(df["PLANT"].unique())
-    n = len(plants)
+def level_abundances(report, taxon_level):
+    """Relative Häufigkeiten eines gecachten Reports auf einem Level, plus 'Unassigned'"""
+    virus_reads_total = virus_reads(report)
+    if virus_reads_total == 0:
+        raise RuntimeError("Keine Virus-Reads im Report gefunden.")
 
-    fig, axes = plt.subplots(n, 1, figsize=(12, 3*n), sharex=True)
-    plt.subplots_adjust(hspace=0.4)
-    if n == 1:
-        axes = [axes]
+    level = rank_rows(report, taxon_level)
+    rel = (level["reads_clade"] / virus_reads_total).groupby(level["name"]).sum()
+    rel["Unassigned"] = (virus_reads_total - level["reads_clade"].sum()) / virus_reads_total
+    return rel
 
-    all_taxa = set()
+def pooled_blocks(runs, meta_csv=META_CSV, memory_budget_mb=MEMORY_BUDGET_MB):
+    """
+    Gepoolte Replikate blockweise (vertretender Run, Report mit Namen), wie iter_report_blocks. Gepoolt wird
+    einmal für die ganze Kohorte (gecacht in replicates.pool_reports); nur die DataFrames entstehen pro Block,
+    geplant mit plan_blocks nach der Größe der gepoolten Reports.
+    """
+    names = load_taxa()["name"]
+    pooled = pool_reports(replicate_groups(runs, load_metadata(meta_csv)))
+    row_bytes = sum(pooled[field].itemsize for field in FIELDS)
+    sizes = {run: {"nbytes": int(end - start) * row_bytes}
+             for run, start, end in zip(pooled["runs"], pooled["offsets"][:-1], pooled["offsets"][1:])}
 
-    for ax, plant in zip(axes, plants):
-        pivot_plot = prepare_time_series(df, plant)
-        if pivot_plot is None or pivot_plot.empty:
-            continue
+    for block in plan_blocks(list(pooled["runs"]), sizes, memory_budget_mb):
+        reports = reports_from_pooled(pooled, block)
+        yield [(run, report.assign(name=report["ncbi_taxid"].map(names))) for run, report in reports.items()]
 
-        all_taxa.update(pivot_plot.columns)
 
-        if TAXON_LEVEL == "O":
-            colors = [ORDER_COLOR_MAP.get(t, "#BBBBBB") for t in pivot_plot.columns]
-        elif TAXON_LEVEL == "F":
-            colors = [FAMILY_COLOR_MAP.get(t, "#BBBBBB") for t in pivot_plot.columns]
-        elif TAXON_LEVEL == "G":
-            colors = [GENUS_COLOR_MAP.get(t, "#BBBBBB") for t in pivot_plot.columns]
-        else:
-            colors = None
+def accumulate_time_series(runs, taxon_level, sample_mapping, memory_budget_mb=MEMORY_BUDGET_MB, pooled=False):
+    """
+    Streamt die Reports blockweise und sammelt pro Kläranlage und Datum nur Summen,
+    Anzahl Runs und das Maximum jedes Taxons. Der Speicher wächst damit mit der
+    Anzahl Datumswerte, nicht mit der Anzahl Taxon-Zeilen aller Reports.
+    Mit pooled=True wird pro Alias der gepoolte Report statt der einzelnen Replikate verwendet.
+    """
+    sums, counts, maxima = None, None, None
 
-        pivot_plot.plot.area(
-            ax=ax,
-            color= colors if colors else None,
-            legend=False
+    if pooled:
+        blocks = pooled_blocks(runs, memory_budget_mb=memory_budget_mb)
+    else:
+        blocks = iter_report_blocks(runs, memory_budget_mb=memory_budget_mb, with_names=True)
+    for block in blocks:
+        keys = [(sample_mapping[run]["PLANT"], sample_mapping[run]["DATE"]) for run, _ in block]
+        # Long-Format: (PLANT, DATE, name) → rel
+        block_rel = pd.concat(
+            [level_abundances(report, taxon_level) for _, report in block],
+            keys=keys, names=["PLANT", "DATE", "name"]
         )
 
-        ax.set_title(PLANT_NAME_MAP.get(plant, plant))
-        ax.xaxis.set_major_locator(mdates.MonthLocator(bymonth=[3,6,9,12], interval=1))
-        ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m"))
+        block_sums = block_rel.groupby(level=["PLANT", "DATE", "name"]).sum()
+        block_counts = pd.Series(1, index=pd.MultiIndex.from_tuples(keys, names=["PLANT", "DATE"])).groupby(level=[0, 1]).sum()
+        block_max = block_rel.groupby(level=["PLANT", "name"]).max()
 
-        ax.xaxis.set_minor_locator(mdates.MonthLocator())
+        if sums is None:
+            sums, counts, maxima = block_sums, block_counts, block_max
+        else:
+            sums = sums.add(block_sums, fill_value=0)
+            counts = counts.add(block_counts, fill_value=0)
+            maxima = pd.concat([maxima, block_max]).groupby(level=["PLANT", "name"]).max()
 
+    if sums is None:
+        raise RuntimeError("Keine passenden Reports gefunden!")
 
-    axes[int(n/2)].set_ylabel("Relative Abundance")
-    axes[-1].set_xlabel("Date")
+    return sums.unstack("name", fill_value=0), counts, maxima.unstack("name", fill_value=0)
 
-    ordered_taxa_O = ["Crassvirales", "Timlovirales", "Chitovirales", "Imitervirales","Herpesvirales", "Tubulavirales", "Lefavirales", "Bunyavirales","Pimascovirales", "Algavirales", "Halopanivirales","Mononegavirales", "Rowavirales", "Picornavirales","Other"]
+def prepare_time_series_from_aggregates(sums, counts, maxima, plant, min_rel_abundance=MIN_REL_ABUNDANCE):
+    """Wie prepare_time_series, aber aus den Aggregaten von accumulate_time_series"""
+    if plant not in counts.index.get_level_values("PLANT"):
+        print(f"⚠ Keine Daten für Kläranlage {plant}")
+        return
 
-    ordered_taxa_F = ["Intestiviridae","Suoliviridae","Peduoviridae","Crevaviridae","Herelleviridae","Kyanoviridae","Straboviridae","Schitoviridae","Steitzviridae","Steigviridae","Autographiviridae","Demerecviridae","Mimiviridae","Poxviridae","Arenbergviridae","Other"]
+    # Replikate mitteln
+    means = sums.loc[plant].div(counts.loc[plant], axis=0)
 
-    ordered_taxa_G = [ "Carjivirus", "Burzaovirus", "Punavirus", "Agtrevirus", "Betabaculovirus", "Gihfavirus", "Casadabanvirus", "Purivirus", "Baikalvirus", "Pamexvirus", "Immutovirus", "Other", "Unassigned" ]
+    unassigned = means.get("Unassigned", pd.Series(0, index=means.index))
+    remaining_cols = means.columns.drop("Unassigned", errors='ignore')
 
-    if TAXON_LEVEL == "O":
-        order = ordered_taxa_O
-    elif TAXON_LEVEL == "F":
-        order = ordered_taxa_F
-    elif TAXON_LEVEL == "G":
-        order = ordered_taxa_G
+    plant_max = maxima.loc[plant, remaining_cols]
+    taxa_to_keep = remaining_cols[plant_max >= min_rel_abundance]
+    taxa_to_other = remaining_cols.difference(taxa_to_keep)
 
-    legend_taxa = [t for t in order if t in all_taxa]
-    
-    add_global_legend(axes[-1], legend_taxa)
-    plt.show()
-
-
-def add_global_legend(ax, taxa):
-    if TAXON_LEVEL == "O":
-        color_map = ORDER_COLOR_MAP
-    elif TAXON_LEVEL == "F":
-        color_map = FAMILY_COLOR_MAP
-    elif TAXON_LEVEL == "G":
-        color_map = GENUS_COLOR_MAP
-
-    handles = [
-        Patch(facecolor=color_map.get(t, "#BBBBBB"), label=t)
-        for t in taxa
-    ]
-
-    ax.legend(
-        handles=handles,
-        title="Viral order",
-        loc="lower left",
-        bbox_to_anchor=(1.01, 3)
-    )
+    pivot_plot = means[taxa_to_keep].copy()
+    pivot_plot["Other"] = means[taxa_to_other].sum(axis=1)
+    pivot_plot["Unassigned"] = unassigned
 
-def plot_single_plant(pivot_plot, plant):
-    if TAXON_LEVEL == "O":
-        colors = [ORDER_COLOR_MAP.get(taxon, "#BBBBBB") for taxon in pivot_plot.columns]
-    elif TAXON_LEVEL == "F":
-        colors = [FAMILY_COLOR_MAP.get(taxon, "#BBBBBB") for taxon in pivot_plot.columns]
-    elif TAXON_LEVEL == "G":
-        colors = [GENUS_COLOR_MAP.get(taxon, "#BBBBBB") for taxon in pivot_plot.columns]
-    else:
-        colors = None
+    cols_no_other = [c for c in pivot_plot.columns if c != "Other" and c != "Unassigned"]
+    sorted_cols = pivot_plot[cols_no_other].sum(axis=0).sort_values(ascending=False).index.tolist()
+    sorted_cols.append("Other")
+    sorted_cols.append("Unassigned")
 
-    pivot_plot.plot.area(color=colors if colors else None)
-    plt.title(f"Relative Virus-Häufigkeiten über Zeit ({plant})")
-    plt.ylabel("Relative Häufigkeit")
-    plt.xlabel("Datum")
-    plt.legend(title="Order", bbox_to_anchor=(1.05,1), loc="upper left")
-    plt.tight_layout()
-    plt.show()
+    return pivot_plot[sorted_cols]
 
-if __name__ == "__main__":
+def load_time_series_out_of_core(input_folder, reports_to_use, taxon_level, sample_mapping, reports_to_skip=None,
+                                 memory_budget_mb=MEMORY_BUDGET_MB, pooled=False):
+    ingest_reports(input_folder)
+    runs = list_runs(input_folder, reports_to_use, reports_to_skip)
+    if not runs:
+        raise RuntimeError("Keine passenden Reports gefunden!")
+
+    sums, counts, maxima = accumulate_time_series(runs, taxon_level, sample_mapping, memory_budget_mb, pooled)
+    plants = sorted(counts.index.get_level_values("PLANT").unique())
+    return {plant: prepare_time_series_from_aggregates(sums, counts, maxima, plant) for plant in plants}
+
+
+def main():
     sample_mapping = load_sample_metadata(META_CSV)
-    df = load_reports(INPUT_FOLDER, REPORTS_TO_USE, TAXON_LEVEL, sample_mapping, reports_to_skip=["ERR2356165_report.txt", "ERR12510732_report.txt"])
+    reports_to_skip = quarantined_reports(INPUT_FOLDER)
+
+    if OUT_OF_CORE or POOL_REPLICATES:
+        with track_peak_memory("Zeitreihe (out-of-core)"):
+            series_by_plant = load_time_series_out_of_core(INPUT_FOLDER, REPORTS_TO_USE, TAXON_LEVEL, sample_mapping,
+                                                           reports_to_skip=reports_to_skip, pooled=POOL_REPLICATES)
+    elif TIME_CUBE:
+        ingest_reports(INPUT_FOLDER, verbose=False)
+        runs = list_runs(INPUT_FOLDER, REPORTS_TO_USE, reports_to_skip)
+        cube = load_cube(TAXON_LEVEL, runs, load_metadata(META_CSV))
+        series_by_plant = {plant: cube.series(plant, MIN_REL_ABUNDANCE) for plant in cube.plants}
+    else:
+        df = load_reports(INPUT_FOLDER, REPORTS_TO_USE, TAXON_LEVEL, sample_mapping, reports_to_skip=reports_to_skip)
+        series_by_plant = {plant: prepare_time_series(df, plant) for plant in sorted(df["PLANT"].unique())}
 
-    plot_all_plants(df)
+    from plotting import plot_all_plants
+    plot_all_plants(series_by_plant, TAXON_LEVEL)
 
     #for plant in df["PLANT"].unique():
     #    pivot_plot = prepare_time_series(df, plant)
-    #    plot_single_plant(pivot_plot, plant)
+    #    plot_single_plant(pivot_plot, plant, TAXON_LEVEL)
+
+
+if __name__ == "__main__":
+    main()